@@ -271,7 +271,8 @@ class BedrockAgentStack(Stack):
             effect=iam.Effect.ALLOW,
             resources=[
                 knowledge_base.attr_knowledge_base_arn],
-            actions=['bedrock:StartIngestionJob']))
+            actions=['bedrock:StartIngestionJob',
+                     'bedrock:ListIngestionJobs']))
         kb_sync_lambda = lambda_.Function(
             scope=self,
             id='SyncKB',
@@ -1,29 +1,81 @@
 import os
+import time
 import boto3
 import hashlib
+from datetime import datetime
+from botocore.exceptions import ClientError
 
+RUNNING_STATUSES = ['STARTING', 'IN_PROGRESS', 'STOPPING']
+# keep enough time to start the next job before the function times out
+MIN_REMAINING_MILLIS = 30000
+MAX_POLL_DELAY = 30
 
-def handler(event: dict, context: dict):
+
+def running_ingestion_job(client, kb_id: str, ds_id: str):
+    """Returns the summary of the ingestion job running on the data source, if any"""
+    jobs = client.list_ingestion_jobs(
+        knowledgeBaseId=kb_id,
+        dataSourceId=ds_id,
+        filters=[{'attribute': 'STATUS', 'operator': 'EQ',
+                  'values': RUNNING_STATUSES}],
+        sortBy={'attribute': 'STARTED_AT', 'order': 'DESCENDING'},
+        maxResults=1)['ingestionJobSummaries']
+    return jobs[0] if jobs else None
+
+
+def handler(event: dict, context):
     """
     This function handles the S3 events resulting from a new `PutObject`
-    event corresponding to a file upload
+    or `DeleteObject` event corresponding to a file upload or removal.
+
+    A data source runs one ingestion job at a time, and each job scans the
+    whole bucket, so a burst of uploads only needs the jobs that start after
+    its last change:
+    - if a job started after the change, it will ingest it: nothing to do
+    - if a job started before the change, wait for it, then start the next
+      job. All the invocations waiting for the same job use the same client
+      token, so they start a single job between them.
 
     Parameters
     ----------
     event : Event details
     context : Extra event context
     """
-    # Instruct the KB to start the ingestion job
     client = boto3.client('bedrock-agent')
+    kb_id = os.environ['KNOWLEDGE_BASE_ID']
+    ds_id = os.environ['DATA_SOURCE_ID']
+    changed_at = max(
+        datetime.fromisoformat(record['eventTime'].replace('Z', '+00:00'))
+        for record in event['Records'])
     client_token = hashlib.sha256(
         event['Records'][0]
         ['responseElements']['x-amz-request-id'].encode()).hexdigest()
-    client.start_ingestion_job(clientToken=client_token,
-                               dataSourceId=os.environ['DATA_SOURCE_ID'],
-                               knowledgeBaseId=os.environ['KNOWLEDGE_BASE_ID'],
-                               description='S3-originated data sync event')
-    # write the event details to the CloudWatch logs
-    print(event)
-    # print value of environment variable
-    print(os.environ['DATA_SOURCE_ID'])
-    print(os.environ['KNOWLEDGE_BASE_ID'])
+
+    delay = 2
+    while context.get_remaining_time_in_millis() > MIN_REMAINING_MILLIS:
+        running_job = running_ingestion_job(client, kb_id, ds_id)
+        if running_job is None:
+            try:
+                job = client.start_ingestion_job(
+                    clientToken=client_token,
+                    dataSourceId=ds_id,
+                    knowledgeBaseId=kb_id,
+                    description='S3-originated data sync event')['ingestionJob']
+                print(f"Started ingestion job {job['ingestionJobId']} for changes up to {changed_at}")
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConflictException':
+                    raise
+                # another invocation started a job in the meantime
+                continue
+        if running_job['startedAt'] >= changed_at:
+            print(f"Change at {changed_at} is covered by running ingestion job {running_job['ingestionJobId']}")
+            return
+        client_token = hashlib.sha256(
+            f"after-{running_job['ingestionJobId']}".encode()).hexdigest()
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_DELAY)
+
+    # let the asynchronous invocation be retried later
+    raise RuntimeError(
+        f"Ingestion job still running, could not start a job for changes up to {changed_at}")
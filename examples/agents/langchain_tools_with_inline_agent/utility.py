@@ -5,7 +5,10 @@ from rich.console import Console
 from rich.markdown import Markdown
 import boto3
 import copy
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 session = boto3.session.Session()
 region = session.region_name
@@ -54,23 +57,40 @@ def invoke_agent_with_roc(
     return agent_answer
 
 
-def process_roc(roc, tool_list):
+def run_tool(functionInvocationInput, tool_list):
+    current_tool = tool_list[functionInvocationInput["function"]]
+    parameters = dict()
+    for param in functionInvocationInput.get("parameters", []):
+        parameters[param["name"]] = param["value"]
+
+    if current_tool.get_name() == "read_file":
+        parameters = {"file_path": "document.txt"}
+
+    return json.dumps(current_tool.invoke(parameters))
+
+
+def process_roc(roc, tool_list, tool_timeout=60):
     inlineSessionState = {"returnControlInvocationResults": []}
     inlineSessionState["invocationId"] = roc["invocationId"]
 
-    for invocationInput in roc["invocationInputs"]:
+    # run all the tools requested by the agent at once, each one within tool_timeout seconds
+    executor = ThreadPoolExecutor(max_workers=max(len(roc["invocationInputs"]), 1))
+    futures = [
+        executor.submit(run_tool, invocationInput["functionInvocationInput"], tool_list)
+        for invocationInput in roc["invocationInputs"]
+    ]
+    deadline = time.time() + tool_timeout
+
+    for invocationInput, future in zip(roc["invocationInputs"], futures):
         functionInvocationInput = copy.deepcopy(
             invocationInput["functionInvocationInput"]
         )
-        current_tool = tool_list[functionInvocationInput["function"]]
-        parameters = dict()
-        for param in functionInvocationInput["parameters"]:
-            parameters[param["name"]] = param["value"]
-
-        if current_tool.get_name() == "read_file":
-            parameters = {"file_path": "document.txt"}
-
-        output = json.dumps(current_tool.invoke(parameters))
+        try:
+            output = future.result(timeout=max(deadline - time.time(), 0))
+        except FutureTimeoutError:
+            output = f"Error: {functionInvocationInput['function']} timed out after {tool_timeout}s"
+        except Exception as e:
+            output = f"Error: {functionInvocationInput['function']} failed: {e}"
 
         if "actionInvocationType" in functionInvocationInput:
             del functionInvocationInput["actionInvocationType"]
@@ -88,6 +108,8 @@ def process_roc(roc, tool_list):
         function_result = {"functionResult": functionInvocationInput}
         inlineSessionState["returnControlInvocationResults"].append(function_result)
 
+    # tools that timed out keep running in the background
+    executor.shutdown(wait=False)
     return inlineSessionState
 
 
@@ -1,14 +1,18 @@
 import os
+import sys
 import time
 import boto3
 import logging
 import pprint
 import json
 import uuid
+from pathlib import Path
 
 from knowledge_base import BedrockKnowledgeBase
 from agent_utility import create_agent_role_and_policies, create_lambda_role, delete_agent_roles_and_policies
 from agent_utility import create_dynamodb, create_lambda, clean_up_resources
+sys.path.append(str(Path(__file__).parent.parent.parent.parent))
+from src.utils.s3_sync import sync_directory_to_bucket
 
 #Clients
 s3_client = boto3.client('s3')
@@ -107,14 +111,7 @@ def create_kb():
         data_bucket_name=bucket_name
     )
 
-    def upload_directory(path, bucket_name):
-            for root,dirs,files in os.walk(path):
-                for file in files:
-                    file_to_upload = os.path.join(root,file)
-                    print(f"uploading file {file_to_upload} to {bucket_name}")
-                    s3_client.upload_file(file_to_upload,bucket_name,file)
-    
-    upload_directory("dataset", bucket_name)
+    sync_directory_to_bucket(s3_client, "dataset", bucket_name, verbose=True)
 
     # ensure that the kb is available
     time.sleep(30)
@@ -1,9 +1,13 @@
 import botocore
 import os
+import sys
 import time
 import boto3
 import logging
+from pathlib import Path
 from knowledge_base import BedrockKnowledgeBase
+sys.path.append(str(Path(__file__).parent.parent.parent.parent.parent.parent))
+from src.utils.s3_sync import sync_directory_to_bucket
 
 # Setup logging
 logging.basicConfig(format='[%(asctime)s] p%(process)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s', level=logging.INFO)
@@ -35,13 +39,8 @@ def create_knowledge_base(kb_name, kb_description, suffix):
     return knowledge_base_metadata, bucket_name
 
 def upload_directory(path, bucket_name, s3_client):
-    """Upload directory contents to S3"""
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            if not file.startswith('.DS_Store'):
-                file_to_upload = os.path.join(root, file)
-                logger.info(f"uploading file {file_to_upload} to {bucket_name}")
-                s3_client.upload_file(file_to_upload, bucket_name, file)
+    """Upload the new and changed files of a directory to S3, concurrently"""
+    return sync_directory_to_bucket(s3_client, path, bucket_name, verbose=True)
 
 def setup_knowledge_base(
     kb_name='inline-agent-kb',
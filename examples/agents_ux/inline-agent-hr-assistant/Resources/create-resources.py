@@ -10,6 +10,8 @@ import argparse
 # Add Resources directory to Python path
 RESOURCES_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(RESOURCES_DIR)
+sys.path.append(os.path.abspath(os.path.join(RESOURCES_DIR, "..", "..", "..", "..")))
+from src.utils.s3_sync import sync_directory_to_bucket
 
 # Configure logging
 logging.basicConfig(
@@ -95,19 +97,11 @@ def create_knowledge_base(region) -> Tuple[str, str]:
         # Upload files
         logger.info(f"Starting upload from {policy_docs_path} to S3 bucket {bucket_name}")
         
-        for root, dirs, files in os.walk(policy_docs_path):
-            for file in files:
-                if not file.startswith('.DS_Store'):
-                    file_path = os.path.join(root, file)
-                    try:
-                        s3_client.upload_file(
-                            file_path,
-                            bucket_name,
-                            f"data/{file}"
-                        )
-                        logger.info(f"Successfully uploaded {file_path}")
-                    except Exception as upload_error:
-                        logger.error(f"Failed to upload {file_path}: {str(upload_error)}")
+        sync_result = sync_directory_to_bucket(
+            s3_client, policy_docs_path, bucket_name, prefix="data/"
+        )
+        for file_key, upload_error in sync_result.failed.items():
+            logger.error(f"Failed to upload {file_key}: {upload_error}")
         
         logger.info("Completed uploading files to S3")
         
@@ -16,7 +16,6 @@ from src.utils.knowledge_base_helper import KnowledgeBasesForAmazonBedrock
 
 kb_helper = KnowledgeBasesForAmazonBedrock()
 
-s3_client = boto3.client('s3')
 sts_client = boto3.client('sts')
 
 logging.basicConfig(format='[%(asctime)s] p%(process)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s',
@@ -24,15 +23,6 @@ logging.basicConfig(format='[%(asctime)s] p%(process)s {%(filename)s:%(lineno)d}
 logger = logging.getLogger(__name__)
 
 
-def upload_directory(path, bucket_name):
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            file_to_upload = os.path.join(root, file)
-            dest_key = f"{path}/{file}"
-            print(f"uploading file {file_to_upload} to {bucket_name}")
-            s3_client.upload_file(file_to_upload, bucket_name, dest_key)
-
-
 def main(args):
     if args.clean_up == "true":
         Agent.set_force_recreate_default(True)
@@ -59,8 +49,12 @@ def main(args):
 
     if args.recreate_agents == "true":
         print("uploading dir")
-        upload_directory("mortgage_dataset", f"{bucket_name}")
+        sync_result = kb_helper.sync_directory_to_bucket(
+            "mortgage_dataset", bucket_name, prefix="mortgage_dataset/"
+        )
+        print(f"uploaded {len(sync_result.uploaded)} files, {len(sync_result.unchanged)} unchanged")
 
+        # ingest even when the bucket did not change: the KB may have just been recreated over it
         # ensure that the kb is available
         time.sleep(30)
         # sync knowledge base
@@ -22,10 +22,10 @@ def main(args):
         Agent.set_force_recreate_default(True)
         Agent.delete_by_name("portfolio_assistant", verbose=True)
     if args.clean_up == "true":
-        Agent.delete_by_name("portfolio_assistant", verbose=True)
-        Agent.delete_by_name("news_agent", verbose=True)
-        Agent.delete_by_name("stock_data_agent", verbose=True)
-        Agent.delete_by_name("analyst_agent", verbose=True)
+        Agent.delete_many(
+            ["portfolio_assistant", "news_agent", "stock_data_agent", "analyst_agent"],
+            verbose=True,
+        )
         response = bedrock_client.list_guardrails()
         for _gr in response["guardrails"]:
             if _gr["name"] == "no_bitcoin_guardrail":
@@ -129,22 +129,15 @@ def main(args):
         with open(agent_yaml_path, 'r') as file:
             agent_yaml_content = yaml.safe_load(file)
 
-        lead_market_analyst = Agent('lead_market_analyst', agent_yaml_content,
-                                    tools=[web_search_tool, set_value_for_key, get_key_value])
-        chief_strategist = Agent('chief_strategist', agent_yaml_content,
-                                    tools=[web_search_tool, set_value_for_key, get_key_value])
-        creative_director = Agent('creative_director', agent_yaml_content,
-                                  tools=[web_search_tool, set_value_for_key, get_key_value])
-        content_creator = Agent('content_writer', agent_yaml_content,
-                                  tools=[web_search_tool, set_value_for_key, get_key_value])
-        formatted_report_writer = Agent('formatted_report_writer', agent_yaml_content,
-                                  tools=[web_search_tool, set_value_for_key, get_key_value])
-        
-        print("\n\nCreating marketing_strategy_agent as a supervisor agent...\n\n")
-        startup_advisor = SupervisorAgent("startup_advisor", agent_yaml_content,
-                                    [lead_market_analyst, chief_strategist, 
-                                    content_creator, creative_director, 
-                                    formatted_report_writer], 
+        _tools = [web_search_tool, set_value_for_key, get_key_value]
+        _collaborator_names = ['lead_market_analyst', 'chief_strategist', 'content_writer',
+                               'creative_director', 'formatted_report_writer']
+
+        # the collaborators are created concurrently, then the supervisor once all of them are ready
+        print("\n\nCreating collaborators and marketing_strategy_agent as a supervisor agent...\n\n")
+        startup_advisor = SupervisorAgent.create_team("startup_advisor", agent_yaml_content,
+                                    {_name: lambda _name=_name: Agent(_name, agent_yaml_content, tools=_tools)
+                                     for _name in _collaborator_names},
                                     verbose=False)
         
         if args.recreate_agents == "false":
@@ -153,24 +153,26 @@ def main(args):
         with open(agent_yaml_path, "r") as file:
             yaml_agent_content = yaml.safe_load(file)
 
-        activity_finder = Agent(
-            "activity_finder",
-            yaml_agent_content,
-            tools=[web_search_tool, set_value_for_key, get_key_value, delete_table])
-
-        restaurant_scout = Agent(
-            "restaurant_scout",
-            yaml_agent_content,
-            tools=[web_search_tool, set_value_for_key, get_key_value, delete_table])
-
-        itinerary_compiler = Agent("itinerary_compiler", yaml_agent_content,
-            tools=[set_value_for_key, get_key_value, delete_table])
-
-        print("\n\nCreating supervisor agent...\n\n")
-        trip_planner = SupervisorAgent(
+        # the collaborators are independent of each other, so they are created concurrently,
+        # and the supervisor is created once all of them are ready.
+        print("\n\nCreating collaborators and supervisor agent...\n\n")
+        trip_planner = SupervisorAgent.create_team(
             "trip_planner",
             yaml_agent_content,
-            [activity_finder, restaurant_scout, itinerary_compiler],
+            {
+                "activity_finder": lambda: Agent(
+                    "activity_finder",
+                    yaml_agent_content,
+                    tools=[web_search_tool, set_value_for_key, get_key_value, delete_table]),
+                "restaurant_scout": lambda: Agent(
+                    "restaurant_scout",
+                    yaml_agent_content,
+                    tools=[web_search_tool, set_value_for_key, get_key_value, delete_table]),
+                "itinerary_compiler": lambda: Agent(
+                    "itinerary_compiler",
+                    yaml_agent_content,
+                    tools=[set_value_for_key, get_key_value, delete_table]),
+            },
         )
 
         if args.recreate_agents == "false":
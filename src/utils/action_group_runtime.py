@@ -0,0 +1,242 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module is the runtime of the AWS Lambda functions that implement agent action groups.
+
+An ActionGroupDispatcher holds any number of tools, plain Python functions, and routes each event of
+an agent to the tool it names with a dictionary lookup. The signature of every tool is inspected once,
+when it is registered at import time: each call only converts the event parameters to the types of
+the annotations (int, float, bool, str, list, dict) and formats the response the agent expects.
+Parameters missing from the event are taken from the session attributes, then from the defaults of
+the function. Tools can be coroutine functions: each call then runs in its own event loop.
+
+Both action group shapes are supported: function details (the event names a "function") and OpenAPI
+schemas (the event names an "apiPath" and an "httpMethod").
+
+This module only uses the standard library, so that it can be packaged next to a Lambda handler:
+create_lambda() adds it to the package of any handler that imports it.
+
+Example lambda_function.py:
+    from action_group_runtime import ActionGroupDispatcher
+
+    dispatcher = ActionGroupDispatcher()
+
+    @dispatcher.tool
+    def get_booking_details(booking_id: str) -> dict:
+        ...
+
+    @dispatcher.tool(name="create_booking")
+    def create(date: str, name: str, hour: str, num_guests: int) -> dict:
+        ...
+
+    lambda_handler = dispatcher.lambda_handler
+"""
+
+import asyncio
+import inspect
+import json
+from typing import Any, Callable, Dict, List, Tuple
+
+RUNTIME_MODULE = "action_group_runtime"
+MESSAGE_VERSION = "1.0"
+_TRUE_STRINGS = {"true", "yes", "1", "y", "t"}
+_FALSE_STRINGS = {"false", "no", "0", "n", "f"}
+_MISSING = inspect.Parameter.empty
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    _value = str(value).strip().lower()
+    if _value in _TRUE_STRINGS:
+        return True
+    if _value in _FALSE_STRINGS:
+        return False
+    raise ValueError(f"'{value}' is not a boolean")
+
+
+def _to_list(value: Any) -> list:
+    if isinstance(value, list):
+        return value
+    _value = str(value).strip()
+    if _value.startswith("["):
+        return json.loads(_value)
+    # agents also send arrays as comma separated values
+    return [_item.strip() for _item in _value.split(",") if _item.strip()]
+
+
+def _to_dict(value: Any) -> dict:
+    return value if isinstance(value, dict) else json.loads(value)
+
+
+def _to_str(value: Any) -> str:
+    return value if isinstance(value, str) else str(value)
+
+
+_CONVERTERS: Dict[Any, Callable[[Any], Any]] = {
+    str: _to_str,
+    int: lambda value: int(float(value)) if isinstance(value, str) else int(value),
+    float: float,
+    bool: _to_bool,
+    list: _to_list,
+    List: _to_list,
+    dict: _to_dict,
+    Dict: _to_dict,
+}
+
+
+def _converter(annotation: Any) -> Callable[[Any], Any]:
+    """Returns the function converting an event value to an annotated type, or None to keep it."""
+    if annotation is _MISSING or annotation is Any:
+        return None
+    _origin = getattr(annotation, "__origin__", None)
+    if _origin is not None:
+        annotation = _origin
+    return _CONVERTERS.get(annotation)
+
+
+class _Tool:
+    """A registered tool, with the conversion of each of its parameters precomputed."""
+
+    def __init__(self, func: Callable):
+        self.func = func
+        self.is_async = inspect.iscoroutinefunction(func)
+        self.params: List[Tuple[str, Callable, Any]] = []
+        self.accepts_kwargs = False
+        for _param in inspect.signature(func).parameters.values():
+            if _param.kind == inspect.Parameter.VAR_KEYWORD:
+                self.accepts_kwargs = True
+            elif _param.kind != inspect.Parameter.VAR_POSITIONAL:
+                self.params.append(
+                    (_param.name, _converter(_param.annotation), _param.default)
+                )
+
+
+class ActionGroupDispatcher:
+    """Routes the events of agent action groups to registered Python functions."""
+
+    def __init__(self):
+        self._tools: Dict[str, _Tool] = {}
+
+    def register(self, func: Callable, name: str = None) -> Callable:
+        """Registers a function as a tool, under its name unless another one is given.
+        For OpenAPI action groups, name it after the route, e.g. "GET /bookings/{booking_id}"
+        or just "/bookings/{booking_id}".
+
+        Returns:
+            Callable: the function, unchanged
+        """
+        self._tools[name or func.__name__] = _Tool(func)
+        return func
+
+    def tool(self, func: Callable = None, name: str = None):
+        """Decorator registering a function as a tool: @dispatcher.tool or @dispatcher.tool(name=...)"""
+        if func is None:
+            return lambda _func: self.register(_func, name)
+        return self.register(func, name)
+
+    @property
+    def tool_names(self) -> List[str]:
+        return list(self._tools)
+
+    @staticmethod
+    def _event_values(event: Dict) -> Dict[str, Any]:
+        _values = {
+            _param["name"]: _param.get("value")
+            for _param in event.get("parameters") or []
+        }
+        _content = (event.get("requestBody") or {}).get("content") or {}
+        for _media in _content.values():
+            for _prop in _media.get("properties") or []:
+                _values.setdefault(_prop["name"], _prop.get("value"))
+        return _values
+
+    def _route(self, event: Dict) -> Tuple[str, _Tool]:
+        if "apiPath" in event:
+            _method = event.get("httpMethod", "").upper()
+            _route = f"{_method} {event['apiPath']}"
+            _tool = self._tools.get(_route) or self._tools.get(event["apiPath"])
+            return _route, _tool
+        return event.get("function", ""), self._tools.get(event.get("function", ""))
+
+    def dispatch(self, event: Dict) -> Dict:
+        """Calls the tool named by an action group event.
+
+        Args:
+            event (Dict): the event sent by the agent
+
+        Returns:
+            Dict: the response expected by the agent, with the result of the tool as text
+        """
+        _route, _tool = self._route(event)
+        if _tool is None:
+            return self.response(event, f"Error: Function '{_route}' not recognized")
+
+        _values = self._event_values(event)
+        _session = event.get("sessionAttributes") or {}
+        _kwargs = {}
+        for _name, _convert, _default in _tool.params:
+            if _name in _values and _values[_name] is not None:
+                _value = _values.pop(_name)
+            elif _name in _session:
+                _value = _session[_name]
+            elif _default is not _MISSING:
+                continue
+            else:
+                return self.response(event, f"Missing required parameter: {_name}")
+            try:
+                _kwargs[_name] = _convert(_value) if _convert is not None else _value
+            except (TypeError, ValueError) as e:
+                return self.response(event, f"Invalid value for parameter {_name}: {e}")
+        if _tool.accepts_kwargs:
+            _kwargs.update(_values)
+
+        try:
+            _result = _tool.func(**_kwargs)
+            if _tool.is_async:
+                _result = asyncio.run(_result)
+        except Exception as e:
+            _error = f"Error executing {_route}: {e}"
+            print(_error)
+            return self.response(event, _error)
+        return self.response(event, _result)
+
+    @staticmethod
+    def response(event: Dict, result: Any) -> Dict:
+        """Formats the result of a tool as the response of an action group event."""
+        if isinstance(result, str):
+            _body = result
+        else:
+            try:
+                _body = json.dumps(result, default=str)
+            except (TypeError, ValueError):
+                _body = str(result)
+        _response = {
+            "messageVersion": event.get("messageVersion", MESSAGE_VERSION),
+            "response": {"actionGroup": event.get("actionGroup", "")},
+            "sessionAttributes": event.get("sessionAttributes") or {},
+            "promptSessionAttributes": event.get("promptSessionAttributes") or {},
+        }
+        if "apiPath" in event:
+            _response["response"].update(
+                {
+                    "apiPath": event["apiPath"],
+                    "httpMethod": event.get("httpMethod", ""),
+                    "httpStatusCode": 200,
+                    "responseBody": {"application/json": {"body": _body}},
+                }
+            )
+        else:
+            _response["response"].update(
+                {
+                    "function": event.get("function", ""),
+                    "functionResponse": {"responseBody": {"TEXT": {"body": _body}}},
+                }
+            )
+        return _response
+
+    def lambda_handler(self, event: Dict, context: Any) -> Dict:
+        """The Lambda handler: lambda_handler = dispatcher.lambda_handler"""
+        print(f"Received event: {event}")
+        return self.dispatch(event)
@@ -0,0 +1,168 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module contains the structured metrics of a single agent invocation.
+
+AgentsForAmazonBedrock.invoke() and invoke_inline_agent() fill an InvocationMetrics record when they
+are given a metrics_callback. It holds the overall latency, time to first token, request ID, retries,
+and every LLM call made by the agent and its collaborators, with its latency and token usage.
+The LLM calls are collected from the trace by the handlers of metrics_trace_dispatcher().
+"""
+
+import datetime
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List
+
+from .agent_trace import (
+    ORCHESTRATION_TRACE,
+    POST_PROCESSING_TRACE,
+    PRE_PROCESSING_TRACE,
+    ROUTING_CLASSIFIER_TRACE,
+    TraceContext,
+    TraceDispatcher,
+)
+
+
+@dataclass
+class LLMCallMetrics:
+    """One LLM call made while processing an invocation.
+
+    Attributes:
+        trace_type (str): trace that reported the call, e.g. "orchestrationTrace"
+        agent (str): collaborator name, or "agent-id/alias-id", of the agent that made the call
+        duration (float): seconds between the model invocation input and output traces, None if unknown
+        input_tokens (int): input tokens, None if the trace did not report usage
+        output_tokens (int): output tokens, None if the trace did not report usage
+    """
+
+    trace_type: str
+    agent: str
+    duration: float = None
+    input_tokens: int = None
+    output_tokens: int = None
+
+
+@dataclass
+class AgentUsage:
+    """LLM usage of one agent of the callerChain."""
+
+    llm_calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+@dataclass
+class InvocationMetrics:
+    """Metrics of one invokeAgent or invokeInlineAgent call.
+
+    Attributes:
+        agent_id (str): id of the invoked agent, None for inline agents
+        agent_alias_id (str): alias of the invoked agent, None for inline agents
+        session_id (str): session used for the invocation
+        request_id (str): request ID of the API call
+        retry_attempts (int): retries made by boto3 for the API call
+        http_status_code (int): HTTP status of the API call
+        start_time (datetime.datetime): when the invocation started
+        duration (float): seconds until the whole completion was read
+        time_to_first_token (float): seconds until the first chunk of the answer was received
+        routing_duration (float): seconds spent in the routing classifier, if it was used
+        llm_calls (List[LLMCallMetrics]): LLM calls, in the order they completed
+        usage_by_agent (Dict[str, AgentUsage]): LLM usage per agent of the callerChain
+        error (str): the error that ended the invocation, None if it succeeded
+        cache_hit (bool): whether the answer was served from the response cache, without calling the API
+    """
+
+    agent_id: str = None
+    agent_alias_id: str = None
+    session_id: str = None
+    request_id: str = None
+    retry_attempts: int = 0
+    http_status_code: int = None
+    start_time: datetime.datetime = field(default_factory=datetime.datetime.now)
+    duration: float = None
+    time_to_first_token: float = None
+    routing_duration: float = None
+    llm_calls: List[LLMCallMetrics] = field(default_factory=list)
+    usage_by_agent: Dict[str, AgentUsage] = field(default_factory=dict)
+    error: str = None
+    cache_hit: bool = False
+
+    @property
+    def total_llm_calls(self) -> int:
+        return len(self.llm_calls)
+
+    @property
+    def total_input_tokens(self) -> int:
+        return sum(_usage.input_tokens for _usage in self.usage_by_agent.values())
+
+    @property
+    def total_output_tokens(self) -> int:
+        return sum(_usage.output_tokens for _usage in self.usage_by_agent.values())
+
+    def to_dict(self) -> Dict:
+        """Returns the metrics as a JSON-serializable dict, e.g. to send to a metrics pipeline."""
+        _metrics = asdict(self)
+        _metrics["start_time"] = self.start_time.isoformat()
+        _metrics["total_llm_calls"] = self.total_llm_calls
+        _metrics["total_input_tokens"] = self.total_input_tokens
+        _metrics["total_output_tokens"] = self.total_output_tokens
+        return _metrics
+
+
+def metrics_trace_dispatcher(metrics: InvocationMetrics) -> TraceDispatcher:
+    """Returns a dispatcher whose handlers record the LLM calls found in the trace into metrics."""
+    _dispatcher = TraceDispatcher()
+    _started = {}
+    _invoked_agent = (
+        f"{metrics.agent_id}/{metrics.agent_alias_id}"
+        if metrics.agent_id is not None
+        else "inline-agent"
+    )
+
+    def _make_handler(trace_type: str):
+        def _record_llm_call(trace_part: Dict, context: TraceContext) -> None:
+            _agent = context.caller_alias_id or _invoked_agent
+            if context.agent_names:
+                _agent = context.agent_names.get(_agent, _agent)
+
+            if "modelInvocationInput" in trace_part:
+                _started[(trace_type, _agent)] = time.monotonic()
+
+            if "modelInvocationOutput" in trace_part:
+                _call = LLMCallMetrics(trace_type, _agent)
+                _start = _started.pop((trace_type, _agent), None)
+                if _start is not None:
+                    _call.duration = time.monotonic() - _start
+                _usage = (
+                    trace_part["modelInvocationOutput"].get("metadata", {}).get("usage")
+                )
+                if _usage is not None:
+                    _call.input_tokens = _usage["inputTokens"]
+                    _call.output_tokens = _usage["outputTokens"]
+                metrics.llm_calls.append(_call)
+
+                _agent_usage = metrics.usage_by_agent.setdefault(_agent, AgentUsage())
+                _agent_usage.llm_calls += 1
+                _agent_usage.input_tokens += _call.input_tokens or 0
+                _agent_usage.output_tokens += _call.output_tokens or 0
+
+                if (
+                    trace_type == ROUTING_CLASSIFIER_TRACE
+                    and _call.duration is not None
+                ):
+                    metrics.routing_duration = (
+                        metrics.routing_duration or 0
+                    ) + _call.duration
+
+        return _record_llm_call
+
+    for _trace_type in [
+        ROUTING_CLASSIFIER_TRACE,
+        ORCHESTRATION_TRACE,
+        PRE_PROCESSING_TRACE,
+        POST_PROCESSING_TRACE,
+    ]:
+        _dispatcher.subscribe(_trace_type, _make_handler(_trace_type))
+    return _dispatcher
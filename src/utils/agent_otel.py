@@ -0,0 +1,381 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module turns the trace of an Amazon Bedrock agent invocation into OpenTelemetry spans.
+
+AgentTraceSpans.invocation() opens one span for the invocation and yields a TraceDispatcher to pass
+to invoke(). Its handlers follow the callerChain of every trace event, so that each collaborator
+gets its own span nested under the supervisor call that invoked it, and each LLM call, action
+group, knowledge base lookup and code interpreter run gets a span under the agent that made it.
+Spans carry the model, tool name, token usage and latency as attributes.
+
+OpenTelemetry is optional: install opentelemetry-api to use this module, and opentelemetry-sdk with
+opentelemetry-exporter-otlp to export the spans with configure_otlp_tracing().
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from .agent_trace import (
+    ANY_TRACE,
+    FAILURE_TRACE,
+    GUARDRAIL_TRACE,
+    ORCHESTRATION_TRACE,
+    POST_PROCESSING_TRACE,
+    PRE_PROCESSING_TRACE,
+    ROUTING_CLASSIFIER_TRACE,
+    TraceContext,
+    TraceDispatcher,
+    routing_classification,
+)
+
+try:
+    from opentelemetry import trace as otel_trace
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:
+    otel_trace = None
+
+OTEL_AVAILABLE = otel_trace is not None
+TRACER_NAME = "src.utils.agent_otel"
+DEFAULT_OTLP_ENDPOINT = "http://localhost:4317"
+
+# span attributes, following the OpenTelemetry semantic conventions for generative AI where they exist
+ATTR_SYSTEM = "gen_ai.system"
+ATTR_OPERATION = "gen_ai.operation.name"
+ATTR_AGENT_ID = "gen_ai.agent.id"
+ATTR_AGENT_NAME = "gen_ai.agent.name"
+ATTR_MODEL = "gen_ai.request.model"
+ATTR_INPUT_TOKENS = "gen_ai.usage.input_tokens"
+ATTR_OUTPUT_TOKENS = "gen_ai.usage.output_tokens"
+ATTR_TOOL_NAME = "gen_ai.tool.name"
+ATTR_SESSION_ID = "session.id"
+ATTR_TRACE_TYPE = "bedrock.agent.trace_type"
+ATTR_ACTION_GROUP = "bedrock.agent.action_group"
+ATTR_KNOWLEDGE_BASE_ID = "bedrock.agent.knowledge_base_id"
+ATTR_ROUTING_CHOICE = "bedrock.agent.routing_choice"
+ATTR_LATENCY_MS = "latency_ms"
+
+_TOOL_INPUTS = {
+    "actionGroupInvocationInput": "actionGroupInvocationOutput",
+    "knowledgeBaseLookupInput": "knowledgeBaseLookupOutput",
+    "codeInterpreterInvocationInput": "codeInterpreterInvocationOutput",
+    "agentCollaboratorInvocationInput": "agentCollaboratorInvocationOutput",
+}
+
+
+class AgentTraceSpans:
+    """Records the trace of agent invocations as nested OpenTelemetry spans.
+
+    Example:
+        spans = AgentTraceSpans()
+        with spans.invocation("trip-planner", session_id=session_id) as trace_dispatcher:
+            supervisor.invoke(input_text, session_id=session_id, trace_dispatcher=trace_dispatcher)
+    """
+
+    def __init__(self, tracer=None):
+        """Args:
+        tracer (opentelemetry.trace.Tracer, optional): tracer used to create the spans. Defaults to
+        a tracer of the global tracer provider, e.g. the one set by configure_otlp_tracing().
+        """
+        if not OTEL_AVAILABLE:
+            raise ImportError(
+                "AgentTraceSpans requires OpenTelemetry: pip install opentelemetry-api"
+            )
+        self._tracer = tracer or otel_trace.get_tracer(TRACER_NAME)
+
+    @contextmanager
+    def invocation(
+        self,
+        agent_name: str,
+        agent_id: str = None,
+        session_id: str = None,
+    ) -> Iterator[TraceDispatcher]:
+        """Opens the span of one invocation, and yields the dispatcher that records its trace
+        as child spans. All spans still open when the block exits are ended with it.
+
+        Args:
+            agent_name (str): name of the invoked agent, used to name the span
+            agent_id (str, optional): id of the invoked agent
+            session_id (str, optional): session of the invocation
+
+        Yields:
+            TraceDispatcher: pass it as trace_dispatcher to invoke() or invoke_inline_agent()
+        """
+        _attributes = {
+            ATTR_SYSTEM: "aws.bedrock",
+            ATTR_OPERATION: "invoke_agent",
+            ATTR_AGENT_NAME: agent_name,
+        }
+        if agent_id is not None:
+            _attributes[ATTR_AGENT_ID] = agent_id
+        if session_id is not None:
+            _attributes[ATTR_SESSION_ID] = session_id
+
+        _root = self._tracer.start_span(
+            f"invoke_agent {agent_name}", attributes=_attributes
+        )
+        _recorder = _InvocationSpans(self._tracer, _root)
+        try:
+            yield _recorder.dispatcher()
+        except Exception as e:
+            _root.record_exception(e)
+            _root.set_status(Status(StatusCode.ERROR, str(e)))
+            raise
+        finally:
+            _recorder.end_all()
+            _root.end()
+
+
+class _InvocationSpans:
+    """Spans of a single invocation. Agent spans are keyed by the callerChain that reached the
+    agent, as a tuple of "agent-id/alias-id"; the invoked agent itself is the root span.
+    """
+
+    def __init__(self, tracer, root):
+        self._tracer = tracer
+        self._root = root
+        self._chain: Tuple[str, ...] = ()
+        self._agent_spans: Dict[Tuple[str, ...], object] = {}
+        self._llm_spans: Dict[Tuple, Tuple[object, float]] = {}
+        # (span, start time, target), target being the "agent-id/alias-id" of an invoked collaborator
+        self._tool_spans: Dict[Tuple, List[Tuple[object, float, str]]] = {}
+
+    def dispatcher(self) -> TraceDispatcher:
+        _dispatcher = TraceDispatcher()
+        for _trace_type in [
+            ROUTING_CLASSIFIER_TRACE,
+            PRE_PROCESSING_TRACE,
+            POST_PROCESSING_TRACE,
+        ]:
+            _dispatcher.subscribe(_trace_type, self._llm_handler(_trace_type))
+        _dispatcher.subscribe(ORCHESTRATION_TRACE, self._on_orchestration)
+        _dispatcher.subscribe(GUARDRAIL_TRACE, self._on_guardrail)
+        _dispatcher.subscribe(FAILURE_TRACE, self._on_failure)
+        # callerChain is only available on the whole trace event
+        _dispatcher.subscribe(ANY_TRACE, self._on_trace_event)
+        return _dispatcher
+
+    def _start_span(self, name: str, parent, attributes: Dict):
+        return self._tracer.start_span(
+            name,
+            context=otel_trace.set_span_in_context(parent),
+            attributes=attributes,
+        )
+
+    @staticmethod
+    def _end_span(span, started: float) -> None:
+        span.set_attribute(ATTR_LATENCY_MS, (time.monotonic() - started) * 1000)
+        span.end()
+
+    def _on_trace_event(self, trace_event: Dict, context: TraceContext) -> None:
+        self._chain = tuple(
+            _caller["agentAliasArn"].split("/", 1)[1]
+            for _caller in trace_event.get("callerChain", [])
+        )
+        self._agent_span(self._chain, context)
+
+    def _agent_span(self, chain: Tuple[str, ...], context: TraceContext):
+        if len(chain) <= 1:
+            return self._root
+        if chain not in self._agent_spans:
+            # a collaborator runs under the span of the supervisor call that invoked it
+            _parent_chain = chain[:-1]
+            _alias_id = chain[-1]
+            _parent = next(
+                (
+                    _span
+                    for _span, _, _target in self._tool_spans.get(
+                        (_parent_chain, "agentCollaboratorInvocationInput"), []
+                    )
+                    if _target == _alias_id
+                ),
+                None,
+            ) or self._agent_span(_parent_chain, context)
+            _name = (context.agent_names or {}).get(_alias_id, _alias_id)
+            self._agent_spans[chain] = self._start_span(
+                f"invoke_agent {_name}",
+                _parent,
+                {
+                    ATTR_SYSTEM: "aws.bedrock",
+                    ATTR_OPERATION: "invoke_agent",
+                    ATTR_AGENT_ID: _alias_id,
+                    ATTR_AGENT_NAME: _name,
+                },
+            )
+        return self._agent_spans[chain]
+
+    def _end_agent_spans(self, chain: Tuple[str, ...]) -> None:
+        """Ends the span of a collaborator, and of any collaborator it invoked in turn."""
+        for _chain in [_c for _c in self._agent_spans if _c[: len(chain)] == chain]:
+            self._agent_spans.pop(_chain).end()
+
+    def _record_llm_call(self, trace_type: str, trace_part: Dict, context) -> None:
+        _key = (trace_type, self._chain)
+        if "modelInvocationInput" in trace_part:
+            _input = trace_part["modelInvocationInput"]
+            _attributes = {
+                ATTR_SYSTEM: "aws.bedrock",
+                ATTR_OPERATION: "chat",
+                ATTR_TRACE_TYPE: trace_type,
+            }
+            if "foundationModel" in _input:
+                _attributes[ATTR_MODEL] = _input["foundationModel"]
+            _span = self._start_span(
+                f"chat {_input.get('foundationModel', trace_type)}",
+                self._agent_span(self._chain, context),
+                _attributes,
+            )
+            self._llm_spans[_key] = (_span, time.monotonic())
+
+        if "modelInvocationOutput" in trace_part:
+            _output = trace_part["modelInvocationOutput"]
+            if _key in self._llm_spans:
+                _span, _started = self._llm_spans.pop(_key)
+            else:
+                # the output was traced without its input: record the call with no duration
+                _span = self._start_span(
+                    f"chat {trace_type}",
+                    self._agent_span(self._chain, context),
+                    {ATTR_OPERATION: "chat", ATTR_TRACE_TYPE: trace_type},
+                )
+                _started = time.monotonic()
+            _usage = _output.get("metadata", {}).get("usage")
+            if _usage is not None:
+                _span.set_attribute(ATTR_INPUT_TOKENS, _usage["inputTokens"])
+                _span.set_attribute(ATTR_OUTPUT_TOKENS, _usage["outputTokens"])
+            if trace_type == ROUTING_CLASSIFIER_TRACE and "rawResponse" in _output:
+                _span.set_attribute(
+                    ATTR_ROUTING_CHOICE, routing_classification(trace_part)
+                )
+            self._end_span(_span, _started)
+
+    def _llm_handler(self, trace_type: str):
+        def _on_llm_trace(trace_part: Dict, context: TraceContext) -> None:
+            self._record_llm_call(trace_type, trace_part, context)
+
+        return _on_llm_trace
+
+    def _on_orchestration(self, orch: Dict, context: TraceContext) -> None:
+        self._record_llm_call(ORCHESTRATION_TRACE, orch, context)
+        if "invocationInput" in orch:
+            self._start_tool(orch["invocationInput"], context)
+        if "observation" in orch:
+            self._end_tool(orch["observation"])
+
+    def _start_tool(self, invocation_input: Dict, context: TraceContext) -> None:
+        for _input_type in _TOOL_INPUTS:
+            if _input_type not in invocation_input:
+                continue
+            _input = invocation_input[_input_type]
+            _attributes = {ATTR_OPERATION: "execute_tool"}
+            _target = None
+            if _input_type == "actionGroupInvocationInput":
+                _tool = _input.get("function") or _input.get("apiPath", "")
+                _attributes[ATTR_ACTION_GROUP] = _input.get("actionGroupName", "")
+            elif _input_type == "knowledgeBaseLookupInput":
+                _tool = "knowledge_base"
+                _attributes[ATTR_KNOWLEDGE_BASE_ID] = _input["knowledgeBaseId"]
+            elif _input_type == "codeInterpreterInvocationInput":
+                _tool = "code_interpreter"
+            else:
+                _tool = _input["agentCollaboratorName"]
+                _target = _input["agentCollaboratorAliasArn"].split("/", 1)[1]
+                _attributes[ATTR_OPERATION] = "invoke_collaborator"
+            _attributes[ATTR_TOOL_NAME] = _tool
+            _span = self._start_span(
+                f"{_attributes[ATTR_OPERATION]} {_tool}",
+                self._agent_span(self._chain, context),
+                _attributes,
+            )
+            # parallel calls of one kind are traced one at a time, and complete in order
+            self._tool_spans.setdefault((self._chain, _input_type), []).append(
+                (_span, time.monotonic(), _target)
+            )
+
+    def _end_tool(self, observation: Dict) -> None:
+        for _input_type, _output_type in _TOOL_INPUTS.items():
+            if _output_type not in observation:
+                continue
+            _calls = self._tool_spans.get((self._chain, _input_type))
+            if not _calls:
+                continue
+            _index = 0
+            if _output_type == "agentCollaboratorInvocationOutput":
+                _collab_arn = observation[_output_type].get("agentCollaboratorAliasArn")
+                if _collab_arn:
+                    _target = _collab_arn.split("/", 1)[1]
+                    self._end_agent_spans(self._chain + (_target,))
+                    _index = next(
+                        (_i for _i, _call in enumerate(_calls) if _call[2] == _target),
+                        0,
+                    )
+            _span, _started, _ = _calls.pop(_index)
+            if _output_type == "codeInterpreterInvocationOutput":
+                _error = observation[_output_type].get("executionError")
+                if _error:
+                    _span.set_status(Status(StatusCode.ERROR, _error))
+            self._end_span(_span, _started)
+
+    def _on_guardrail(self, guardrail: Dict, context: TraceContext) -> None:
+        self._agent_span(self._chain, context).add_event(
+            "guardrail", {"action": guardrail.get("action", "")}
+        )
+
+    def _on_failure(self, failure: Dict, context: TraceContext) -> None:
+        self._agent_span(self._chain, context).set_status(
+            Status(StatusCode.ERROR, failure.get("failureReason", ""))
+        )
+
+    def end_all(self) -> None:
+        """Ends the spans left open by a trace that was cut short."""
+        for _span, _ in self._llm_spans.values():
+            _span.end()
+        for _calls in self._tool_spans.values():
+            for _span, _, _ in _calls:
+                _span.end()
+        for _chain in sorted(self._agent_spans, key=len, reverse=True):
+            self._agent_spans[_chain].end()
+        self._llm_spans.clear()
+        self._tool_spans.clear()
+        self._agent_spans.clear()
+
+
+def configure_otlp_tracing(
+    service_name: str = "bedrock-agents",
+    endpoint: str = DEFAULT_OTLP_ENDPOINT,
+    set_global: bool = True,
+):
+    """Sets up a tracer provider that exports spans to an OTLP collector over gRPC, for example
+    a local OpenTelemetry collector or Jaeger listening on the default port. An http:// endpoint
+    is reached without TLS.
+
+    Args:
+        service_name (str, optional): service.name resource attribute of the spans
+        endpoint (str, optional): OTLP gRPC endpoint. Defaults to DEFAULT_OTLP_ENDPOINT.
+        set_global (bool, optional): whether to make it the global tracer provider. Defaults to True.
+
+    Returns:
+        opentelemetry.sdk.trace.TracerProvider: the provider. Call its shutdown() before exiting
+        to flush the spans that are still buffered.
+    """
+    try:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+            OTLPSpanExporter,
+        )
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        raise ImportError(
+            "OTLP export requires: pip install opentelemetry-sdk opentelemetry-exporter-otlp"
+        ) from e
+
+    _provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    _provider.add_span_processor(
+        BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint))
+    )
+    if set_global:
+        otel_trace.set_tracer_provider(_provider)
+    return _provider
@@ -0,0 +1,477 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module contains the trace dispatcher used by AgentsForAmazonBedrock.invoke() and invoke_inline_agent().
+
+Trace events returned by invokeAgent carry exactly one trace part, keyed by its type
+(routingClassifierTrace, orchestrationTrace, preProcessingTrace, postProcessingTrace, guardrailTrace,
+failureTrace). A TraceDispatcher routes each part only to the handlers subscribed to that type, so
+callers that only need, for example, token counts pay nothing for the rest of the trace. A
+dispatcher without handlers is never called at all.
+
+The console output printed by invoke() when enable_trace=True is implemented by the handlers
+returned by console_trace_dispatcher().
+"""
+
+import datetime
+import json
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from termcolor import colored
+from rich.console import Console
+from rich.markdown import Markdown
+
+UNDECIDABLE_CLASSIFICATION = "undecidable"
+TRACE_TRUNCATION_LENGTH = 300
+
+ROUTING_CLASSIFIER_TRACE = "routingClassifierTrace"
+ORCHESTRATION_TRACE = "orchestrationTrace"
+PRE_PROCESSING_TRACE = "preProcessingTrace"
+POST_PROCESSING_TRACE = "postProcessingTrace"
+GUARDRAIL_TRACE = "guardrailTrace"
+FAILURE_TRACE = "failureTrace"
+ANY_TRACE = "*"  # handlers subscribed to ANY_TRACE receive the whole trace event
+TRACE_TYPES = [
+    ROUTING_CLASSIFIER_TRACE,
+    ORCHESTRATION_TRACE,
+    PRE_PROCESSING_TRACE,
+    POST_PROCESSING_TRACE,
+    GUARDRAIL_TRACE,
+    FAILURE_TRACE,
+]
+
+INLINE_AGENT_NAME = "<not yet supported with inline>"
+
+
+@dataclass
+class TraceContext:
+    """State shared by the trace handlers over a single invocation.
+
+    agent_names maps "agent-id/alias-id" to collaborator names, to name the sub-agent found in
+    the callerChain of a trace event. Leave it as None when names are not available (inline agents).
+    caller_alias_id is the "agent-id/alias-id" of the agent that emitted the current trace event,
+    the last one of its callerChain.
+    """
+
+    trace_level: str = "core"
+    agent_names: Dict[str, str] = None
+    orch_step: int = 0
+    sub_step: int = 0
+    sub_agent_name: str = "<collab-name-not-yet-provided>"
+    sub_agent_alias_id: str = None
+    caller_alias_id: str = None
+    total_in_tokens: int = 0
+    total_out_tokens: int = 0
+    total_llm_calls: int = 0
+    time_before_orchestration: datetime.datetime = field(
+        default_factory=datetime.datetime.now
+    )
+    time_before_routing: datetime.datetime = None
+
+    def record_llm_call(
+        self, model_invocation_output: Dict
+    ) -> Optional[Tuple[int, int]]:
+        """Counts one LLM call and adds its token usage, if the trace reported it.
+
+        Returns:
+            Tuple[int, int]: input and output tokens, or None if no usage metadata was returned
+        """
+        self.total_llm_calls += 1
+        if "metadata" not in model_invocation_output:
+            return None
+        _usage = model_invocation_output["metadata"]["usage"]
+        self.total_in_tokens += _usage["inputTokens"]
+        self.total_out_tokens += _usage["outputTokens"]
+        return _usage["inputTokens"], _usage["outputTokens"]
+
+
+def routing_classification(route: Dict) -> str:
+    """Returns the collaborator name chosen by the routing classifier. The raw model
+    response is only parsed here, when a handler actually asks for it."""
+    _raw_resp = json.loads(route["modelInvocationOutput"]["rawResponse"]["content"])
+    return _raw_resp["content"][0]["text"].replace("<a>", "").replace("</a>", "")
+
+
+class TraceDispatcher:
+    """Routes trace events to the handlers subscribed to their trace type.
+
+    A handler is called with the trace part of its type (e.g. the content of orchestrationTrace)
+    and the TraceContext of the invocation. Handlers subscribed to ANY_TRACE are called first,
+    with the whole trace event.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable]] = {}
+
+    def subscribe(self, trace_type: str, handler: Callable[[Dict, TraceContext], None]):
+        """Registers a handler for one of TRACE_TYPES, or for ANY_TRACE."""
+        if trace_type != ANY_TRACE and trace_type not in TRACE_TYPES:
+            raise ValueError(
+                f"Unknown trace type '{trace_type}', expected one of {TRACE_TYPES}"
+            )
+        self._handlers.setdefault(trace_type, []).append(handler)
+        return handler
+
+    def unsubscribe(self, trace_type: str, handler: Callable) -> None:
+        """Removes a handler registered with subscribe()."""
+        self._handlers[trace_type].remove(handler)
+        if not self._handlers[trace_type]:
+            del self._handlers[trace_type]
+
+    def __bool__(self) -> bool:
+        return bool(self._handlers)
+
+    def dispatch(self, trace_event: Dict, context: TraceContext) -> None:
+        """Calls the handlers subscribed to the trace type of a trace event."""
+        _caller_chain = trace_event.get("callerChain")
+        if _caller_chain:
+            context.caller_alias_id = _caller_chain[-1]["agentAliasArn"].split("/", 1)[
+                1
+            ]
+        else:
+            context.caller_alias_id = None
+        if _caller_chain and len(_caller_chain) > 1:
+            # get sub agent id by grabbing all text following the first '/' character
+            context.sub_agent_alias_id = _caller_chain[1]["agentAliasArn"].split(
+                "/", 1
+            )[1]
+            if context.agent_names is None:
+                context.sub_agent_name = INLINE_AGENT_NAME
+            else:
+                context.sub_agent_name = context.agent_names.get(
+                    context.sub_agent_alias_id, context.sub_agent_name
+                )
+        else:
+            context.sub_agent_alias_id = None
+
+        for _handler in self._handlers.get(ANY_TRACE, ()):
+            _handler(trace_event, context)
+        for _trace_type, _trace_part in trace_event.get("trace", {}).items():
+            for _handler in self._handlers.get(_trace_type, ()):
+                _handler(_trace_part, context)
+
+
+def _print_trace_event(trace_event: Dict, context: TraceContext) -> None:
+    if context.trace_level == "all":
+        print("---")
+        print(json.dumps(trace_event, indent=2))
+
+
+def _print_routing_trace(route: Dict, context: TraceContext) -> None:
+    if "modelInvocationInput" in route:
+        context.orch_step += 1
+        print(colored(f"---- Step {context.orch_step} ----", "green"))
+        context.time_before_routing = datetime.datetime.now()
+        print(
+            colored(
+                "Classifying request to immediately route to one collaborator if possible.",
+                "blue",
+            )
+        )
+
+    if "modelInvocationOutput" in route:
+        _usage = context.record_llm_call(route["modelInvocationOutput"])
+        _route_duration = datetime.datetime.now() - (
+            context.time_before_routing or context.time_before_orchestration
+        )
+        _classification = routing_classification(route)
+
+        if _classification == UNDECIDABLE_CLASSIFICATION:
+            print(
+                colored(
+                    f"Routing classifier did not find a matching collaborator. Reverting to 'SUPERVISOR' mode.",
+                    "magenta",
+                )
+            )
+        elif _classification == "keep_previous_agent":
+            print(
+                colored(
+                    f"Continuing conversation with previous collaborator.",
+                    "magenta",
+                )
+            )
+        else:
+            context.sub_agent_name = _classification
+            print(
+                colored(
+                    f"Routing classifier chose collaborator: '{_classification}'",
+                    "magenta",
+                )
+            )
+        if _usage is not None:
+            _in_tokens, _out_tokens = _usage
+            print(
+                colored(
+                    f"Routing classifier took {_route_duration.total_seconds():,.1f}s, using {_in_tokens+_out_tokens} tokens (in: {_in_tokens}, out: {_out_tokens}).\n",
+                    "yellow",
+                )
+            )
+        else:
+            print(
+                colored(
+                    f"Routing classifier took {_route_duration.total_seconds():,.1f}s [token count metadata was not returned].\n",
+                    "yellow",
+                )
+            )
+
+
+def _print_failure_trace(failure: Dict, context: TraceContext) -> None:
+    print(colored(f"Agent error: {failure['failureReason']}", "red"))
+
+
+def _print_invocation_input(_input: Dict, context: TraceContext) -> None:
+    # NOTE: when agent determines invocations should happen in parallel
+    # the trace objects for invocation input still come back one at a time.
+    if "actionGroupInvocationInput" in _input:
+        _ag_input = _input["actionGroupInvocationInput"]
+        if context.trace_level == "outline":
+            print(colored(f"Using tool: {_ag_input['function']}", "magenta"))
+        elif "function" not in _ag_input:
+            print(
+                colored(
+                    f"EXPECTING to capture 'Using tool', but 'function' not found\n{_ag_input}",
+                    "red",
+                )
+            )
+        else:
+            print(
+                colored(
+                    f"Using tool: {_ag_input['function']} with these inputs:",
+                    "magenta",
+                )
+            )
+            if "parameters" in _ag_input:
+                if (len(_ag_input["parameters"]) == 1) and (
+                    _ag_input["parameters"][0]["name"] == "input_text"
+                ):
+                    print(colored(f"{_ag_input['parameters'][0]['value']}", "magenta"))
+                else:
+                    print(colored(f"{_ag_input['parameters']}\n", "magenta"))
+            else:
+                print(colored(f"    no input parameters being sent\n", "magenta"))
+
+    elif "agentCollaboratorInvocationInput" in _input:
+        _collab_input = _input["agentCollaboratorInvocationInput"]
+        _collab_name = _collab_input["agentCollaboratorName"]
+        context.sub_agent_name = _collab_name
+        _collab_input_text = _collab_input["input"]["text"]
+        _collab_ids = _collab_input["agentCollaboratorAliasArn"].split("/", 1)[1]
+
+        if context.trace_level == "outline":
+            print(
+                colored(
+                    f"Using sub-agent collaborator: '{_collab_name} [{_collab_ids}]'",
+                    "magenta",
+                )
+            )
+        else:
+            print(
+                colored(
+                    f"Using sub-agent collaborator: '{_collab_name} [{_collab_ids}]' passing input text:",
+                    "magenta",
+                )
+            )
+            print(
+                colored(
+                    f"{_collab_input_text[0:TRACE_TRUNCATION_LENGTH]}\n",
+                    "magenta",
+                )
+            )
+
+    elif "codeInterpreterInvocationInput" in _input:
+        if context.trace_level == "outline":
+            print(colored(f"Using code interpreter", "magenta"))
+        else:
+            console = Console()
+            _gen_code = _input["codeInterpreterInvocationInput"]["code"]
+            _code = f"```python\n{_gen_code}\n```"
+
+            console.print(Markdown(f"**Generated code**\n{_code}"))
+
+    elif "knowledgeBaseLookupInput" in _input:
+        if context.trace_level == "outline":
+            print(colored(f"Using knowledge base", "magenta"))
+        else:
+            _kb_id = _input["knowledgeBaseLookupInput"]["knowledgeBaseId"]
+            _kb_query = _input["knowledgeBaseLookupInput"]["text"]
+            print(
+                colored(
+                    f"Using knowledge base id: {_kb_id} to search for:",
+                    "magenta",
+                )
+            )
+            print(colored(f"  {_kb_query}\n", "magenta"))
+
+
+def _print_observation(_output: Dict, context: TraceContext) -> None:
+    if "actionGroupInvocationOutput" in _output:
+        print(
+            colored(
+                f"--tool outputs:\n{_output['actionGroupInvocationOutput']['text'][0:TRACE_TRUNCATION_LENGTH]}...\n",
+                "magenta",
+            )
+        )
+
+    if "agentCollaboratorInvocationOutput" in _output:
+        _collab_name = _output["agentCollaboratorInvocationOutput"][
+            "agentCollaboratorName"
+        ]
+        _collab_output_text = _output["agentCollaboratorInvocationOutput"]["output"][
+            "text"
+        ][0:TRACE_TRUNCATION_LENGTH]
+        print(
+            colored(
+                f"\n----sub-agent {_collab_name} output text:\n{_collab_output_text}...\n",
+                "magenta",
+            )
+        )
+
+    if "codeInterpreterInvocationOutput" in _output:
+        _ci_output = _output["codeInterpreterInvocationOutput"]
+        if "executionError" in _ci_output:
+            print(
+                colored(
+                    f"--- Code interpreter execution ERROR:\n{_ci_output['executionError']}\n---\n",
+                    "red",
+                )
+            )
+        elif "executionOutput" in _ci_output:
+            print(
+                colored(
+                    f"--- Code interpreter execution OUTPUT:\n{_ci_output['executionOutput']}\n---\n",
+                    "magenta",
+                )
+            )
+
+    if "knowledgeBaseLookupOutput" in _output:
+        _refs = _output["knowledgeBaseLookupOutput"]["retrievedReferences"]
+        print(
+            colored(
+                f"Knowledge base lookup output, {len(_refs)} references:\n",
+                "magenta",
+            )
+        )
+        for _curr, _ref in enumerate(_refs, 1):
+            print(
+                colored(
+                    f"  ({_curr}) {_ref['content']['text'][0:TRACE_TRUNCATION_LENGTH]}...\n",
+                    "magenta",
+                )
+            )
+
+    if "finalResponse" in _output:
+        print(
+            colored(
+                f"Final response:\n{_output['finalResponse']['text'][0:TRACE_TRUNCATION_LENGTH]}...",
+                "cyan",
+            )
+        )
+
+
+def _print_orchestration_trace(_orch: Dict, context: TraceContext) -> None:
+    if context.trace_level in ["core", "outline"]:
+        if "rationale" in _orch:
+            print(colored(f"{_orch['rationale']['text']}", "blue"))
+
+        if "invocationInput" in _orch:
+            _print_invocation_input(_orch["invocationInput"], context)
+
+        if "observation" in _orch and context.trace_level == "core":
+            _print_observation(_orch["observation"], context)
+
+    if "modelInvocationOutput" in _orch:
+        if context.sub_agent_alias_id is not None:
+            context.sub_step += 1
+            print(
+                colored(
+                    f"---- Step {context.orch_step}.{context.sub_step} [using sub-agent name:{context.sub_agent_name}, id:{context.sub_agent_alias_id}] ----",
+                    "green",
+                )
+            )
+        else:
+            context.orch_step += 1
+            context.sub_step = 0
+            print(colored(f"---- Step {context.orch_step} ----", "green"))
+
+        _orch_duration = datetime.datetime.now() - context.time_before_orchestration
+        _usage = context.record_llm_call(_orch["modelInvocationOutput"])
+        if _usage is not None:
+            _in_tokens, _out_tokens = _usage
+            print(
+                colored(
+                    f"Took {_orch_duration.total_seconds():,.1f}s, using {_in_tokens+_out_tokens} tokens (in: {_in_tokens}, out: {_out_tokens}) to complete prior action, observe, orchestrate.",
+                    "yellow",
+                )
+            )
+        else:
+            print(
+                colored(
+                    f"Took {_orch_duration.total_seconds():,.1f}s [token count metadata was not returned] to complete prior action, observe, orchestrate.",
+                    "yellow",
+                )
+            )
+
+        # restart the clock for next step/sub-step
+        context.time_before_orchestration = datetime.datetime.now()
+
+
+def _print_pre_processing_trace(_pre: Dict, context: TraceContext) -> None:
+    if "modelInvocationOutput" in _pre:
+        _usage = context.record_llm_call(_pre["modelInvocationOutput"])
+        print(
+            colored(
+                "Pre-processing trace, agent came up with an initial plan.",
+                "yellow",
+            )
+        )
+        if _usage is not None:
+            _in_tokens, _out_tokens = _usage
+            print(
+                colored(
+                    f"Used LLM tokens, in: {_in_tokens}, out: {_out_tokens}", "yellow"
+                )
+            )
+
+
+def _print_post_processing_trace(_post: Dict, context: TraceContext) -> None:
+    if "modelInvocationOutput" in _post:
+        _usage = context.record_llm_call(_post["modelInvocationOutput"])
+        print(colored("Agent post-processing complete.", "yellow"))
+        if _usage is not None:
+            _in_tokens, _out_tokens = _usage
+            print(
+                colored(
+                    f"Used LLM tokens, in: {_in_tokens}, out: {_out_tokens}", "yellow"
+                )
+            )
+
+
+def console_trace_dispatcher() -> TraceDispatcher:
+    """Returns a dispatcher with the handlers that print the trace to the console, as shown
+    by invoke() with enable_trace=True. The verbosity follows the trace_level of the TraceContext.
+    More handlers can be subscribed to it, e.g. to also export the trace elsewhere.
+    """
+    _dispatcher = TraceDispatcher()
+    _dispatcher.subscribe(ANY_TRACE, _print_trace_event)
+    _dispatcher.subscribe(ROUTING_CLASSIFIER_TRACE, _print_routing_trace)
+    _dispatcher.subscribe(FAILURE_TRACE, _print_failure_trace)
+    _dispatcher.subscribe(ORCHESTRATION_TRACE, _print_orchestration_trace)
+    _dispatcher.subscribe(PRE_PROCESSING_TRACE, _print_pre_processing_trace)
+    _dispatcher.subscribe(POST_PROCESSING_TRACE, _print_post_processing_trace)
+    return _dispatcher
+
+
+def print_trace_summary(context: TraceContext, duration: datetime.timedelta) -> None:
+    """Prints the totals of an invocation, after its trace was printed to the console."""
+    if context.trace_level in ["core", "outline"]:
+        print(
+            colored(
+                f"Agent made a total of {context.total_llm_calls} LLM calls, "
+                + f"using {context.total_in_tokens+context.total_out_tokens} tokens "
+                + f"(in: {context.total_in_tokens}, out: {context.total_out_tokens})"
+                + f", and took {duration.total_seconds():,.1f} total seconds",
+                "yellow",
+            )
+        )
@@ -0,0 +1,498 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module prepares the files attached to agent invocations through the session state, such as the
+datasets given to the code interpreter.
+
+Sizes are checked before anything is read: a request carries at most MAX_SESSION_FILES files of
+MAX_SESSION_FILES_BYTES in total. Files sent as they are get memory-mapped, so they are hashed and
+copied into the request without intermediate buffers. Tabular files (CSV, XLSX, Parquet) can be
+reduced before they are sent, with AttachmentOptions: column projection and row sampling are applied
+while the rows are streamed, so only the rows that are kept are held in memory, and the result is
+sent as CSV. Parquet files, which agents cannot read, are always converted to CSV.
+
+Prepared attachments are cached by the SHA-256 of the source file and the options, so a dataset
+attached to many sessions is read and converted once. The hash of a file is itself remembered by
+size and modification time, as the manifest of sync_directory_to_bucket() does. An AttachmentCache
+with a cache_dir also keeps prepared attachments on disk for other processes.
+
+XLSX files are streamed with openpyxl (pip install openpyxl), and Parquet files with PyArrow
+(pip install pyarrow).
+"""
+
+import csv
+import hashlib
+import io
+import mmap
+import os
+import random
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+MAX_SESSION_FILES = 5
+MAX_SESSION_FILES_BYTES = 10 * 1024 * 1024  # total size of the files of a request
+DEFAULT_ATTACHMENT_CACHE_BYTES = 256 * 1024 * 1024
+USE_CASES = ["CHAT", "CODE_INTERPRETER"]
+SAMPLE_MODES = ["head", "random"]
+CSV_MEDIA_TYPE = "text/csv"
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DEFAULT_MEDIA_TYPE = "text/plain"
+# media type of each file extension, the other files are sent as DEFAULT_MEDIA_TYPE
+MEDIA_TYPES = {
+    "csv": CSV_MEDIA_TYPE,
+    "xls": XLSX_MEDIA_TYPE,
+    "xlsx": XLSX_MEDIA_TYPE,
+}
+# extensions whose rows can be streamed, and so projected, sampled and converted to CSV
+_TABULAR_EXTENSIONS = ["csv", "xlsx", "parquet"]
+# extensions that are always converted to CSV
+_CONVERTED_EXTENSIONS = ["parquet"]
+_PARQUET_BATCH_ROWS = 65536
+
+
+@dataclass(frozen=True)
+class AttachmentOptions:
+    """Pre-processing of a tabular file (CSV, XLSX or Parquet) before it is attached. A file that is
+    projected or sampled is sent as CSV.
+
+    Attributes:
+        columns (Tuple[str, ...]): columns to keep, in this order. None keeps all of them.
+        max_rows (int): data rows to keep. None keeps all of them.
+        sample (str): "head" keeps the first max_rows rows, "random" a uniform sample of max_rows
+            rows, in the order of the file
+        seed (int): seed of the random sample, so that a file is always sampled the same way
+        sheet_name (str): sheet of an XLSX file. None reads the active sheet.
+    """
+
+    columns: Tuple[str, ...] = None
+    max_rows: int = None
+    sample: str = "head"
+    seed: int = 0
+    sheet_name: str = None
+
+    def __post_init__(self):
+        if self.sample not in SAMPLE_MODES:
+            raise ValueError(f"sample must be one of {SAMPLE_MODES}, not {self.sample}")
+        if self.max_rows is not None and self.max_rows < 0:
+            raise ValueError("max_rows must be positive")
+        if self.columns is not None and not isinstance(self.columns, tuple):
+            # keeps the options hashable, they are part of the cache key
+            object.__setattr__(self, "columns", tuple(self.columns))
+
+    @property
+    def reduces(self) -> bool:
+        return self.columns is not None or self.max_rows is not None
+
+
+@dataclass
+class PreparedAttachment:
+    """A file ready to be attached to a session.
+
+    Attributes:
+        name (str): name of the file seen by the agent
+        media_type (str): media type of data
+        data (bytes): content sent to the agent
+        sha256 (str): SHA-256 of the source file
+        source_size (int): size of the source file, in bytes
+    """
+
+    name: str
+    media_type: str
+    data: bytes
+    sha256: str
+    source_size: int
+
+    def session_file(self, use_case: str = "CODE_INTERPRETER") -> Dict:
+        """Returns the entry of the "files" list of a session state."""
+        return {
+            "name": self.name,
+            "source": {
+                "sourceType": "BYTE_CONTENT",
+                "byteContent": {"mediaType": self.media_type, "data": self.data},
+            },
+            "useCase": use_case,
+        }
+
+
+def _extension(file_name: str) -> str:
+    return os.path.splitext(file_name)[1].lstrip(".").lower()
+
+
+def media_type(file_name: str) -> str:
+    """Returns the media type of a file sent as it is, from its extension."""
+    return MEDIA_TYPES.get(_extension(file_name), DEFAULT_MEDIA_TYPE)
+
+
+def _read_mapped(file_name: str) -> Tuple[bytes, str]:
+    """Returns the content of a file and its SHA-256, reading it once through a memory map."""
+    with open(file_name, "rb") as _file:
+        if os.fstat(_file.fileno()).st_size == 0:
+            return b"", hashlib.sha256().hexdigest()
+        with mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ) as _mapped:
+            return _mapped[:], hashlib.sha256(_mapped).hexdigest()
+
+
+def file_sha256(file_name: str) -> str:
+    """Returns the SHA-256 of a file, hashed through a memory map."""
+    with open(file_name, "rb") as _file:
+        if os.fstat(_file.fileno()).st_size == 0:
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ) as _mapped:
+            return hashlib.sha256(_mapped).hexdigest()
+
+
+class AttachmentCache:
+    """Prepared attachments, keyed by the content of their source file and their options.
+
+    Entries are kept in memory up to max_bytes of data, evicting the least recently used ones. With
+    a cache_dir, the data of each entry is also written to a file named after its key, and read
+    back by other caches using the same directory.
+    """
+
+    def __init__(
+        self, max_bytes: int = DEFAULT_ATTACHMENT_CACHE_BYTES, cache_dir: str = None
+    ):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        # SHA-256 of the files already hashed, by path, size and modification time
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def source_sha256(self, file_name: str) -> str:
+        """Returns the SHA-256 of a file, hashing it again only if it changed."""
+        _stat = os.stat(file_name)
+        _key = (os.path.abspath(file_name), _stat.st_size, _stat.st_mtime_ns)
+        with self._lock:
+            _sha256 = self._hashes.get(_key)
+        if _sha256 is None:
+            _sha256 = file_sha256(file_name)
+            with self._lock:
+                self._hashes[_key] = _sha256
+        return _sha256
+
+    @staticmethod
+    def make_key(sha256: str, options: AttachmentOptions = None) -> str:
+        return hashlib.sha256(f"{sha256}:{options!r}".encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str, name: str, media_type: str) -> PreparedAttachment:
+        """Returns the attachment of a key, or None. name and media_type are those of an entry
+        read from cache_dir, which only holds the data."""
+        with self._lock:
+            _attachment = self._entries.get(key)
+            if _attachment is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _attachment
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            _data, _ = _read_mapped(self._path(key))
+            _attachment = PreparedAttachment(name, media_type, _data, None, None)
+            self.put(key, _attachment, persist=False)
+            with self._lock:
+                self.hits += 1
+            return _attachment
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, attachment: PreparedAttachment, persist: bool = True):
+        if persist and self.cache_dir is not None:
+            # written then renamed, so that readers never see a partial file
+            _tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(_tmp_path, "wb") as _file:
+                _file.write(attachment.data)
+            os.replace(_tmp_path, self._path(key))
+        if len(attachment.data) > self.max_bytes:
+            return
+        with self._lock:
+            _previous = self._entries.pop(key, None)
+            if _previous is not None:
+                self._size -= len(_previous.data)
+            self._entries[key] = attachment
+            self._size += len(attachment.data)
+            while self._size > self.max_bytes:
+                _, _evicted = self._entries.popitem(last=False)
+                self._size -= len(_evicted.data)
+
+    def clear(self) -> None:
+        """Empties the cache in memory. Files in cache_dir are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._hashes.clear()
+            self._size = 0
+
+
+_default_cache: AttachmentCache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_attachment_cache() -> AttachmentCache:
+    """Returns the in-memory cache used when no cache is given."""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = AttachmentCache()
+    return _default_cache
+
+
+def _csv_rows(file_name: str, options: AttachmentOptions) -> Iterator[Sequence]:
+    with open(file_name, newline="", encoding="utf-8-sig") as _file:
+        yield from csv.reader(_file)
+
+
+def _xlsx_rows(file_name: str, options: AttachmentOptions) -> Iterator[Sequence]:
+    try:
+        import openpyxl
+    except ImportError as e:
+        raise ImportError(
+            "Pre-processing XLSX attachments requires: pip install openpyxl"
+        ) from e
+    _workbook = openpyxl.load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        _sheet = (
+            _workbook.active
+            if options.sheet_name is None
+            else _workbook[options.sheet_name]
+        )
+        yield from _sheet.iter_rows(values_only=True)
+    finally:
+        _workbook.close()
+
+
+def _parquet_rows(file_name: str, options: AttachmentOptions) -> Iterator[Sequence]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Parquet attachments require PyArrow: pip install pyarrow"
+        ) from e
+    _file = pq.ParquetFile(file_name, memory_map=True)
+    _columns = _file.schema_arrow.names
+    if options.columns is not None:
+        _missing = [_name for _name in options.columns if _name not in _columns]
+        if _missing:
+            raise ValueError(
+                f"Columns {_missing} not found in {file_name}, columns are {_columns}"
+            )
+        # only the projected columns are read from the file
+        _columns = list(options.columns)
+    yield _columns
+    for _batch in _file.iter_batches(batch_size=_PARQUET_BATCH_ROWS, columns=_columns):
+        yield from zip(*(_column.to_pylist() for _column in _batch.columns))
+
+
+_ROW_READERS = {"csv": _csv_rows, "xlsx": _xlsx_rows, "parquet": _parquet_rows}
+
+
+def _project(
+    rows: Iterator[Sequence], file_name: str, options: AttachmentOptions
+) -> Tuple[List, Iterator[Sequence]]:
+    """Returns the header and the data rows of a table, with the columns of the options."""
+    _header = next(rows, None)
+    if _header is None:
+        return [], iter(())
+    _header = ["" if _value is None else str(_value) for _value in _header]
+    if options.columns is None or _header == list(options.columns):
+        return _header, rows
+    _missing = [_name for _name in options.columns if _name not in _header]
+    if _missing:
+        raise ValueError(
+            f"Columns {_missing} not found in {file_name}, columns are {_header}"
+        )
+    _indexes = [_header.index(_name) for _name in options.columns]
+    return list(options.columns), (
+        [_row[_index] if _index < len(_row) else None for _index in _indexes]
+        for _row in rows
+    )
+
+
+def _sample(rows: Iterator[Sequence], options: AttachmentOptions) -> Iterator[Sequence]:
+    """Returns the rows kept by the options, reading no more rows than needed."""
+    if options.max_rows is None:
+        return rows
+    if options.sample == "head":
+        return (_row for _, _row in zip(range(options.max_rows), rows))
+    # reservoir sampling: a uniform sample of a stream of unknown length, in bounded memory
+    _random = random.Random(options.seed)
+    _reservoir = []
+    for _index, _row in enumerate(rows):
+        if _index < options.max_rows:
+            _reservoir.append((_index, _row))
+        else:
+            _slot = _random.randint(0, _index)
+            if _slot < options.max_rows:
+                _reservoir[_slot] = (_index, _row)
+    return (_row for _, _row in sorted(_reservoir, key=lambda _item: _item[0]))
+
+
+def _table_csv(file_name: str, options: AttachmentOptions, max_bytes: int) -> bytes:
+    """Streams the rows of a tabular file into CSV, with the projection and sampling of the
+    options. Raises ValueError as soon as the CSV exceeds max_bytes."""
+    _header, _rows = _project(
+        _ROW_READERS[_extension(file_name)](file_name, options), file_name, options
+    )
+    _buffer = io.StringIO()
+    _writer = csv.writer(_buffer, lineterminator="\n")
+    _writer.writerow(_header)
+    for _row in _sample(_rows, options):
+        _writer.writerow(["" if _value is None else _value for _value in _row])
+        # characters are a lower bound of the encoded size
+        if _buffer.tell() > max_bytes:
+            break
+    _data = _buffer.getvalue().encode("utf-8")
+    if len(_data) > max_bytes:
+        raise ValueError(
+            f"{file_name} exceeds {max_bytes} bytes once converted to CSV, "
+            "select fewer columns or rows"
+        )
+    return _data
+
+
+def prepare_attachment(
+    file_name: str,
+    options: AttachmentOptions = None,
+    max_bytes: int = MAX_SESSION_FILES_BYTES,
+    cache: AttachmentCache = None,
+) -> PreparedAttachment:
+    """Prepares a file to be attached to a session, or returns it from the cache.
+
+    Args:
+        file_name (str): path of the file
+        options (AttachmentOptions, optional): pre-processing of a tabular file. Defaults to None:
+        the file is sent as it is, except Parquet files which are converted to CSV.
+        max_bytes (int, optional): maximum size of the attachment. Files sent as they are, are
+        checked before they are read. Defaults to MAX_SESSION_FILES_BYTES.
+        cache (AttachmentCache, optional): cache of prepared attachments. Defaults to
+        default_attachment_cache().
+
+    Returns:
+        PreparedAttachment: the attachment
+    """
+    _extension_name = _extension(file_name)
+    if _extension_name in _CONVERTED_EXTENSIONS and options is None:
+        options = AttachmentOptions()
+    _converts = options is not None and (
+        options.reduces or _extension_name in _CONVERTED_EXTENSIONS
+    )
+    if _converts and _extension_name not in _TABULAR_EXTENSIONS:
+        raise ValueError(
+            f"Only {', '.join(_TABULAR_EXTENSIONS).upper()} files can be pre-processed, "
+            f"not {file_name}"
+        )
+    _source_size = os.path.getsize(file_name)
+    if not _converts and _source_size > max_bytes:
+        raise ValueError(
+            f"{file_name} has {_source_size} bytes, attachments are limited to "
+            f"{max_bytes} bytes: pre-process it with AttachmentOptions"
+        )
+
+    _cache = cache or default_attachment_cache()
+    _name = os.path.basename(file_name)
+    if _converts:
+        _name = os.path.splitext(_name)[0] + ".csv"
+        _media_type = CSV_MEDIA_TYPE
+    else:
+        _media_type = media_type(file_name)
+
+    _sha256 = _cache.source_sha256(file_name)
+    _key = AttachmentCache.make_key(_sha256, options if _converts else None)
+    _cached = _cache.get(_key, _name, _media_type)
+    if _cached is not None:
+        if len(_cached.data) > max_bytes:
+            raise ValueError(
+                f"{file_name} exceeds {max_bytes} bytes once prepared, "
+                "select fewer columns or rows"
+            )
+        # the cache is shared by files with the same content but other names
+        return PreparedAttachment(
+            _name, _media_type, _cached.data, _sha256, _source_size
+        )
+
+    if _converts:
+        _data = _table_csv(file_name, options, max_bytes)
+    else:
+        _data, _sha256 = _read_mapped(file_name)
+    _attachment = PreparedAttachment(_name, _media_type, _data, _sha256, _source_size)
+    _cache.put(_key, _attachment)
+    return _attachment
+
+
+def add_files_to_session_state(
+    file_names: List[str],
+    use_case: str = "CODE_INTERPRETER",
+    session_state: Dict = None,
+    options: AttachmentOptions = None,
+    max_bytes: int = MAX_SESSION_FILES_BYTES,
+    cache: AttachmentCache = None,
+) -> Dict:
+    """Attaches files to a session state, checking the limits of a request before reading them.
+
+    Args:
+        file_names (List[str]): paths of the files
+        use_case (str, optional): "CODE_INTERPRETER" or "CHAT". Defaults to "CODE_INTERPRETER".
+        session_state (Dict, optional): session state to add the files to. Defaults to a new one.
+        options (AttachmentOptions, optional): pre-processing of the tabular files. Defaults to None.
+        max_bytes (int, optional): maximum size of all the files of the session state. Defaults to
+        MAX_SESSION_FILES_BYTES.
+        cache (AttachmentCache, optional): cache of prepared attachments. Defaults to
+        default_attachment_cache().
+
+    Returns:
+        Dict: the session state
+    """
+    use_case = use_case.upper()
+    if use_case not in USE_CASES:
+        raise ValueError(f"Use case must be one of {USE_CASES}")
+    if not session_state:
+        session_state = {"files": []}
+    _files = session_state.setdefault("files", [])
+    if len(_files) + len(file_names) > MAX_SESSION_FILES:
+        raise ValueError(
+            f"A session state can hold {MAX_SESSION_FILES} files, "
+            f"cannot add {len(file_names)} to {len(_files)}"
+        )
+
+    _used = sum(
+        len(_file["source"].get("byteContent", {}).get("data", b"")) for _file in _files
+    )
+    # files sent as they are can be checked against the limit before anything is read
+    _unread = 0
+    for _file_name in file_names:
+        _extension_name = _extension(_file_name)
+        _reduced = (
+            options is not None
+            and options.reduces
+            and _extension_name in _TABULAR_EXTENSIONS
+        )
+        if not _reduced and _extension_name not in _CONVERTED_EXTENSIONS:
+            _unread += os.path.getsize(_file_name)
+    if _used + _unread > max_bytes:
+        raise ValueError(
+            f"The files of the session state would have {_used + _unread} bytes, "
+            f"the limit is {max_bytes} bytes"
+        )
+
+    for _file_name in file_names:
+        _attachment = prepare_attachment(
+            _file_name,
+            options=(
+                options if _extension(_file_name) in _TABULAR_EXTENSIONS else None
+            ),
+            max_bytes=max_bytes - _used,
+            cache=cache,
+        )
+        _used += len(_attachment.data)
+        _files.append(_attachment.session_file(use_case))
+    return session_state
@@ -0,0 +1,252 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module contains the AWS context shared by the helpers: the boto3 session, its region, the
+account id and the clients built from it.
+
+Nothing is resolved when a context is created. Each client is built on first use and then reused,
+and the account id is only looked up with STS when something needs it, so importing the helpers
+costs no network round-trip.
+
+Every helper shares the clients of its context, and so their connection pools. Clients are
+configured for concurrent use: pools of DEFAULT_MAX_POOL_CONNECTIONS connections (instead of
+botocore's 10, which makes concurrent invocations open and drop connections with "connection pool
+is full" warnings), TCP keep-alive, and adaptive retries, which also rate limit the client once it
+is throttled.
+
+The helpers use the default context unless they are given one. To target another profile, region
+or set of credentials, set the default context before first use:
+
+    from boto3.session import Session
+    from src.utils.aws_context import AwsContext, set_default_context
+
+    set_default_context(AwsContext(Session(profile_name="dev", region_name="us-west-2")))
+
+Asyncio code can get non-blocking clients of the same session with async_client(), which requires:
+pip install aiobotocore
+"""
+
+import asyncio
+import threading
+import weakref
+from typing import Any, Dict, Tuple
+
+from boto3.session import Session
+from botocore.config import Config
+from botocore.credentials import RefreshableCredentials
+
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+DEFAULT_RETRY_MODE = "adaptive"
+DEFAULT_MAX_ATTEMPTS = 5
+
+
+class AwsContext:
+    """Lazily resolved boto3 session, region, account id and clients."""
+
+    def __init__(
+        self,
+        session: Session = None,
+        region_name: str = None,
+        account_id: str = None,
+        max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS,
+        retry_mode: str = DEFAULT_RETRY_MODE,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        tcp_keepalive: bool = True,
+    ):
+        """Args:
+        session (Session, optional): boto3 session. Defaults to a session built on first use.
+        region_name (str, optional): region of the session built on first use. Defaults to the
+        region of the environment or profile.
+        account_id (str, optional): account id, to skip the STS lookup. Defaults to the account of
+        the credentials, looked up on first use.
+        max_pool_connections (int, optional): connections kept per client; use at least the number
+        of concurrent calls. Defaults to DEFAULT_MAX_POOL_CONNECTIONS.
+        retry_mode (str, optional): botocore retry mode, "adaptive", "standard" or "legacy".
+        Defaults to DEFAULT_RETRY_MODE.
+        max_attempts (int, optional): attempts per call, retries included. Defaults to DEFAULT_MAX_ATTEMPTS.
+        tcp_keepalive (bool, optional): whether idle connections are kept alive. Defaults to True.
+        """
+        self._session = session
+        self._region_name = region_name
+        self._account_id = account_id
+        self._caller_identity = None
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            retries={"mode": retry_mode, "total_max_attempts": max_attempts},
+            tcp_keepalive=tcp_keepalive,
+        )
+        self._clients: Dict[Tuple, Any] = {}
+        # aiobotocore clients are bound to the event loop they were built in
+        self._async_clients = weakref.WeakKeyDictionary()
+        # boto3 sessions are not thread safe: clients are built one at a time
+        self._lock = threading.RLock()
+
+    @property
+    def session(self) -> Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = Session(region_name=self._region_name)
+        return self._session
+
+    @property
+    def region(self) -> str:
+        return self.session.region_name
+
+    @property
+    def caller_identity(self) -> Dict:
+        """Returns the STS caller identity of the credentials, looked up once."""
+        if self._caller_identity is None:
+            self._caller_identity = self.client("sts").get_caller_identity()
+        return self._caller_identity
+
+    @property
+    def account_id(self) -> str:
+        if self._account_id is None:
+            self._account_id = self.caller_identity["Account"]
+        return self._account_id
+
+    @property
+    def suffix(self) -> str:
+        """Returns "<region>-<account id>", used to name per-account resources."""
+        return f"{self.region}-{self.account_id}"
+
+    def client(self, service_name: str, region_name: str = None, **config_options):
+        """Returns the client of a service, built on first use.
+
+        Args:
+            service_name (str): boto3 service name, e.g. "bedrock-agent"
+            region_name (str, optional): region of the client. Defaults to the region of the session.
+            config_options: botocore Config options of the client, e.g. read_timeout=600, on top
+            of the pool and retry settings of the context. Clients with different options are distinct.
+
+        Returns:
+            the boto3 client
+        """
+        _key = (
+            "client",
+            service_name,
+            region_name,
+            repr(sorted(config_options.items())),
+        )
+        _client = self._clients.get(_key)
+        if _client is None:
+            with self._lock:
+                _client = self._clients.get(_key)
+                if _client is None:
+                    _client = self._clients[_key] = self.session.client(
+                        service_name,
+                        region_name=region_name,
+                        config=(
+                            self.config.merge(Config(**config_options))
+                            if config_options
+                            else self.config
+                        ),
+                    )
+        return _client
+
+    async def async_client(
+        self, service_name: str, region_name: str = None, **config_options
+    ):
+        """Returns the aiobotocore client of a service for the running event loop, built on first
+        use. Requires: pip install aiobotocore
+
+        The client uses the profile and region of the session, and its credentials when they are
+        static; refreshable credentials are resolved again by aiobotocore. Close the clients of a
+        loop with close_async_clients() before the loop ends.
+
+        Args:
+            service_name (str): boto3 service name, e.g. "bedrock-agent-runtime"
+            region_name (str, optional): region of the client. Defaults to the region of the session.
+            config_options: botocore Config options of the client, as for client()
+
+        Returns:
+            the aiobotocore client
+        """
+        try:
+            from aiobotocore.session import AioSession
+        except ImportError as e:
+            raise ImportError(
+                "Asynchronous clients require: pip install aiobotocore"
+            ) from e
+
+        _key = (service_name, region_name, repr(sorted(config_options.items())))
+        _loop_clients = self._async_clients.setdefault(asyncio.get_running_loop(), {})
+        _client = _loop_clients.get(_key)
+        if _client is not None:
+            return _client
+
+        with self._lock:
+            # profile_name is "default" even when no profile is configured
+            _profile_name = self.session.profile_name
+            _aio_session = AioSession(
+                profile=(
+                    _profile_name
+                    if _profile_name in self.session.available_profiles
+                    else None
+                )
+            )
+            _credentials = self.session.get_credentials()
+            if _credentials is not None and not isinstance(
+                _credentials, RefreshableCredentials
+            ):
+                _frozen = _credentials.get_frozen_credentials()
+                _aio_session.set_credentials(
+                    _frozen.access_key, _frozen.secret_key, _frozen.token
+                )
+        _client = await _aio_session.create_client(
+            service_name,
+            region_name=region_name or self.region,
+            config=(
+                self.config.merge(Config(**config_options))
+                if config_options
+                else self.config
+            ),
+        ).__aenter__()
+        if _key in _loop_clients:
+            # built concurrently by another task of the loop
+            await _client.close()
+            return _loop_clients[_key]
+        _loop_clients[_key] = _client
+        return _client
+
+    async def close_async_clients(self) -> None:
+        """Closes the aiobotocore clients of the running event loop."""
+        _loop_clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for _client in _loop_clients.values():
+            await _client.close()
+
+    def resource(self, service_name: str, region_name: str = None):
+        """Returns the boto3 resource of a service, e.g. "dynamodb", built on first use."""
+        _key = ("resource", service_name, region_name)
+        _resource = self._clients.get(_key)
+        if _resource is None:
+            with self._lock:
+                _resource = self._clients.get(_key)
+                if _resource is None:
+                    _resource = self._clients[_key] = self.session.resource(
+                        service_name, region_name=region_name, config=self.config
+                    )
+        return _resource
+
+
+_default_context: AwsContext = None
+_default_context_lock = threading.Lock()
+
+
+def default_context() -> AwsContext:
+    """Returns the context used by helpers that were not given one."""
+    global _default_context
+    if _default_context is None:
+        with _default_context_lock:
+            if _default_context is None:
+                _default_context = AwsContext()
+    return _default_context
+
+
+def set_default_context(context: AwsContext) -> None:
+    """Replaces the default context. Helpers that already built their clients keep them."""
+    global _default_context
+    with _default_context_lock:
+        _default_context = context
@@ -23,7 +23,6 @@ associating them with Guardrails, Knowledge Bases, and Tools.
 The SupervisorAgent class enables creating Agents that can collaborate with other sub-agents, with options
 for specifying collaboration types, routing classifiers, and instructions.
 """
-import boto3
 from botocore.exceptions import ClientError
 import uuid
 from textwrap import dedent
@@ -33,24 +32,47 @@ from dataclasses import dataclass
 from typing import Self, Callable, Union
 from enum import Enum
 import yaml
+from src.utils.aws_context import default_context
 from src.utils.bedrock_agent_helper import AgentsForAmazonBedrock
+from src.utils.agent_trace import TraceDispatcher
+from src.utils.attachments import (
+    AttachmentCache,
+    AttachmentOptions,
+    add_files_to_session_state,
+)
+from src.utils.local_tools import DEFAULT_LOCAL_TOOL_WORKERS, LocalToolExecutor
+from src.utils.response_cache import ResponseCache
+from src.utils.provisioning import DEFAULT_PROVISIONING_CONCURRENCY, provision
 import json
 
-print(f"boto3 version: {boto3.__version__}")
-
-# Clients
-s3_client = boto3.client("s3")
-sts_client = boto3.client("sts")
-bedrock_agent_client = boto3.client("bedrock-agent")
-bedrock_agent_runtime_client = boto3.client("bedrock-agent-runtime")
-bedrock_client = boto3.client("bedrock")
+# Clients, region and account id are resolved from the default AWS context on first use (see
+# __getattr__ below), so that importing this module makes no AWS call. To use another session,
+# call src.utils.aws_context.set_default_context() first.
+_LAZY_CLIENTS = {
+    "s3_client": "s3",
+    "sts_client": "sts",
+    "bedrock_agent_client": "bedrock-agent",
+    "bedrock_agent_runtime_client": "bedrock-agent-runtime",
+    "bedrock_client": "bedrock",
+}
 agents_helper = AgentsForAmazonBedrock()
 
-region = agents_helper.get_region()
-account_id = sts_client.get_caller_identity()["Account"]
 
-suffix = f"{region}-{account_id}"
-bucket_name = f"mac-workshop-{suffix}"
+def __getattr__(name: str):
+    """Resolves the module level clients, region, account_id, suffix and bucket_name lazily."""
+    if name in _LAZY_CLIENTS:
+        return default_context().client(_LAZY_CLIENTS[name])
+    if name == "region":
+        return default_context().region
+    if name == "account_id":
+        return default_context().account_id
+    if name == "suffix":
+        return default_context().suffix
+    if name == "bucket_name":
+        return f"mac-workshop-{default_context().suffix}"
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 agent_foundation_models = [
     "us.anthropic.claude-3-haiku-20240307-v1:0",
     "us.anthropic.claude-3-sonnet-20240307-v1:0",
@@ -156,7 +178,7 @@ class Guardrail:
         self.name = name
 
         # see if Guardrail already exists
-        resp = bedrock_client.list_guardrails()
+        resp = default_context().client("bedrock").list_guardrails()
         if verbose:
             print(f"Found {len(resp['guardrails'])} guardrails: {resp['guardrails']}")
             print(f"Looking for guardrail: {self.name}")
@@ -168,20 +190,24 @@ class Guardrail:
                 return
 
         # create new Guardrail
-        resp = bedrock_client.create_guardrail(
-            name="no_bitcoin_guardrail",
-            blockedInputMessaging=blocked_input_response,
-            blockedOutputsMessaging=blocked_output_response,
-            topicPolicyConfig={
-                "topicsConfig": [
-                    {
-                        "definition": topics_definition,
-                        "examples": denied_topics,
-                        "name": topics_name,
-                        "type": "DENY",
-                    }
-                ]
-            },
+        resp = (
+            default_context()
+            .client("bedrock")
+            .create_guardrail(
+                name="no_bitcoin_guardrail",
+                blockedInputMessaging=blocked_input_response,
+                blockedOutputsMessaging=blocked_output_response,
+                topicPolicyConfig={
+                    "topicsConfig": [
+                        {
+                            "definition": topics_definition,
+                            "examples": denied_topics,
+                            "name": topics_name,
+                            "type": "DENY",
+                        }
+                    ]
+                },
+            )
         )
         if verbose:
             print(f"Guardrail created: {resp}")
@@ -269,6 +295,9 @@ class Task:
 # define an Agent class to simplify creating and using an agent
 class Agent:
     default_force_recreate: bool = False
+    default_reconcile: bool = False
+    default_check_drift: bool = False
+    default_local_tools: bool = False
     NO_TOOL_USE_INSTRUCTION = (
         "\nYou have no available tools. Rely only on your own knowledge."
     )
@@ -280,6 +309,35 @@ class Agent:
     def set_force_recreate_default(cls, force_recreate: bool):
         Agent.default_force_recreate = force_recreate
 
+    @classmethod
+    def set_reconcile_default(cls, reconcile: bool):
+        """When True, existing agents are updated in place to match their definition
+        (only what changed), and missing agents are created. Takes precedence over force_recreate.
+        """
+        Agent.default_reconcile = reconcile
+
+    @classmethod
+    def set_check_drift_default(cls, check_drift: bool):
+        """When True, reconciling compares each deployed agent with its definition even if its
+        fingerprint tag matches, so that changes made outside of this code are repaired too.
+        """
+        Agent.default_check_drift = check_drift
+
+    @classmethod
+    def set_local_tools_default(cls, local_tools: bool):
+        """When True, the tools of new agents are return of control action groups, and invoke()
+        runs their Lambda handler code in this process instead of deploying it to AWS Lambda.
+        For development, tests and benchmarks of the tools.
+        """
+        Agent.default_local_tools = local_tools
+
+    @classmethod
+    def set_response_cache(cls, response_cache: ResponseCache):
+        """Sets the cache of answers used by invoke() on all agents and supervisors,
+        None to disable it. Pass use_cache=False to invoke() for multi-turn sessions.
+        """
+        agents_helper.set_response_cache(response_cache)
+
     def __init__(
         self,
         name,
@@ -329,7 +387,16 @@ class Agent:
         else:
             self.llm = DEFAULT_AGENT_MODEL
 
-        if not Agent.default_force_recreate:
+        self.local_tools = (
+            self._local_tool_executor(tools) if Agent.default_local_tools else None
+        )
+
+        if Agent.default_reconcile and Agent.exists(self.name):
+            # update the existing agent in place, only where it differs from its definition
+            self._reconcile(guardrail, tools, kb_id, kb_descr, verbose)
+            return
+
+        if not Agent.default_force_recreate and not Agent.default_reconcile:
             # if the agent already exists, get its agent_id and move on.
             try:
                 self.agent_id = agents_helper.get_agent_id_by_name(self.name)
@@ -362,12 +429,7 @@ class Agent:
             # now create a new bedrock agent
             print(f"Creating agent {self.name}...")
 
-            self.instructions = f"Role: {self.role}, \nGoal: {self.goal}, \nInstructions: {self.instructions}"
-
-            # add workaround in instructions, since default prompts can yield hallucinations for tool use calls
-            # if self.tool_code is None and self.tool_defs is None:
-            if tools is None and self.tool_code is None and self.tool_defs is None:
-                self.instructions += Agent.NO_TOOL_USE_INSTRUCTION
+            self.instructions = self._full_instructions(tools)
 
             (self.agent_id, self.agent_alias_id, self.agent_alias_arn) = (
                 agents_helper.create_agent(
@@ -394,7 +456,12 @@ class Agent:
                 self.attach_knowledge_base(kb_id, kb_descr)
 
             # Add tools as Lambda or ROC action groups to support the specified capabilities
-            if tools is None and self.tool_code is not None and self.tool_code != "ROC":
+            if (
+                tools is None
+                and self.tool_code is not None
+                and self.tool_code != "ROC"
+                and self.local_tools is None
+            ):
                 print(f"Adding action group with Lambda: {self.tool_code}...")
                 # Also updated to capture the new alias ID and ARN.
                 # (self.agent_alias_id,
@@ -410,7 +477,7 @@ class Agent:
                     verbose=verbose,
                 )
 
-            elif tools is None and self.tool_code == "ROC":
+            elif tools is None and self.tool_code is not None:
                 print(f"Adding action group with Return of Control...")
                 resp = agents_helper.add_action_group_with_roc(
                     self.agent_id,
@@ -422,6 +489,15 @@ class Agent:
                 _tool_num = 1
                 for _tool in tools:
                     print(f"Adding tool: {_tool['definition']['name']}...")
+                    if self._runs_locally(_tool):
+                        agents_helper.add_action_group_with_roc(
+                            self.agent_id,
+                            [_tool["definition"]],
+                            f"actions_{_tool_num}_{self.name}",
+                            f"Set of functions for {self.name}",
+                        )
+                        _tool_num += 1
+                        continue
                     # print(f"Adding action group for tool: {str(_tool.definition['name'])}...")
                     resp = agents_helper.add_action_group_with_lambda(
                         self.name,
@@ -441,22 +517,151 @@ class Agent:
         )  # wait to be out of "Versioning" state
         agents_helper.prepare(self.name)
         agents_helper.wait_agent_status_update(self.agent_id)
-        _agent_alias = agents_helper._bedrock_agent_client.create_agent_alias(
-            agentAliasName="with-code-ag", agentId=self.agent_id
+        self.agent_alias_id, self.agent_alias_arn = agents_helper.create_agent_alias(
+            self.agent_id, "with-code-ag"
         )
-        self.agent_alias_id = _agent_alias["agentAlias"]["agentAliasId"]
-        self.agent_alias_arn = _agent_alias["agentAlias"]["agentAliasArn"]
 
+        # wait for the alias version to be ready, so a supervisor can associate it right away
+        agents_helper.wait_agent_alias_status_update(self.agent_id, self.agent_alias_id)
         agents_helper.wait_agent_status_update(
             self.agent_id
         )  # wait to be out of "Versioning" state
-        agents_helper.prepare(self.name)
-        agents_helper.wait_agent_status_update(self.agent_id)
 
         print(
             f"DONE: Agent: {self.name}, id: {self.agent_id}, alias id: {self.agent_alias_id}\n"
         )
 
+    def _full_instructions(self, tools: List[Tool] = None) -> str:
+        """Return the agent instructions built from its role, goal and instructions"""
+        _instructions = f"Role: {self.role}, \nGoal: {self.goal}, \nInstructions: {self.instructions}"
+
+        # add workaround in instructions, since default prompts can yield hallucinations for tool use calls
+        # if self.tool_code is None and self.tool_defs is None:
+        if tools is None and self.tool_code is None and self.tool_defs is None:
+            _instructions += Agent.NO_TOOL_USE_INSTRUCTION
+        return _instructions
+
+    def _local_tool_executor(self, tools: List[Dict] = None) -> LocalToolExecutor:
+        """Return an executor running the Lambda code of the agent tools locally, or None if
+        the agent has no tool code that can run locally"""
+        _executor = LocalToolExecutor()
+        if tools is not None:
+            # tools given as Lambda ARNs keep running in Lambda
+            _local_tools = [_tool for _tool in tools if "arn:" not in _tool["code"]]
+            if not _local_tools:
+                return None
+            for _tool in _local_tools:
+                _executor.add_lambda_file(_tool["code"], [_tool["definition"]["name"]])
+        elif (
+            self.tool_code is not None
+            and self.tool_code != "ROC"
+            and "arn:" not in self.tool_code
+        ):
+            _executor.add_lambda_file(
+                self.tool_code, [_def["name"] for _def in self.tool_defs]
+            )
+        else:
+            return None
+        return _executor
+
+    def _runs_locally(self, tool: Dict) -> bool:
+        """Whether a tool of the tools list runs locally, through return of control"""
+        return self.local_tools is not None and "arn:" not in tool["code"]
+
+    def _action_group_specs(self, tools: List[Tool] = None) -> List[Dict]:
+        """Return the action groups of the agent, as created by __init__, in the format
+        expected by AgentsForAmazonBedrock.reconcile_agent()"""
+        if (
+            tools is None
+            and self.tool_code is not None
+            and self.tool_code != "ROC"
+            and self.local_tools is None
+        ):
+            return [
+                {
+                    "action_group_name": f"actions_{self.name}",
+                    "description": f"Set of functions for {self.name}",
+                    "functions": self.tool_defs,
+                    "executor": self.tool_code,
+                    "lambda_function_name": f"{self.name}_ag",
+                    "additional_function_iam_policy": self.additional_function_iam_policy,
+                }
+            ]
+        elif tools is None and self.tool_code is not None:
+            return [
+                {
+                    "action_group_name": f"actions_{self.name}",
+                    "description": f"Set of functions for {self.name}",
+                    "functions": self.tool_defs,
+                    "executor": "ROC",
+                }
+            ]
+        elif tools is not None:
+            return [
+                (
+                    {
+                        "action_group_name": f"actions_{_tool_num}_{self.name}",
+                        "description": f"Set of functions for {self.name}",
+                        "functions": [_tool["definition"]],
+                        "executor": "ROC",
+                    }
+                    if self._runs_locally(_tool)
+                    else {
+                        "action_group_name": f"actions_{_tool_num}_{self.name}",
+                        "description": f"Set of functions for {self.name}",
+                        "functions": [_tool["definition"]],
+                        "executor": _tool["code"],
+                        "lambda_function_name": f"{self.name}_ag",
+                        "additional_function_iam_policy": self.additional_function_iam_policy,
+                    }
+                )
+                for _tool_num, _tool in enumerate(tools, 1)
+            ]
+        return []
+
+    def _reconcile(
+        self,
+        guardrail: Guardrail = None,
+        tools: List[Tool] = None,
+        kb_id: str = None,
+        kb_descr: str = " ",
+        verbose: bool = False,
+    ) -> None:
+        """Update the existing agent so that it matches this definition, then pick up its ids"""
+        print(f"Reconciling agent {self.name}...")
+        self.instructions = self._full_instructions(tools)
+        _changes = agents_helper.reconcile_agent(
+            self.name,
+            dedent(self.instructions[0 : MAX_DESCR_SIZE - 1]),
+            dedent(self.instructions),
+            self.llm,
+            action_groups=self._action_group_specs(tools),
+            kb_id=kb_id,
+            kb_descr=kb_descr,
+            guardrail_id=guardrail.guardrail_id if guardrail is not None else None,
+            code_interpretation=self.code_interpreter,
+            verbose=verbose,
+            check_drift=Agent.default_check_drift,
+        )
+        self.agent_id = agents_helper.get_agent_id_by_name(self.name)
+        self.agent_alias_id = agents_helper.get_agent_latest_alias_id(self.agent_id)
+        if not self.agent_alias_id:
+            # never got an alias, so it can't be used by a supervisor yet
+            self.agent_alias_id, self.agent_alias_arn = (
+                agents_helper.create_agent_alias(self.agent_id, "with-code-ag")
+            )
+            agents_helper.wait_agent_alias_status_update(
+                self.agent_id, self.agent_alias_id
+            )
+        else:
+            self.agent_alias_arn = agents_helper.get_agent_alias_arn(
+                self.agent_id, self.agent_alias_id
+            )
+        if _changes:
+            print(f"DONE: Agent: {self.name} updated: {', '.join(_changes)}\n")
+        else:
+            print(f"DONE: Agent: {self.name} is up to date\n")
+
     def attach_knowledge_base(self, knowledge_base_id: str, description: str):
         """Attach a knowledge base to the agent"""
         agents_helper.wait_agent_status_update(
@@ -468,7 +673,7 @@ class Agent:
 
     def needs_preparation(self) -> bool:
         """Return True if the agent needs to be prepared"""
-        bedrock_agent = boto3.client("bedrock-agent")
+        bedrock_agent = default_context().client("bedrock-agent")
         response = bedrock_agent.get_agent(agentId=self.agent_id)
         agent_info = response["agent"]
 
@@ -486,51 +691,44 @@ class Agent:
         if self.needs_preparation():
             agents_helper.prepare(self.name)
             agents_helper.wait_agent_status_update(self.agent_id)
-            _agent_alias = agents_helper._bedrock_agent_client.create_agent_alias(
-                agentAliasName=alias, agentId=self.agent_id
+            self.agent_alias_id, self.agent_alias_arn = (
+                agents_helper.create_agent_alias(self.agent_id, alias)
             )
-            self.agent_alias_id = _agent_alias["agentAlias"]["agentAliasId"]
-            self.agent_alias_arn = _agent_alias["agentAlias"]["agentAliasArn"]
         else:
             print("Agent already prepared")
 
     @classmethod
     # Return a session state populated with the files from the supplied list of filenames
     def add_file_to_session_state(
-        cls, file_name, use_case="CODE_INTERPRETER", session_state=None
+        cls,
+        file_name,
+        use_case="CODE_INTERPRETER",
+        session_state=None,
+        options: AttachmentOptions = None,
+        cache: AttachmentCache = None,
     ):
-        """Add a file to the session state"""
-        use_case = use_case.upper()
-        if use_case != "CHAT" and use_case != "CODE_INTERPRETER":
-            raise ValueError("Use case must be either 'CHAT' or 'CODE_INTERPRETER'")
-        if not session_state:
-            session_state = {"files": []}
-        type = file_name.split(".")[-1].upper()
-        name = file_name.split("/")[-1]
-
-        if type == "CSV":
-            media_type = "text/csv"
-        elif type in ["XLS", "XLSX"]:
-            media_type = (
-                "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        else:
-            media_type = "text/plain"
-
-        named_file = {
-            "name": name,
-            "source": {
-                "sourceType": "BYTE_CONTENT",
-                "byteContent": {
-                    "mediaType": media_type,
-                    "data": open(file_name, "rb").read(),
-                },
-            },
-            "useCase": use_case,
-        }
-        session_state["files"].append(named_file)
-
-        return session_state
+        """Add a file to the session state. Size limits are checked before the file is read, and
+        prepared files are cached by content, see src.utils.attachments.
+
+        Args:
+            file_name (str): path of the file
+            use_case (str, optional): "CODE_INTERPRETER" or "CHAT". Defaults to "CODE_INTERPRETER".
+            session_state (dict, optional): session state to add the file to. Defaults to a new one.
+            options (AttachmentOptions, optional): column projection and row sampling of a CSV, XLSX
+            or Parquet file, sent as CSV. Parquet files are always converted to CSV. Defaults to None.
+            cache (AttachmentCache, optional): cache of prepared files. Defaults to a cache shared by
+            the process.
+
+        Returns:
+            dict: the session state
+        """
+        return add_files_to_session_state(
+            [file_name],
+            use_case=use_case,
+            session_state=session_state,
+            options=options,
+            cache=cache,
+        )
 
     @classmethod
     def create(
@@ -590,11 +788,31 @@ class Agent:
         enable_trace: bool = False,
         trace_level: str = "none",
         multi_agent_names: dict = {},
+        metrics_callback: Callable = None,
+        trace_dispatcher: TraceDispatcher = None,
+        use_cache: bool = True,
     ):
-        """Invoke the agent with the given input text"""
+        """Invoke the agent with the given input text. metrics_callback, if given, receives the
+        InvocationMetrics of the call, and trace_dispatcher, if given, receives its trace events.
+        Agents with local tools run them in this process through return of control.
+        """
         # if self.needs_preparation():
         #    self.prepare()
 
+        if self.local_tools is not None:
+            return agents_helper.invoke_with_local_tools(
+                input_text,
+                self.agent_id,
+                self.local_tools,
+                session_id=session_id,
+                session_state=session_state,
+                enable_trace=enable_trace,
+                trace_level=trace_level,
+                multi_agent_names=multi_agent_names,
+                metrics_callback=metrics_callback,
+                trace_dispatcher=trace_dispatcher,
+                use_cache=use_cache,
+            )
         return agents_helper.invoke(
             input_text,
             self.agent_id,
@@ -603,6 +821,30 @@ class Agent:
             enable_trace=enable_trace,
             trace_level=trace_level,
             multi_agent_names=multi_agent_names,
+            metrics_callback=metrics_callback,
+            trace_dispatcher=trace_dispatcher,
+            use_cache=use_cache,
+        )
+
+    def invoke_many(
+        self,
+        inputs: List,
+        max_concurrency: int = 4,
+        rate_limit: float = None,
+        max_retries: int = 5,
+        verbose: bool = False,
+    ):
+        """Invoke the agent once per input concurrently, each input in its own session.
+        Agents with local tools run them in this process through return of control.
+        Returns one InvocationResult per input, in input order."""
+        return agents_helper.invoke_many(
+            inputs,
+            self.agent_id,
+            max_concurrency=max_concurrency,
+            rate_limit=rate_limit,
+            max_retries=max_retries,
+            verbose=verbose,
+            local_tools=self.local_tools,
         )
 
     def invoke_roc(
@@ -630,34 +872,48 @@ class Agent:
         session_id: str = str(uuid.uuid1()),
         enable_trace: bool = False,
         trace_level: str = "none",
+        tool_timeout: float = None,
+        max_workers: int = DEFAULT_LOCAL_TOOL_WORKERS,
     ):
-        roc_call = agents_helper.invoke_roc(
-            input_text, self.agent_id, session_id=session_id, enable_trace=enable_trace
-        )
-        invocation_inputs = roc_call["invocationInputs"]
-        for invocation_input in invocation_inputs:
-            function_to_call = invocation_input["functionInvocationInput"]["function"]
-            tool_args = {}
-            for param in invocation_input["functionInvocationInput"]["parameters"]:
-                tool_args[param["name"]] = param["value"]
-
-            function_call_result = getattr(tools_list, function_to_call)(**tool_args)
-
-            final_answer = self.invoke_roc(
-                "",
+        """Invoke the agent with return-of-control, running its tools from tools_list until it
+        answers. All the invocation inputs of each returnControl event run concurrently, and their
+        results are sent back together.
+
+        Args:
+            input_text (str): the text sent to the agent
+            tools_list: the tools, as an object whose methods are the tools, a list of functions
+            or a dictionary of tool names to functions, see LocalToolExecutor.register_tools()
+            session_id (str, optional): the ID of the session
+            enable_trace (bool, optional): whether to print the trace. Defaults to False.
+            trace_level (str, optional): the level of trace printed when enable_trace is set. Defaults to "none".
+            tool_timeout (float, optional): seconds each tool gets before it is answered with an
+            error. Defaults to None: no timeout.
+            max_workers (int, optional): tools running at once. Defaults to DEFAULT_LOCAL_TOOL_WORKERS.
+
+        Returns:
+            str: the answer of the agent
+        """
+        with LocalToolExecutor(
+            max_workers=max_workers, timeout=tool_timeout
+        ).register_tools(tools_list) as _executor:
+            return agents_helper.invoke_with_local_tools(
+                input_text,
+                self.agent_id,
+                _executor,
                 session_id=session_id,
-                function_call=roc_call,
-                function_call_result=function_call_result,
                 enable_trace=enable_trace,
+                trace_level=trace_level,
             )
-            return final_answer
 
     def get_prepared_version(self) -> str:
-        response = bedrock_agent_client.get_agent(agentId=self.agent_id)
+        response = (
+            default_context().client("bedrock-agent").get_agent(agentId=self.agent_id)
+        )
         return response.get("agentVersion")
 
     def has_action_group(self, action_group_name: str) -> bool:
         """Check if an agent already has a specified action group attached"""
+        bedrock_agent_client = default_context().client("bedrock-agent")
         try:
             response = bedrock_agent_client.list_agent_action_groups(
                 agentId=self.agent_id, agentVersion="DRAFT"
@@ -682,12 +938,24 @@ class Agent:
             )
             self.update(new_instructions=instructions)
 
+        _local = Agent.default_local_tools and "arn:" not in tool.code_file
+        if _local:
+            # run the Lambda code of the tool in this process, through return of control
+            if self.local_tools is None:
+                self.local_tools = LocalToolExecutor()
+            self.local_tools.add_lambda_file(tool.code_file, [tool.name])
+
         # add_action_group_with_lambda() doesn't check if the lambda already exists, we need to
         if self.has_action_group(tool.name):
             print(f"Action group {tool.name} already exists, skipping...")
             return
 
         tool_defs = [tool.to_action_group_definition()]
+        if _local:
+            agents_helper.add_action_group_with_roc(
+                self.agent_id, tool_defs, tool.name, f"actions for {tool.description}"
+            )
+            return
         agents_helper.add_action_group_with_lambda(
             self.name,
             tool.name,
@@ -781,6 +1049,26 @@ class Agent:
         """Delete the agent by name"""
         agents_helper.delete_agent(agent_name, delete_role_flag=True, verbose=verbose)
 
+    @classmethod
+    def delete_many(
+        cls,
+        agent_names: List[str] = None,
+        name_prefix: str = None,
+        tags: Dict[str, str] = None,
+        force: bool = False,
+        verbose: bool = False,
+    ):
+        """Delete agents concurrently, by name, name prefix or tags, with their aliases, Lambda
+        functions and IAM roles. Agents still in use are only deleted with force. Returns a
+        TeardownResult"""
+        return agents_helper.delete_agents(
+            agent_names,
+            name_prefix=name_prefix,
+            tags=tags,
+            force=force,
+            verbose=verbose,
+        )
+
     @classmethod
     def exists(cls, agent_name: str):
         return agents_helper.get_agent_id_by_name(agent_name) is not None
@@ -1069,6 +1357,59 @@ class SupervisorAgent:
             verbose=verbose,
         )
 
+    @classmethod
+    def create_team(
+        cls,
+        name: str,
+        yaml_content,
+        collaborator_builders: Dict[str, Callable[[], Agent]],
+        guardrail: Guardrail = None,
+        kb_id: str = None,
+        kb_descr: str = " ",
+        llm: str = None,
+        max_workers: int = DEFAULT_PROVISIONING_CONCURRENCY,
+        verbose: bool = False,
+    ):
+        """Create the collaborators of a supervisor concurrently, then the supervisor itself once they
+        are all ready. Each collaborator is built by calling its builder, e.g.
+        lambda: Agent("activity_finder", yaml_content, tools=[...]).
+
+        Args:
+            name (str): name of the supervisor agent
+            yaml_content (dict): supervisor definitions, as for SupervisorAgent()
+            collaborator_builders (Dict[str, Callable]): collaborator name to a function that creates that Agent
+            max_workers (int, optional): maximum number of collaborators created at once. Defaults to DEFAULT_PROVISIONING_CONCURRENCY.
+
+        Returns:
+            SupervisorAgent: the supervisor, with its collaborators in collaborator_objects
+        """
+        if name in collaborator_builders:
+            raise ValueError(
+                f"Collaborator '{name}' has the same name as its supervisor"
+            )
+
+        _builders = {
+            _collab_name: lambda _deps, _build=_build: _build()
+            for _collab_name, _build in collaborator_builders.items()
+        }
+        _builders[name] = lambda _deps: cls(
+            name,
+            yaml_content,
+            [_deps[_collab_name] for _collab_name in collaborator_builders],
+            guardrail=guardrail,
+            kb_id=kb_id,
+            kb_descr=kb_descr,
+            llm=llm,
+            verbose=verbose,
+        )
+        _team = provision(
+            _builders,
+            depends_on={name: list(collaborator_builders)},
+            max_workers=max_workers,
+            verbose=verbose,
+        )
+        return _team[name]
+
     def _get_collab_alias_arn(self, collab_name):
         # print(f"Finding argn for collab: {collab_name}")
         for _collab_obj in self.collaborator_objects:
@@ -1087,6 +1428,9 @@ class SupervisorAgent:
         trace_level: str = "core",
         session_state: dict = {},
         multi_agent_names: dict = {},
+        metrics_callback: Callable = None,
+        trace_dispatcher: TraceDispatcher = None,
+        use_cache: bool = True,
     ):
         if multi_agent_names == {}:
             multi_agent_names = self.multi_agent_names
@@ -1099,6 +1443,30 @@ class SupervisorAgent:
             session_state=session_state,
             trace_level=trace_level,
             multi_agent_names=multi_agent_names,
+            metrics_callback=metrics_callback,
+            trace_dispatcher=trace_dispatcher,
+            use_cache=use_cache,
+        )
+
+    def invoke_many(
+        self,
+        inputs: List,
+        max_concurrency: int = 4,
+        rate_limit: float = None,
+        max_retries: int = 5,
+        verbose: bool = False,
+    ):
+        """Invoke the supervisor once per input concurrently, each input in its own session.
+        Returns one InvocationResult per input, in input order."""
+        return agents_helper.invoke_many(
+            inputs,
+            self.supervisor_agent_id,
+            agent_alias_id=self.supervisor_agent_alias_id,
+            max_concurrency=max_concurrency,
+            rate_limit=rate_limit,
+            max_retries=max_retries,
+            multi_agent_names=self.multi_agent_names,
+            verbose=verbose,
         )
 
     def invoke_with_tasks(
@@ -1109,6 +1477,8 @@ class SupervisorAgent:
         enable_trace: bool = False,
         trace_level: str = "none",
         verbose: bool = False,
+        trace_dispatcher: TraceDispatcher = None,
+        use_cache: bool = True,
     ):
         prompt = ""
         if processing_type == "sequential":
@@ -1158,6 +1528,8 @@ be sure to include the details as input to the task.\n\n"""
             enable_trace=enable_trace,
             trace_level=trace_level,
             multi_agent_names=self.multi_agent_names,
+            trace_dispatcher=trace_dispatcher,
+            use_cache=use_cache,
         )
         return result
 
@@ -7,26 +7,51 @@ The AgentsForAmazonBedrock class provides a convenient interface for working wit
 It includes methods for creating, updating, and invoking Agents, as well as managing
 IAM roles and Lambda functions for action groups.
 """
-import copy
 
-import boto3
+import asyncio
+import hashlib
+import importlib.util
 import json
+import random
+import threading
 import time
 import uuid
-import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from dateutil.tz import tzutc
 import os
 import datetime
-from io import BytesIO
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Any, Iterator, AsyncIterator, Union
 import re
-from boto3.session import Session
-from botocore.config import Config
+from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
 import inspect
 from typing import Callable
 from textwrap import dedent
 
+from .agent_trace import (
+    TRACE_TRUNCATION_LENGTH,
+    UNDECIDABLE_CLASSIFICATION,
+    TraceContext,
+    TraceDispatcher,
+    console_trace_dispatcher,
+    print_trace_summary,
+)
+from . import action_group_runtime
+from .agent_metrics import InvocationMetrics, metrics_trace_dispatcher
+from .aws_context import DEFAULT_MAX_POOL_CONNECTIONS, AwsContext, default_context
+from .lambda_packaging import (
+    LambdaPackage,
+    build_package,
+    code_sha256,
+    deploy_function_code,
+    publish_dependency_layer,
+)
+from .local_tools import LocalToolExecutor
+from .provisioning import provision
+from .response_cache import ResponseCache
+from .waiters import DEFAULT_WAIT_TIMEOUT, poll_until, wait_for_all
+
 # import matplotlib.pyplot as plt
 # import matplotlib.image as mpimg
 # from IPython.display import display, Markdown
@@ -40,9 +65,36 @@ PYTHON_TIMEOUT = 180
 PYTHON_RUNTIME = "python3.12"
 DEFAULT_ALIAS = "TSTALIASID"
 DEFAULT_CI_ACTION_GROUP_NAME = "CodeInterpreterAction"
-UNDECIDABLE_CLASSIFICATION = "undecidable"
 ROUTER_MODEL = "us.anthropic.claude-3-haiku-20240307-v1:0"
-TRACE_TRUNCATION_LENGTH = 300
+DEFAULT_AGENT_INDEX_TTL = 300  # seconds before the agent name index is listed again
+# returnControl events handled before giving up on an answer
+DEFAULT_MAX_ROC_ROUNDS = 10
+# threads of the executor shared by astream() and ainvoke() without aiobotocore: sessions
+# streamed at once, one connection each of the runtime client pool
+DEFAULT_ASYNC_STREAM_WORKERS = DEFAULT_MAX_POOL_CONNECTIONS
+# astream() and ainvoke() use non-blocking aiobotocore clients when it is installed
+_AIOBOTOCORE_AVAILABLE = importlib.util.find_spec("aiobotocore") is not None
+DEFAULT_TEARDOWN_CONCURRENCY = 8
+AGENT_SPEC_FINGERPRINT_TAG = "agent-spec-fingerprint"
+# clients resolved through the AWS context on first use: attribute -> (service, Config options)
+_CONTEXT_CLIENTS = {
+    "_bedrock_agent_client": ("bedrock-agent", {}),
+    # invocations can run for minutes
+    "_bedrock_agent_runtime_client": ("bedrock-agent-runtime", {"read_timeout": 600}),
+    "_sts_client": ("sts", {}),
+    "_iam_client": ("iam", {}),
+    "_lambda_client": ("lambda", {}),
+    "_s3_client": ("s3", {}),
+    "_dynamodb_client": ("dynamodb", {}),
+}
+THROTTLING_ERROR_CODES = [
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+]
+_RUNTIME_IMPORT = re.compile(
+    rf"^\s*(from|import)\s+{action_group_runtime.RUNTIME_MODULE}\b", re.MULTILINE
+)
 
 # TODO: Take advantage of a default execution role so that we do not need to have lengthy
 # waiting times when creating a new Agent or new Lambda to give time for the IAM role to
@@ -119,40 +171,328 @@ DEFAULT_AGENT_IAM_POLICY = {
     ],
 }
 
+# Types of events yielded by AgentsForAmazonBedrock.stream() and astream()
+STREAM_EVENT_CHUNK = "chunk"
+STREAM_EVENT_CITATION = "citation"
+STREAM_EVENT_TRACE = "trace"
+STREAM_EVENT_RETURN_CONTROL = "returnControl"
+STREAM_EVENT_FILES = "files"
+
 # # setting logger
 # logging.basicConfig(format='[%(asctime)s] p%(process)s {%(filename)s:%(lineno)d} %(levelname)s - %(message)s', level=logging.INFO)
 # logger = logging.getLogger(__name__)
 
 
-class AgentsForAmazonBedrock:
-    """Provides an easy to use wrapper for Agents for Amazon Bedrock."""
+@dataclass
+class AgentStreamEvent:
+    """A single typed event from an invokeAgent completion stream.
+
+    Attributes:
+        type (str): one of "chunk", "citation", "trace", "returnControl" or "files"
+        data (Any): decoded answer text for "chunk", the list of citations for "citation",
+            and the corresponding raw payload for every other type
+        raw (Dict): the raw event as received from the completion stream
+    """
 
-    def __init__(self):
-        """Constructs an instance."""
-        self._boto_session = Session()
-        self._region = self._boto_session.region_name
-        self._account_id = boto3.client("sts").get_caller_identity()["Account"]
+    type: str
+    data: Any
+    raw: Dict = None
 
-        self._bedrock_agent_client = boto3.client("bedrock-agent")
 
-        long_invoke_time_config = Config(read_timeout=600)
-        self._bedrock_agent_runtime_client = boto3.client(
-            "bedrock-agent-runtime", config=long_invoke_time_config
+def _to_stream_events(event: Dict) -> List[AgentStreamEvent]:
+    """Converts one raw completion stream event into typed AgentStreamEvents."""
+    _events = []
+    if "chunk" in event:
+        _chunk = event["chunk"]
+        _events.append(
+            AgentStreamEvent(
+                STREAM_EVENT_CHUNK, _chunk.get("bytes", b"").decode("utf8"), event
+            )
+        )
+        _citations = _chunk.get("attribution", {}).get("citations")
+        if _citations:
+            _events.append(AgentStreamEvent(STREAM_EVENT_CITATION, _citations, event))
+    if "returnControl" in event:
+        _events.append(
+            AgentStreamEvent(STREAM_EVENT_RETURN_CONTROL, event["returnControl"], event)
         )
+    if "trace" in event:
+        _events.append(AgentStreamEvent(STREAM_EVENT_TRACE, event["trace"], event))
+    if "files" in event:
+        _events.append(AgentStreamEvent(STREAM_EVENT_FILES, event["files"], event))
+    return _events
+
+
+@dataclass
+class InvocationResult:
+    """Outcome of one input of an AgentsForAmazonBedrock.invoke_many() batch.
+
+    Attributes:
+        index (int): position of the input in the batch
+        input_text (str): the text sent to the agent
+        session_id (str): the session used for this input
+        output (Any): the answer from the agent, or None if the invocation failed
+        error (Exception): the last error raised, or None if the invocation succeeded
+        attempts (int): number of invokeAgent attempts made, including retries
+        duration (float): seconds spent on this input, including backoff
+    """
+
+    index: int
+    input_text: str
+    session_id: str
+    output: Any = None
+    error: Exception = None
+    attempts: int = 0
+    duration: float = 0.0
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class TeardownResult:
+    """Outcome of AgentsForAmazonBedrock.delete_agents().
+
+    Attributes:
+        deleted (List[str]): the resources deleted, e.g. "agent my_agent" or "lambda my_agent_ag"
+        errors (Dict[str, str]): the resources that could not be deleted, with the error
+    """
+
+    deleted: List[str] = field(default_factory=list)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def succeeded(self) -> bool:
+        return not self.errors
+
+
+class _RateLimiter:
+    """Thread-safe limiter that spaces calls to at most `rate` per second."""
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            _now = time.monotonic()
+            _wait = self._next_slot - _now
+            self._next_slot = max(_now, self._next_slot) + self._interval
+        if _wait > 0:
+            time.sleep(_wait)
+
+
+_async_stream_executor: ThreadPoolExecutor = None
+_async_stream_executor_lock = threading.Lock()
+
+
+def _default_async_stream_executor() -> ThreadPoolExecutor:
+    """Returns the executor of astream() and ainvoke() when none is given, built on first use."""
+    global _async_stream_executor
+    if _async_stream_executor is None:
+        with _async_stream_executor_lock:
+            if _async_stream_executor is None:
+                _async_stream_executor = ThreadPoolExecutor(
+                    max_workers=DEFAULT_ASYNC_STREAM_WORKERS,
+                    thread_name_prefix="agent-stream",
+                )
+    return _async_stream_executor
+
+
+def _is_throttling_error(error: BaseException) -> bool:
+    """Returns True if the error, or an error it wraps, is an AWS throttling error."""
+    _pending = [error]
+    while _pending:
+        _error = _pending.pop()
+        if isinstance(_error, ClientError):
+            if _error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+                return True
+        elif isinstance(_error, BaseException):
+            _pending.extend(_error.args)
+            if _error.__cause__ is not None:
+                _pending.append(_error.__cause__)
+    return False
+
+
+class AgentsForAmazonBedrock:
+    """Provides an easy to use wrapper for Agents for Amazon Bedrock."""
+
+    def __init__(
+        self,
+        agent_index_ttl: int = DEFAULT_AGENT_INDEX_TTL,
+        agent_index_file: str = None,
+        response_cache: ResponseCache = None,
+        context: AwsContext = None,
+    ):
+        """Constructs an instance. Clients, region and account id are resolved on first use.
+
+        Args:
+            agent_index_ttl (int, optional): Seconds an in-process index of agent names to ids is
+            trusted before all agents are listed again. Defaults to DEFAULT_AGENT_INDEX_TTL.
+            agent_index_file (str, optional): Path of a JSON snapshot of that index, shared across
+            runs while it is younger than agent_index_ttl. Defaults to None (no snapshot).
+            response_cache (ResponseCache, optional): Cache of answers used by invoke() and
+            invoke_inline_agent(). Defaults to None (no caching).
+            context (AwsContext, optional): Session and clients to use. Defaults to the default
+            context at first use.
+        """
+        self._context = context
+
+        self._agent_index_ttl = agent_index_ttl
+        self._agent_index_file = agent_index_file
+        self._agent_index = None
+        self._agent_index_loaded_at = 0.0
+        self._agent_index_lock = threading.RLock()
+        self._latest_alias_ids = {}
+        self._load_agent_index_snapshot()
+        self._response_cache = response_cache
+
+    def __getattr__(self, name: str) -> Any:
+        """Resolves the clients, region and account id through the AWS context on first use,
+        and keeps them as attributes."""
+        if name in _CONTEXT_CLIENTS:
+            _service_name, _config_options = _CONTEXT_CLIENTS[name]
+            _value = self._aws_context().client(_service_name, **_config_options)
+        elif name == "_dynamodb_resource":
+            _value = self._aws_context().resource("dynamodb")
+        elif name == "_boto_session":
+            _value = self._aws_context().session
+        elif name == "_region":
+            _value = self._aws_context().region
+        elif name == "_account_id":
+            _value = self._aws_context().account_id
+        elif name == "_suffix":
+            _value = self._aws_context().suffix
+        else:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'"
+            )
+        setattr(self, name, _value)
+        return _value
 
-        self._sts_client = boto3.client("sts")
-        self._iam_client = boto3.client("iam")
-        self._lambda_client = boto3.client("lambda")
-        self._s3_client = boto3.client("s3", region_name=self._region)
-        self._dynamodb_client = boto3.client("dynamodb", region_name=self._region)
-        self._dynamodb_resource = boto3.resource("dynamodb", region_name=self._region)
+    def _aws_context(self) -> AwsContext:
+        _context = self.__dict__.get("_context")
+        return _context if _context is not None else default_context()
 
-        self._suffix = f"{self._region}-{self._account_id}"
+    def set_response_cache(self, response_cache: ResponseCache) -> None:
+        """Sets the cache of answers used by invoke() and invoke_inline_agent(), None to disable it."""
+        self._response_cache = response_cache
 
     def get_region(self) -> str:
         """Returns the region for this instance."""
         return self._region
 
+    def _load_agent_index_snapshot(self) -> None:
+        """Loads the agent index from the on-disk snapshot, if one is configured and still fresh."""
+        if self._agent_index_file is None or not os.path.exists(self._agent_index_file):
+            return
+        try:
+            with open(self._agent_index_file, "r") as f:
+                _snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(
+                f"Ignoring unreadable agent index snapshot {self._agent_index_file}: {e}"
+            )
+            return
+        if (
+            _snapshot.get("account_id") == self._account_id
+            and _snapshot.get("region") == self._region
+            and time.time() - _snapshot.get("loaded_at", 0) < self._agent_index_ttl
+        ):
+            self._agent_index = _snapshot["agents"]
+            self._agent_index_loaded_at = _snapshot["loaded_at"]
+
+    def _save_agent_index_snapshot(self) -> None:
+        """Writes the agent index to the on-disk snapshot, if one is configured."""
+        if self._agent_index_file is None or self._agent_index is None:
+            return
+        _tmp_file = f"{self._agent_index_file}.tmp"
+        with open(_tmp_file, "w") as f:
+            json.dump(
+                {
+                    "account_id": self._account_id,
+                    "region": self._region,
+                    "loaded_at": self._agent_index_loaded_at,
+                    "agents": self._agent_index,
+                },
+                f,
+            )
+        os.replace(_tmp_file, self._agent_index_file)
+
+    def refresh_agent_index(self) -> Dict[str, Dict]:
+        """Lists all agents in the account, following pagination, and rebuilds the index of
+        agent names to ids and ARNs.
+
+        Returns:
+            Dict[str, Dict]: agent name to {"agentId", "agentArn"}
+        """
+        _index = {}
+        _paginator = self._bedrock_agent_client.get_paginator("list_agents")
+        for _page in _paginator.paginate(PaginationConfig={"PageSize": 100}):
+            for _summary in _page["agentSummaries"]:
+                _index[_summary["agentName"]] = {
+                    "agentId": _summary["agentId"],
+                    "agentArn": f"arn:aws:bedrock:{self._region}:{self._account_id}:agent/{_summary['agentId']}",
+                }
+        with self._agent_index_lock:
+            self._agent_index = _index
+            self._agent_index_loaded_at = time.time()
+            self._save_agent_index_snapshot()
+        return _index
+
+    def invalidate_agent_index(self) -> None:
+        """Forgets the agent name index and cached aliases, so the next lookup lists agents again."""
+        with self._agent_index_lock:
+            self._agent_index = None
+            self._agent_index_loaded_at = 0.0
+            self._latest_alias_ids = {}
+            if self._agent_index_file is not None and os.path.exists(
+                self._agent_index_file
+            ):
+                os.remove(self._agent_index_file)
+
+    def _remember_agent(self, agent_name: str, agent_id: str, agent_arn: str) -> None:
+        """Records a newly created agent in the index without listing all agents again."""
+        with self._agent_index_lock:
+            if self._agent_index is not None:
+                self._agent_index[agent_name] = {
+                    "agentId": agent_id,
+                    "agentArn": agent_arn,
+                }
+                self._save_agent_index_snapshot()
+
+    def _forget_agent(self, agent_name: str, agent_id: str = None) -> None:
+        """Removes a deleted agent and its cached aliases from the index."""
+        with self._agent_index_lock:
+            if self._agent_index is not None:
+                self._agent_index.pop(agent_name, None)
+                self._save_agent_index_snapshot()
+            self._latest_alias_ids.pop(agent_id, None)
+
+    def _lookup_agent(self, agent_name: str) -> Dict:
+        """Finds an agent in the index, listing agents when the index is stale, or once more on
+        a miss in case the agent was created by another process.
+
+        Returns:
+            Dict: {"agentId", "agentArn"} for the agent, or None if not found
+        """
+        with self._agent_index_lock:
+            _index = self._agent_index
+            _is_fresh = (
+                _index is not None
+                and time.time() - self._agent_index_loaded_at < self._agent_index_ttl
+            )
+        _just_listed = False
+        if not _is_fresh:
+            _index = self.refresh_agent_index()
+            _just_listed = True
+        _entry = _index.get(agent_name)
+        if _entry is None and not _just_listed:
+            _entry = self.refresh_agent_index().get(agent_name)
+        return _entry
+
     def _create_lambda_iam_role(
         self,
         agent_name: str,
@@ -295,6 +635,9 @@ class AgentsForAmazonBedrock:
         Returns:
             str: Latest alias ID
         """
+        if agent_id in self._latest_alias_ids:
+            return self._latest_alias_ids[agent_id]
+
         _agent_aliases = self._bedrock_agent_client.list_agent_aliases(
             agentId=agent_id, maxResults=100
         )
@@ -321,6 +664,8 @@ class AgentsForAmazonBedrock:
             print(f"  updated at: {_latest_update}")
             print(f"  alias name: {_alias_name}\n")  # , version: {_alias_version}\n")
 
+        if _latest_alias_id:
+            self._latest_alias_ids[agent_id] = _latest_alias_id
         return _latest_alias_id
 
     def get_agent_alias_arn(
@@ -349,11 +694,7 @@ class AgentsForAmazonBedrock:
         Returns:
             str: Agent ID, or None if not found
         """
-        _get_agents_resp = self._bedrock_agent_client.list_agents(maxResults=100)
-        _agents_json = _get_agents_resp["agentSummaries"]
-        _target_agent = next(
-            (agent for agent in _agents_json if agent["agentName"] == agent_name), None
-        )
+        _target_agent = self._lookup_agent(agent_name)
         if _target_agent is None:
             return None
         else:
@@ -385,11 +726,10 @@ class AgentsForAmazonBedrock:
         Returns:
             str: Agent ARN, or None if not found
         """
-        _agent_id = self.get_agent_id_by_name(agent_name)
-        if _agent_id is None:
+        _target_agent = self._lookup_agent(agent_name)
+        if _target_agent is None:
             raise ValueError(f"Agent {agent_name} not found")
-        _get_agent_resp = self._bedrock_agent_client.get_agent(agentId=_agent_id)
-        return _get_agent_resp["agent"]["agentArn"]
+        return _target_agent["agentArn"]
 
     def get_agent_instructions_by_name(self, agent_name: str) -> str:
         """Gets the current Agent Instructions that are used by the specified Agent.
@@ -417,13 +757,17 @@ class AgentsForAmazonBedrock:
             lambda_function_name (str): Name of the Lambda function
         """
         # Create allow invoke permission on lambda
-        _permission_resp = self._lambda_client.add_permission(
-            FunctionName=lambda_function_name,
-            StatementId=f"allow_bedrock_{agent_id}",
-            Action="lambda:InvokeFunction",
-            Principal="bedrock.amazonaws.com",
-            SourceArn=f"arn:aws:bedrock:{self._region}:{self._account_id}:agent/{agent_id}",
-        )
+        try:
+            _permission_resp = self._lambda_client.add_permission(
+                FunctionName=lambda_function_name,
+                StatementId=f"allow_bedrock_{agent_id}",
+                Action="lambda:InvokeFunction",
+                Principal="bedrock.amazonaws.com",
+                SourceArn=f"arn:aws:bedrock:{self._region}:{self._account_id}:agent/{agent_id}",
+            )
+        except self._lambda_client.exceptions.ResourceConflictException:
+            # already allowed, e.g. when redeploying the function
+            pass
 
     def _make_agent_string(self, agent_arns: List[str] = None) -> str:
         """Makes a comma separated string of agent ids from a list of agent ARNs.
@@ -439,6 +783,42 @@ class AgentsForAmazonBedrock:
                 _agent_string += _agent_arn.split("/")[1] + ","
             return _agent_string.strip()[:-1]
 
+    def _package_lambda_code(
+        self, source_code_file: str, package_paths: List[str] = None
+    ) -> bytes:
+        """Zips a Lambda source file, and the files it imports, deterministically: the same sources
+        always give the same bytes, so the CodeSha256 of a deployed function tells whether its code changed.
+
+        Handlers importing action_group_runtime get the module packaged next to them.
+
+        Args:
+            source_code_file (str): Name of the file containing the Lambda source code.
+            package_paths (List[str], Optional): Other files and directories to package, relative to
+            the directory of source_code_file.
+
+        Returns:
+            bytes: content of the zip file
+        """
+        _base_dir = os.path.dirname(source_code_file)
+        _paths = [source_code_file] + [
+            os.path.join(_base_dir, _path) for _path in package_paths or []
+        ]
+        _extra_files = {}
+        with open(source_code_file, "r") as f:
+            if _RUNTIME_IMPORT.search(f.read()):
+                _extra_files[f"{action_group_runtime.RUNTIME_MODULE}.py"] = (
+                    action_group_runtime.__file__
+                )
+        return build_package(
+            _paths, base_dir=_base_dir, extra_files=_extra_files
+        ).zip_content
+
+    @staticmethod
+    def _code_sha256(zip_content: bytes) -> str:
+        """Returns the hash of a Lambda deployment package, in the format of the CodeSha256
+        returned by the Lambda API."""
+        return code_sha256(zip_content)
+
     def create_lambda(
         self,
         agent_name: str,
@@ -447,8 +827,11 @@ class AgentsForAmazonBedrock:
         additional_function_iam_policy: Dict = None,
         sub_agent_arns: List[str] = None,
         dynamo_args: List[str] = None,
+        package_paths: List[str] = None,
+        requirements: List[str] = None,
     ) -> str:
         """Creates a new Lambda function that implements a set of actions for an Agent Action Group.
+        If the function already exists, its code is only uploaded if it changed.
 
         Args:
             agent_name (str): Name of the existing Agent that this Lambda will support.
@@ -457,6 +840,10 @@ class AgentsForAmazonBedrock:
             Must be a local file, and use underscores, not hyphens.
             additional_function_iam_policy (Dict, Optional): Additional IAM policy to attach to the Lambda function. Defaults to None.
             sub_agent_arns (List[str], Optional): List of ARNs of the sub-agents that this Lambda is allowed to invoke.
+            package_paths (List[str], Optional): Other files and directories of the function, relative to
+            the directory of source_code_file, e.g. the modules the handler imports. Defaults to None.
+            requirements (List[str], Optional): pip requirements of the function, e.g. ["requests", "pandas"].
+            They are installed in a layer, reused by every function with the same requirements. Defaults to None.
 
         Returns:
             str: ARN of the new Lambda function
@@ -466,14 +853,11 @@ class AgentsForAmazonBedrock:
         if _agent_id is None:
             return "Agent not found"
 
-        _base_filename = source_code_file.split(".py")[0]
+        _base_filename = os.path.basename(source_code_file).split(".py")[0]
 
         # Package up the lambda function code
-        s = BytesIO()
-        z = zipfile.ZipFile(s, "w")
-        z.write(f"{source_code_file}")
-        z.close()
-        zip_content = s.getvalue()
+        zip_content = self._package_lambda_code(source_code_file, package_paths)
+        _layers = self._dependency_layers(requirements)
         # TODO: make this an optional keyword arg. only supply it when sub-agent-arns are provided or DynamoDB variables are provided
         if sub_agent_arns:
             env_variables = {
@@ -495,20 +879,64 @@ class AgentsForAmazonBedrock:
             lambda_role = self._create_lambda_iam_role(agent_name, sub_agent_arns)
 
         # Create Lambda Function
-        _lambda_function = self._lambda_client.create_function(
-            FunctionName=lambda_function_name,
-            Runtime=PYTHON_RUNTIME,
-            Timeout=PYTHON_TIMEOUT,
-            Role=lambda_role,
-            Code={"ZipFile": zip_content},
-            Handler=f"{_base_filename}.lambda_handler",
-            Environment=env_variables,
-        )
+        try:
+            _lambda_function = self._lambda_client.create_function(
+                FunctionName=lambda_function_name,
+                Runtime=PYTHON_RUNTIME,
+                Timeout=PYTHON_TIMEOUT,
+                Role=lambda_role,
+                Code={"ZipFile": zip_content},
+                Handler=f"{_base_filename}.lambda_handler",
+                Environment=env_variables,
+                Layers=_layers,
+            )
+        except self._lambda_client.exceptions.ResourceConflictException:
+            # redeploy: skip the upload when the code did not change
+            deploy_function_code(
+                self._lambda_client,
+                lambda_function_name,
+                LambdaPackage(zip_content, []),
+            )
+            _lambda_function = self._lambda_client.get_function_configuration(
+                FunctionName=lambda_function_name
+            )
+            self._update_function_layers(_lambda_function, _layers)
 
         self._allow_agent_lambda(_agent_id, lambda_function_name)
 
         return _lambda_function["FunctionArn"]
 
+    def _dependency_layers(self, requirements: List[str] = None) -> List[str]:
+        """Returns the layer ARNs of a function with these pip requirements, publishing the
+        dependency layer if needed."""
+        if not requirements:
+            return []
+        return [
+            publish_dependency_layer(
+                self._lambda_client, requirements, runtime=PYTHON_RUNTIME
+            )
+        ]
+
+    def _update_function_layers(
+        self, function_configuration: Dict, layers: List[str]
+    ) -> bool:
+        """Sets the layers of a deployed function, if they differ from its configuration.
+
+        Returns:
+            bool: whether the function was updated
+        """
+        if [
+            _layer["Arn"] for _layer in function_configuration.get("Layers", [])
+        ] == layers:
+            return False
+        self._lambda_client.update_function_configuration(
+            FunctionName=function_configuration["FunctionName"], Layers=layers
+        )
+        self._lambda_client.get_waiter("function_updated").wait(
+            FunctionName=function_configuration["FunctionName"]
+        )
+        return True
+
     def delete_lambda(
         self, lambda_function_name: str, delete_role_flag: bool = True
     ) -> None:
@@ -553,11 +981,7 @@ class AgentsForAmazonBedrock:
         Returns:
             str: ARN of the IAM role, or None if not found
         """
-        _get_agents_resp = self._bedrock_agent_client.list_agents(maxResults=100)
-        _agents_json = _get_agents_resp["agentSummaries"]
-        _target_agent = next(
-            (agent for agent in _agents_json if agent["agentName"] == agent_name), None
-        )
+        _target_agent = self._lookup_agent(agent_name)
         if _target_agent is not None:
             # pprint.pp(_target_agent)
             _agent_id = _target_agent["agentId"]
@@ -579,51 +1003,26 @@ class AgentsForAmazonBedrock:
         """
 
         # first find the agent ID from the agent Name
-        _get_agents_resp = self._bedrock_agent_client.list_agents(maxResults=100)
-        _agents_json = _get_agents_resp["agentSummaries"]
-        _target_agent = next(
-            (agent for agent in _agents_json if agent["agentName"] == agent_name), None
-        )
+        _target_agent = self._lookup_agent(agent_name)
 
         if _target_agent is None:
             print(f"Agent {agent_name} not found")
             return
 
-        if _target_agent is not None and verbose:
-            print(
-                f"Found target agent, name: {agent_name}, id: {_target_agent['agentId']}"
-            )
-
-        # Delete the agent aliases
-        if _target_agent is not None:
-            _agent_id = _target_agent["agentId"]
-
-            if verbose:
-                print(f"Deleting aliases for agent {_agent_id}...")
-
-            try:
-                _agent_aliases = self._bedrock_agent_client.list_agent_aliases(
-                    agentId=_agent_id, maxResults=100
-                )
-                for alias in _agent_aliases["agentAliasSummaries"]:
-                    alias_id = alias["agentAliasId"]
-                    print(f"Deleting alias {alias_id} from agent {_agent_id}")
-                    response = self._bedrock_agent_client.delete_agent_alias(
-                        agentAliasId=alias_id, agentId=_agent_id
-                    )
-            except Exception as e:
-                print(f"Error deleting aliases: {e}")
-                pass
+        _agent_id = _target_agent["agentId"]
+        if verbose:
+            print(f"Found target agent, name: {agent_name}, id: {_agent_id}")
+            print(f"Deleting aliases for agent {_agent_id}...")
 
-        # if the agent exists, delete the agent
-        if _target_agent is not None:
-            _agent_id = _target_agent["agentId"]
+        try:
+            self._delete_agent_aliases(_agent_id, verbose=True)
+        except Exception as e:
+            print(f"Error deleting aliases: {e}")
 
-            if verbose:
-                print(f"Deleting agent: {_agent_id}...")
-            time.sleep(5)
-            self._bedrock_agent_client.delete_agent(agentId=_agent_id)
-            time.sleep(5)
+        if verbose:
+            print(f"Deleting agent: {_agent_id}...")
+        self._delete_agent_and_wait(_agent_id)
+        self._forget_agent(agent_name, _agent_id)
 
         # TODO: add delete_lambda_flag parameter to optionall take care of
         # deleting the lambda function associated with the agent.
@@ -633,34 +1032,338 @@ class AgentsForAmazonBedrock:
             _agent_role_name = f"AmazonBedrockExecutionRoleForAgents_{agent_name}"
             if verbose:
                 print(f"Deleting IAM role: {_agent_role_name}...")
-
             try:
-                self._iam_client.delete_role_policy(
-                    PolicyName="bedrock_gr_allow_policy", RoleName=_agent_role_name
-                )
+                self._delete_role(_agent_role_name)
             except Exception as e:
-                pass
+                print(f"Error deleting role {_agent_role_name}: {e}")
 
-            try:
-                self._iam_client.delete_role_policy(
-                    PolicyName="bedrock_allow_policy", RoleName=_agent_role_name
+        return
+
+    def _delete_agent_aliases(
+        self,
+        agent_id: str,
+        timeout: float = DEFAULT_WAIT_TIMEOUT,
+        verbose: bool = False,
+    ) -> None:
+        """Deletes all the aliases of an agent, and waits until they are gone."""
+        _alias_ids = []
+        _paginator = self._bedrock_agent_client.get_paginator("list_agent_aliases")
+        for _page in _paginator.paginate(agentId=agent_id):
+            for _alias in _page["agentAliasSummaries"]:
+                if verbose:
+                    print(
+                        f"Deleting alias {_alias['agentAliasId']} from agent {agent_id}"
+                    )
+                self._bedrock_agent_client.delete_agent_alias(
+                    agentId=agent_id, agentAliasId=_alias["agentAliasId"]
                 )
-            except Exception as e:
-                pass
+                _alias_ids.append(_alias["agentAliasId"])
+        wait_for_all(
+            {
+                _alias_id: lambda _cancel_event, _alias_id=_alias_id: self.wait_agent_alias_status_update(
+                    agent_id, _alias_id, timeout=timeout, cancel_event=_cancel_event
+                )
+                for _alias_id in _alias_ids
+            }
+        )
+        with self._agent_index_lock:
+            self._latest_alias_ids.pop(agent_id, None)
 
-            try:
-                self._iam_client.delete_role_policy(
-                    PolicyName="bedrock_kb_allow_policy", RoleName=_agent_role_name
+    def _delete_agent_and_wait(
+        self,
+        agent_id: str,
+        timeout: float = DEFAULT_WAIT_TIMEOUT,
+        force: bool = False,
+    ) -> None:
+        """Deletes an agent, and waits until it is gone. Unless force is set, an agent that is
+        still in use, e.g. as the collaborator of a supervisor, is not deleted."""
+        try:
+            self._bedrock_agent_client.delete_agent(
+                agentId=agent_id, skipResourceInUseCheck=force
+            )
+        except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
+            return
+        poll_until(
+            lambda: self._get_agent_status(agent_id),
+            lambda agent_status: agent_status == "DELETED",
+            description=f"deletion of agent {agent_id}",
+            timeout=timeout,
+        )
+
+    def _delete_role(self, role_name: str) -> None:
+        """Detaches the managed policies of an IAM role, deletes its inline policies, then the role.
+        A role that does not exist is ignored."""
+        try:
+            _paginator = self._iam_client.get_paginator("list_attached_role_policies")
+            for _page in _paginator.paginate(RoleName=role_name):
+                for _policy in _page["AttachedPolicies"]:
+                    self._iam_client.detach_role_policy(
+                        RoleName=role_name, PolicyArn=_policy["PolicyArn"]
+                    )
+            _paginator = self._iam_client.get_paginator("list_role_policies")
+            for _page in _paginator.paginate(RoleName=role_name):
+                for _policy_name in _page["PolicyNames"]:
+                    self._iam_client.delete_role_policy(
+                        RoleName=role_name, PolicyName=_policy_name
+                    )
+            self._iam_client.delete_role(RoleName=role_name)
+        except self._iam_client.exceptions.NoSuchEntityException:
+            pass
+
+    def _delete_function(self, function_name: str) -> None:
+        """Deletes a Lambda function, ignoring a function that does not exist."""
+        try:
+            self._lambda_client.delete_function(FunctionName=function_name)
+        except self._lambda_client.exceptions.ResourceNotFoundException:
+            pass
+
+    def _teardown_inventory(
+        self, agent_id: str, delete_lambdas: bool, delete_roles: bool, with_kbs: bool
+    ) -> Dict:
+        """Lists the resources of an agent that delete_agents() removes.
+
+        Returns:
+            Dict: "agent_role" (role name or None), "lambdas" (function name to its role name or
+            None), "kb_names" and "collaborator_ids" (agent ids of its collaborators)
+        """
+        _inventory = {
+            "agent_role": None,
+            "lambdas": {},
+            "kb_names": [],
+            "collaborator_ids": [],
+        }
+        _agent = self._bedrock_agent_client.get_agent(agentId=agent_id)["agent"]
+        _role_name = _agent.get("agentResourceRoleArn", "").split("/")[-1]
+        # the default role is shared by all agents
+        if delete_roles and _role_name and _role_name != DEFAULT_AGENT_IAM_ROLE_NAME:
+            _inventory["agent_role"] = _role_name
+
+        if delete_lambdas:
+            _paginator = self._bedrock_agent_client.get_paginator(
+                "list_agent_action_groups"
+            )
+            for _page in _paginator.paginate(agentId=agent_id, agentVersion="DRAFT"):
+                for _summary in _page["actionGroupSummaries"]:
+                    _action_group = self._bedrock_agent_client.get_agent_action_group(
+                        agentId=agent_id,
+                        agentVersion="DRAFT",
+                        actionGroupId=_summary["actionGroupId"],
+                    )["agentActionGroup"]
+                    _lambda_arn = _action_group.get("actionGroupExecutor", {}).get(
+                        "lambda"
+                    )
+                    if _lambda_arn is None:
+                        continue
+                    _function_name = _lambda_arn.split(":function:")[-1].split(":")[0]
+                    _inventory["lambdas"][_function_name] = None
+                    if not delete_roles:
+                        continue
+                    try:
+                        _function = self._lambda_client.get_function(
+                            FunctionName=_function_name
+                        )
+                        _inventory["lambdas"][_function_name] = _function[
+                            "Configuration"
+                        ]["Role"].split("/")[-1]
+                    except self._lambda_client.exceptions.ResourceNotFoundException:
+                        pass
+
+        if with_kbs:
+            _paginator = self._bedrock_agent_client.get_paginator(
+                "list_agent_knowledge_bases"
+            )
+            for _page in _paginator.paginate(agentId=agent_id, agentVersion="DRAFT"):
+                for _summary in _page["agentKnowledgeBaseSummaries"]:
+                    _inventory["kb_names"].append(
+                        self._bedrock_agent_client.get_knowledge_base(
+                            knowledgeBaseId=_summary["knowledgeBaseId"]
+                        )["knowledgeBase"]["name"]
+                    )
+
+        if _agent.get("agentCollaboration", "DISABLED") != "DISABLED":
+            _paginator = self._bedrock_agent_client.get_paginator(
+                "list_agent_collaborators"
+            )
+            for _page in _paginator.paginate(agentId=agent_id, agentVersion="DRAFT"):
+                for _summary in _page["agentCollaboratorSummaries"]:
+                    # arn:aws:bedrock:<region>:<account>:agent-alias/<agent id>/<alias id>
+                    _inventory["collaborator_ids"].append(
+                        _summary["agentDescriptor"]["aliasArn"].split("/")[-2]
+                    )
+        return _inventory
+
+    def delete_agents(
+        self,
+        agent_names: List[str] = None,
+        name_prefix: str = None,
+        tags: Dict[str, str] = None,
+        delete_lambdas: bool = True,
+        delete_roles: bool = True,
+        kb_helper=None,
+        max_workers: int = DEFAULT_TEARDOWN_CONCURRENCY,
+        force: bool = False,
+        verbose: bool = False,
+    ) -> TeardownResult:
+        """Deletes a set of agents with their aliases, action group Lambda functions, IAM roles and,
+        optionally, knowledge bases. Resources are deleted concurrently, each one as soon as the
+        resources using it are gone: aliases, then the agent, then its Lambda functions, knowledge
+        bases and roles. A supervisor is deleted before the collaborators it uses.
+
+        Errors do not stop the teardown. They are reported in the result, with the resources that
+        were skipped because a resource using them could not be deleted, and the teardown can
+        simply be run again.
+
+        Args:
+            agent_names (List[str], optional): names of the agents to delete
+            name_prefix (str, optional): also delete the agents whose name starts with this prefix
+            tags (Dict[str, str], optional): also delete the agents that have all these tags
+            delete_lambdas (bool, optional): whether to delete the Lambda functions of the action
+            groups. Defaults to True.
+            delete_roles (bool, optional): whether to delete the IAM roles of the agents and of their
+            Lambda functions. The shared default agent role is kept. Defaults to True.
+            kb_helper (KnowledgeBasesForAmazonBedrock, optional): when given, the knowledge bases
+            associated with the agents are deleted with kb_helper.delete_kb(). Defaults to None.
+            max_workers (int, optional): maximum number of deletions running at once. Defaults to DEFAULT_TEARDOWN_CONCURRENCY.
+            force (bool, optional): whether to delete agents that are still in use, e.g. collaborators
+            of supervisors that are not being deleted. Defaults to False.
+            verbose (bool, optional): whether to print progress. Defaults to False.
+
+        Returns:
+            TeardownResult: the resources deleted, and the errors
+        """
+        _agents = self.refresh_agent_index()
+        _selected = {
+            _name
+            for _name in _agents
+            if _name in (agent_names or [])
+            or (name_prefix is not None and _name.startswith(name_prefix))
+        }
+        for _name in agent_names or []:
+            if _name not in _agents:
+                print(f"Agent {_name} not found")
+
+        _tag_errors = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as _executor:
+            if tags:
+
+                def _has_tags(name: str) -> bool:
+                    try:
+                        _agent_tags = self._bedrock_agent_client.list_tags_for_resource(
+                            resourceArn=_agents[name]["agentArn"]
+                        ).get("tags", {})
+                    except Exception as e:
+                        _tag_errors[f"agent {name}"] = f"Error reading tags: {e}"
+                        return False
+                    return all(_agent_tags.get(_k) == _v for _k, _v in tags.items())
+
+                _names = list(_agents)
+                _selected.update(
+                    _name
+                    for _name, _match in zip(_names, _executor.map(_has_tags, _names))
+                    if _match
                 )
-            except Exception as e:
-                pass
 
-            try:
-                self._iam_client.delete_role(RoleName=_agent_role_name)
-            except Exception as e:
-                pass
+            _futures = {
+                _name: _executor.submit(
+                    self._teardown_inventory,
+                    _agents[_name]["agentId"],
+                    delete_lambdas,
+                    delete_roles,
+                    kb_helper is not None,
+                )
+                for _name in sorted(_selected)
+            }
 
-        return
+        _result = TeardownResult(errors=_tag_errors)
+        _names_by_id = {_agents[_name]["agentId"]: _name for _name in _futures}
+        # deletion steps, and the steps that must be done before each one
+        _steps = {}
+        _depends_on = {}
+        for _name, _future in _futures.items():
+            if _future.exception() is not None:
+                _result.errors[f"agent {_name}"] = str(_future.exception())
+                continue
+            _inventory = _future.result()
+            _agent_id = _agents[_name]["agentId"]
+            _agent_step = f"agent {_name}"
+            _steps[f"aliases of {_agent_step}"] = (
+                lambda _agent_id=_agent_id: self._delete_agent_aliases(_agent_id)
+            )
+            _steps[_agent_step] = lambda _name=_name, _agent_id=_agent_id: (
+                self._delete_agent_and_wait(_agent_id, force=force),
+                self._forget_agent(_name, _agent_id),
+            )
+            _depends_on.setdefault(_agent_step, set()).add(f"aliases of {_agent_step}")
+            for _collaborator_id in _inventory["collaborator_ids"]:
+                if _collaborator_id in _names_by_id:
+                    # the aliases of a collaborator are in use until its supervisor is gone
+                    _depends_on.setdefault(
+                        f"aliases of agent {_names_by_id[_collaborator_id]}", set()
+                    ).add(_agent_step)
+            if _inventory["agent_role"] is not None:
+                _role_step = f"role {_inventory['agent_role']}"
+                _steps[_role_step] = lambda _role=_inventory["agent_role"]: (
+                    self._delete_role(_role)
+                )
+                _depends_on.setdefault(_role_step, set()).add(_agent_step)
+            for _function_name, _role in _inventory["lambdas"].items():
+                _lambda_step = f"lambda {_function_name}"
+                _steps[_lambda_step] = lambda _function_name=_function_name: (
+                    self._delete_function(_function_name)
+                )
+                _depends_on.setdefault(_lambda_step, set()).add(_agent_step)
+                if _role is not None:
+                    _steps[f"role {_role}"] = lambda _role=_role: self._delete_role(
+                        _role
+                    )
+                    _depends_on.setdefault(f"role {_role}", set()).add(_lambda_step)
+            for _kb_name in _inventory["kb_names"]:
+                _kb_step = f"knowledge base {_kb_name}"
+                _steps[_kb_step] = lambda _kb_name=_kb_name: kb_helper.delete_kb(
+                    _kb_name
+                )
+                _depends_on.setdefault(_kb_step, set()).add(_agent_step)
+
+        _lock = threading.Lock()
+
+        def _builder(step: str):
+            def _delete(deps: Dict) -> bool:
+                """Returns whether the step was done, so that the steps depending on it are
+                skipped when it was not."""
+                _failed = sorted(_dep for _dep, _done in deps.items() if not _done)
+                if _failed:
+                    with _lock:
+                        _result.errors[step] = (
+                            f"Skipped: {', '.join(_failed)} not deleted"
+                        )
+                    return False
+                try:
+                    _steps[step]()
+                except Exception as e:
+                    with _lock:
+                        _result.errors[step] = str(e)
+                    print(f"Error deleting {step}: {e}")
+                    return False
+                with _lock:
+                    _result.deleted.append(step)
+                if verbose:
+                    print(f"Deleted {step}")
+                return True
+
+            return _delete
+
+        # steps of agents whose inventory failed are not known: drop dependencies on them
+        _depends_on = {
+            _step: {_dep for _dep in _deps if _dep in _steps}
+            for _step, _deps in _depends_on.items()
+            if _step in _steps
+        }
+        provision(
+            {_step: _builder(_step) for _step in _steps},
+            depends_on={_step: sorted(_deps) for _step, _deps in _depends_on.items()},
+            max_workers=max_workers,
+        )
+        return _result
 
     def _create_agent_role(
         self,
@@ -810,50 +1513,152 @@ class AgentsForAmazonBedrock:
 
             return _agent_role["Role"]["Arn"]
 
-    def wait_agent_status_update(self, agent_id):
-        response = self._bedrock_agent_client.get_agent(agentId=agent_id)
-        agent_status = response["agent"]["agentStatus"]
-        _waited_at_least_once = False
-        while agent_status.endswith("ING"):
-            print(f"Waiting for agent status to change. Current status {agent_status}")
-            time.sleep(5)
-            _waited_at_least_once = True
-            try:
-                response = self._bedrock_agent_client.get_agent(agentId=agent_id)
-                agent_status = response["agent"]["agentStatus"]
-            except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
-                agent_status = "DELETED"
-        if _waited_at_least_once:
-            print(f"Agent id {agent_id} current status: {agent_status}")
+    def _get_agent_status(self, agent_id: str) -> str:
+        """Returns the status of an agent, or "DELETED" if it no longer exists."""
+        try:
+            response = self._bedrock_agent_client.get_agent(agentId=agent_id)
+            return response["agent"]["agentStatus"]
+        except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
+            return "DELETED"
 
-    def wait_agent_alias_status_update(self, agent_id, agent_alias_id, verbose=False):
-        response = self._bedrock_agent_client.get_agent_alias(
-            agentId=agent_id, agentAliasId=agent_alias_id
+    def _get_agent_alias_status(self, agent_id: str, agent_alias_id: str) -> str:
+        """Returns the status of an agent alias, or "DELETED" if it no longer exists."""
+        try:
+            response = self._bedrock_agent_client.get_agent_alias(
+                agentId=agent_id, agentAliasId=agent_alias_id
+            )
+            return response["agentAlias"]["agentAliasStatus"]
+        except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
+            return "DELETED"
+
+    def wait_agent_status_update(
+        self,
+        agent_id: str,
+        timeout: float = DEFAULT_WAIT_TIMEOUT,
+        cancel_event: threading.Event = None,
+        verbose: bool = True,
+    ) -> str:
+        """Waits until an agent leaves its transitional state (CREATING, PREPARING, UPDATING,
+        VERSIONING, DELETING). Polls with exponential backoff instead of a fixed interval.
+
+        Args:
+            agent_id (str): Id of the agent
+            timeout (float, optional): Seconds to wait before raising WaitTimeoutError. Defaults to DEFAULT_WAIT_TIMEOUT.
+            cancel_event (threading.Event, optional): Set it from another thread to abort the wait.
+            verbose (bool, optional): Whether to print the status while waiting. Defaults to True.
+
+        Returns:
+            str: the final agent status, or "DELETED" if the agent no longer exists
+        """
+        _polled_statuses = []
+
+        def _on_poll(agent_status):
+            _polled_statuses.append(agent_status)
+            if verbose:
+                print(
+                    f"Waiting for agent status to change. Current status {agent_status}"
+                )
+
+        agent_status = poll_until(
+            lambda: self._get_agent_status(agent_id),
+            lambda agent_status: not agent_status.endswith("ING"),
+            description=f"agent {agent_id}",
+            timeout=timeout,
+            cancel_event=cancel_event,
+            on_poll=_on_poll,
         )
-        agent_alias_status = response["agentAlias"]["agentAliasStatus"]
-        while agent_alias_status.endswith("ING"):
+        if _polled_statuses and verbose:
+            print(f"Agent id {agent_id} current status: {agent_status}")
+        return agent_status
+
+    def wait_agent_alias_status_update(
+        self,
+        agent_id: str,
+        agent_alias_id: str,
+        verbose: bool = False,
+        timeout: float = DEFAULT_WAIT_TIMEOUT,
+        cancel_event: threading.Event = None,
+    ) -> str:
+        """Waits until an agent alias leaves its transitional state (CREATING, UPDATING, DELETING).
+
+        Args:
+            agent_id (str): Id of the agent
+            agent_alias_id (str): Id of the agent alias
+            verbose (bool, optional): Whether to print the status while waiting. Defaults to False.
+            timeout (float, optional): Seconds to wait before raising WaitTimeoutError. Defaults to DEFAULT_WAIT_TIMEOUT.
+            cancel_event (threading.Event, optional): Set it from another thread to abort the wait.
+
+        Returns:
+            str: the final alias status, or "DELETED" if the alias no longer exists
+        """
+
+        def _on_poll(agent_alias_status):
             if verbose:
                 print(
                     f"Waiting for agent ALIAS status to change. Current status {agent_alias_status}"
                 )
-            time.sleep(5)
-            try:
-                response = self._bedrock_agent_client.get_agent_alias(
-                    agentId=agent_id, agentAliasId=agent_alias_id
-                )
-                agent_alias_status = response["agentAlias"]["agentAliasStatus"]
-            except self._bedrock_agent_client.exceptions.ResourceNotFoundException:
-                agent_status = "DELETED"
+
+        agent_alias_status = poll_until(
+            lambda: self._get_agent_alias_status(agent_id, agent_alias_id),
+            lambda agent_alias_status: not agent_alias_status.endswith("ING"),
+            description=f"agent {agent_id} alias {agent_alias_id}",
+            timeout=timeout,
+            cancel_event=cancel_event,
+            on_poll=_on_poll,
+        )
         if verbose:
             print(
                 f"Agent id {agent_id}, Alias {agent_alias_id} current status: {agent_alias_status}"
             )
+        return agent_alias_status
+
+    def wait_agents_status_update(
+        self,
+        agent_ids: List[str],
+        timeout: float = DEFAULT_WAIT_TIMEOUT,
+        cancel_event: threading.Event = None,
+        verbose: bool = False,
+    ) -> Dict[str, str]:
+        """Waits concurrently for several agents to leave their transitional state.
+
+        Args:
+            agent_ids (List[str]): Ids of the agents
+            timeout (float, optional): Seconds to wait for each agent. Defaults to DEFAULT_WAIT_TIMEOUT.
+            cancel_event (threading.Event, optional): Set it from another thread to abort all waits.
+            verbose (bool, optional): Whether to print the status while waiting. Defaults to False.
+
+        Returns:
+            Dict[str, str]: agent id to its final status
+        """
+        return wait_for_all(
+            {
+                _agent_id: lambda _cancel_event, _agent_id=_agent_id: self.wait_agent_status_update(
+                    _agent_id,
+                    timeout=timeout,
+                    cancel_event=_cancel_event,
+                    verbose=verbose,
+                )
+                for _agent_id in agent_ids
+            },
+            cancel_event=cancel_event,
+        )
 
     def associate_sub_agents(self, supervisor_agent_id, sub_agents_list):
+        """Associates all collaborators with a supervisor agent, prepares the supervisor once
+        and creates its "multi-agent" alias.
+
+        Args:
+            supervisor_agent_id (str): id of the supervisor agent
+            sub_agents_list (List[dict]): collaborators, each with sub_agent_alias_arn, sub_agent_association_name,
+            sub_agent_instruction and relay_conversation_history
+
+        Returns:
+            Tuple[str, str]: id and ARN of the supervisor alias
+        """
+        self.wait_agent_status_update(
+            supervisor_agent_id
+        )  # Be sure agent is not still in CREATING state
         for sub_agent in sub_agents_list:
-            self.wait_agent_status_update(
-                supervisor_agent_id
-            )  # Be sure agent is not still in CREATING state
             association_response = (
                 self._bedrock_agent_client.associate_agent_collaborator(
                     agentId=supervisor_agent_id,
@@ -864,14 +1669,15 @@ class AgentsForAmazonBedrock:
                     relayConversationHistory=sub_agent["relay_conversation_history"],
                 )
             )
-            self.wait_agent_status_update(supervisor_agent_id)
-            self._bedrock_agent_client.prepare_agent(agentId=supervisor_agent_id)
-            self.wait_agent_status_update(supervisor_agent_id)
+        self.wait_agent_status_update(supervisor_agent_id)
+        self._bedrock_agent_client.prepare_agent(agentId=supervisor_agent_id)
+        self.wait_agent_status_update(supervisor_agent_id)
 
         supervisor_agent_alias = self._bedrock_agent_client.create_agent_alias(
             agentAliasName="multi-agent", agentId=supervisor_agent_id
         )
         supervisor_agent_alias_id = supervisor_agent_alias["agentAlias"]["agentAliasId"]
+        self._latest_alias_ids.pop(supervisor_agent_id, None)
         supervisor_agent_alias_arn = supervisor_agent_alias["agentAlias"][
             "agentAliasArn"
         ]
@@ -983,6 +1789,9 @@ class AgentsForAmazonBedrock:
                     **_kwargs,
                 )
                 _agent_id = _create_agent_response["agent"]["agentId"]
+                self._remember_agent(
+                    agent_name, _agent_id, _create_agent_response["agent"]["agentArn"]
+                )
                 if verbose:
                     print(f"Created agent, resulting id: {_agent_id}")
                     _get_resp = self._bedrock_agent_client.get_agent(agentId=_agent_id)
@@ -1022,7 +1831,8 @@ class AgentsForAmazonBedrock:
             return "Agent not found"
 
         _resp = self._bedrock_agent_client.prepare_agent(agentId=_agent_id)
-        time.sleep(5)  # make sure agent is ready to be invoked as soon as we return
+        # make sure agent is ready to be invoked as soon as we return
+        self.wait_agent_status_update(_agent_id, verbose=False)
         return
 
     def create_agent_alias(self, agent_id: str, alias_name: str) -> Tuple[str, str]:
@@ -1036,6 +1846,7 @@ class AgentsForAmazonBedrock:
         agent_alias = self._bedrock_agent_client.create_agent_alias(
             agentAliasName=alias_name, agentId=agent_id
         )
+        self._latest_alias_ids.pop(agent_id, None)
         agent_alias_id = agent_alias["agentAlias"]["agentAliasId"]
         agent_alias_arn = agent_alias["agentAlias"]["agentAliasArn"]
         return agent_alias_id, agent_alias_arn
@@ -1063,7 +1874,8 @@ class AgentsForAmazonBedrock:
         # check the response and if successful, prepare the agent
         if _agent_action_group_resp["ResponseMetadata"]["HTTPStatusCode"] == 200:
             _resp = self._bedrock_agent_client.prepare_agent(agentId=_agent_id)
-            time.sleep(5)  # make sure agent is ready to be invoked as soon as we return
+            # make sure agent is ready to be invoked as soon as we return
+            self.wait_agent_status_update(_agent_id, verbose=False)
         else:
             print(f"Error adding code interpreter to agent: {_agent_action_group_resp}")
         return
@@ -1080,6 +1892,8 @@ class AgentsForAmazonBedrock:
         sub_agent_arns: List[str] = None,
         dynamo_args: List[str] = None,
         verbose: bool = False,
+        package_paths: List[str] = None,
+        requirements: List[str] = None,
     ) -> None:
         """Adds an action group to an existing agent, creates a Lambda function to
         implement that action group, and prepares the agent so it is ready to be
@@ -1094,6 +1908,8 @@ class AgentsForAmazonBedrock:
             agent_action_group_description (str): description of the agent action group
             additional_function_iam_policy (Dict, Optional): additional IAM policy to attach to the Lambda function
             sub_agent_arns (List[str], Optional): list of ARNs of sub-agents (if any) to permit the Lambda to invoke
+            package_paths (List[str], Optional): other files and directories of the Lambda function, see create_lambda()
+            requirements (List[str], Optional): pip requirements of the Lambda function, see create_lambda()
         """
 
         _agent_id = self.get_agent_id_by_name(agent_name)
@@ -1110,6 +1926,8 @@ class AgentsForAmazonBedrock:
                 additional_function_iam_policy=additional_function_iam_policy,
                 sub_agent_arns=sub_agent_arns,
                 dynamo_args=dynamo_args,
+                package_paths=package_paths,
+                requirements=requirements,
             )
 
         self.wait_agent_status_update(_agent_id)
@@ -1155,7 +1973,8 @@ class AgentsForAmazonBedrock:
             description=agent_action_group_description,
         )
         _resp = self._bedrock_agent_client.prepare_agent(agentId=agent_id)
-        time.sleep(5)  # make sure agent is ready to be invoked as soon as we return
+        # make sure agent is ready to be invoked as soon as we return
+        self.wait_agent_status_update(agent_id, verbose=False)
         return
 
     def get_function_defs(self, agent_name: str) -> List[dict]:
@@ -1404,579 +2223,316 @@ class AgentsForAmazonBedrock:
 
         return _fully_cited_answer
 
-    def invoke_inline_agent(
+    def _consume_completion(
         self,
-        request_params: Dict = {},
+        event_stream,
+        time_before_call: datetime.datetime,
+        enable_trace: bool = False,
         trace_level: str = "core",
-    ):
-        if "enableTrace" in request_params:
-            enable_trace = request_params["enableTrace"]
-        else:
-            request_params["enableTrace"] = enable_trace = False
-
-        if "sessionId" in request_params:
-            session_id = request_params["sessionId"]
-        else:
-            request_params["sessionId"] = session_id = str(uuid.uuid4())
+        trace_dispatcher: TraceDispatcher = None,
+        trace_context: TraceContext = None,
+        stream_final_response: bool = False,
+        return_control_answer: bool = False,
+        metrics: InvocationMetrics = None,
+    ) -> Tuple[Any, Dict]:
+        """Reads the completion event stream of invokeAgent or invokeInlineAgent. Collects the answer
+        and its citations, and hands trace events to the trace dispatcher. With enable_trace and no
+        trace_dispatcher, the trace is printed to the console. When metrics is given, the time to
+        first token and the LLM calls found in the trace are recorded into it.
 
-        _time_before_call = datetime.datetime.now()
+        Returns:
+            Tuple[Any, Dict]: the answer (or the returnControl payload if return_control_answer is set),
+            and the chunk event carrying the citations, if any
+        """
+        _print_trace = enable_trace and trace_dispatcher is None
+        if _print_trace:
+            trace_dispatcher = console_trace_dispatcher()
+        if trace_context is None:
+            trace_context = TraceContext(trace_level=trace_level)
+        _trace_dispatchers = [
+            _dispatcher
+            for _dispatcher in [
+                trace_dispatcher,
+                metrics_trace_dispatcher(metrics) if metrics is not None else None,
+            ]
+            if _dispatcher
+        ]
 
-        _agent_resp = self._bedrock_agent_runtime_client.invoke_inline_agent(
-            **request_params
-        )
-
-        if _agent_resp["ResponseMetadata"]["RetryAttempts"] > 0:
-            print(
-                colored(
-                    f"  ** invokeAgent boto3 retries executed: {_agent_resp['ResponseMetadata']['RetryAttempts']}",
-                    "red",
-                )
-            )
-
-        if enable_trace:
-            if trace_level == "all":
-                print(f"invokeAgent API response object: {_agent_resp}")
-            else:
-                print(
-                    f"invokeAgent API request ID: {_agent_resp['ResponseMetadata']['RequestId']}"
-                )
-                print(f"invokeAgent API session ID: {session_id}")
-
-        # Return error message if invoke was unsuccessful
-        if _agent_resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            _error_message = f"API Response was not 200: {_agent_resp}"
-            if enable_trace and trace_level == "all":
-                print(_error_message)
-            return _error_message
-
-        _total_in_tokens = 0
-        _total_out_tokens = 0
-        _total_llm_calls = 0
-        _orch_step = 0
-        _sub_step = 0
         _num_response_chunks = 0
-        _time_before_orchestration = _overall_start_time = datetime.datetime.now()
-        _citations = []
+        _overall_start_time = datetime.datetime.now()
         _citations_event = None
-
         _agent_answer = ""
-        _event_stream = _agent_resp["completion"]
 
-        try:
-            _sub_agent_name = "<collab-name-not-yet-provided>"
-            for _event in _event_stream:
-                _sub_agent_alias_id = None
+        for _event in event_stream:
+            if "chunk" in _event:
+                _data = _event["chunk"]["bytes"]
+                _tmp_agent_answer = _data.decode("utf8")
+                if enable_trace and trace_level == "all":
+                    print(
+                        f"tmp answer: '{_tmp_agent_answer}', streaming: {stream_final_response}, trace: {enable_trace}"
+                    )
 
-                if "chunk" in _event:
-                    _data = _event["chunk"]["bytes"]
-                    _tmp_agent_answer = _data.decode("utf8")
-                    if enable_trace and trace_level == "all":
-                        # print(f"tmp answer: '{_tmp_agent_answer}', streaming: {stream_final_response}, trace: {enable_trace}")
+                # continue to build up the full answer
+                _agent_answer += _tmp_agent_answer
+
+                if _num_response_chunks == 0:
+                    _time_to_first_token = datetime.datetime.now() - _overall_start_time
+                    if metrics is not None:
+                        metrics.time_to_first_token = (
+                            datetime.datetime.now() - time_before_call
+                        ).total_seconds()
+                    if enable_trace and stream_final_response:
                         print(
-                            f"tmp answer: '{_tmp_agent_answer}', trace: {enable_trace}"
+                            colored(
+                                f"Time to first token: {_time_to_first_token.total_seconds():,.1f}s\n",
+                                "yellow",
+                            )
                         )
+                _num_response_chunks += 1
 
-                    # continue to build up the full answer
-                    _agent_answer += _tmp_agent_answer
-
-                    # stream the chunks
-
-                    # if _num_response_chunks == 0:
-                    #     _time_to_first_token = datetime.datetime.now() - _overall_start_time
-                    #     if enable_trace and stream_final_response:
-                    #         print(colored(f"Time to first token: {_time_to_first_token.total_seconds():,.1f}s\n", "yellow"))
-                    # _num_response_chunks += 1
+                if enable_trace and stream_final_response and _num_response_chunks < 3:
+                    print(
+                        colored(
+                            f"Answer chunk [{_num_response_chunks}]: {_tmp_agent_answer}",
+                            "blue",
+                        )
+                    )
 
-                    # if enable_trace and stream_final_response and _num_response_chunks < 3:
-                    #     print(colored(f"Answer chunk [{_num_response_chunks}]: {_tmp_agent_answer}", "blue"))
+                # print all keys in _event["chunk"] dictionary if more than just 'bytes' provided
+                if enable_trace and trace_level == "all":
+                    if len(_event["chunk"].keys()) > 1:
+                        print(
+                            f"chunk keys beyond just 'bytes': {list(_event['chunk'].keys())}"
+                        )
 
-                    # print all keys in _event["chunk"] dictionary if more than just 'bytes' provided
+                # remember the citations, if any are provided. Events are not reused by
+                # the event stream, so there is no need to copy them.
+                if "citations" in _event["chunk"].get("attribution", {}):
+                    _citations_event = _event
                     if enable_trace and trace_level == "all":
-                        if len(_event["chunk"].keys()) > 1:
-                            print(
-                                f"chunk keys beyond just 'bytes': {list(_event['chunk'].keys())}"
+                        print(
+                            colored(
+                                f"Citations: {_event['chunk']['attribution']['citations']}",
+                                "blue",
                             )
+                        )
 
-                    # remember the citations, if any are provided
-                    if "attribution" in _event["chunk"]:
-                        if "citations" in _event["chunk"]["attribution"]:
-                            _citations_event = copy.deepcopy(_event)
-                            _citations = _event["chunk"]["attribution"]["citations"]
-                            if enable_trace and trace_level == "all":
-                                print(colored(f"Citations: {_citations}", "blue"))
+            elif "returnControl" in _event and return_control_answer:
+                _agent_answer = _event["returnControl"]
 
-                elif "returnControl" in _event:
-                    _agent_answer = _event["returnControl"]
+            if "trace" in _event and _trace_dispatchers:
+                for _dispatcher in _trace_dispatchers:
+                    _dispatcher.dispatch(_event["trace"], trace_context)
 
-                if "trace" in _event and enable_trace:
-                    if trace_level == "all":
-                        print("---")
-                    else:
-                        if "callerChain" in _event["trace"]:
-                            if len(_event["trace"]["callerChain"]) > 1:
-                                _sub_agent_alias_arn = _event["trace"]["callerChain"][
-                                    1
-                                ]["agentAliasArn"]
-                                # get sub agent id by grabbing all text following the first '/' character
-                                _sub_agent_alias_id = _sub_agent_alias_arn.split(
-                                    "/", 1
-                                )[1]
-                                _sub_agent_name = "<not yet supported with inline>"  # multi_agent_names[_sub_agent_alias_id]
-
-                    if "routingClassifierTrace" in _event["trace"]["trace"]:
-                        _route = _event["trace"]["trace"]["routingClassifierTrace"]
-
-                        if "modelInvocationInput" in _route:
-                            _orch_step += 1
-                            print(colored(f"---- Step {_orch_step} ----", "green"))
-                            _time_before_routing = datetime.datetime.now()
-                            print(
-                                colored(
-                                    "Classifying request to immediately route to one collaborator if possible.",
-                                    "blue",
-                                )
-                            )
+            if "files" in _event.keys() and enable_trace:
+                console = Console()
+                files_event = _event["files"]
+                console.print(Markdown("**Files**"))
 
-                        if "modelInvocationOutput" in _route:
-                            _llm_usage = _route["modelInvocationOutput"]["metadata"][
-                                "usage"
-                            ]
-                            _in_tokens = _llm_usage["inputTokens"]
-                            _total_in_tokens += _in_tokens
+                files_list = files_event["files"]
+                for this_file in files_list:
+                    print(f"{this_file['name']} ({this_file['type']})")
+                    file_bytes = this_file["bytes"]
 
-                            _out_tokens = _llm_usage["outputTokens"]
-                            _total_out_tokens += _out_tokens
+                    # save bytes to file, given the name of file and the bytes
+                    file_name = os.path.join("output", this_file["name"])
+                    with open(file_name, "wb") as f:
+                        f.write(file_bytes)
 
-                            _total_llm_calls += 1
-                            _route_duration = (
-                                datetime.datetime.now() - _time_before_routing
-                            )
+        if enable_trace:
+            duration = datetime.datetime.now() - time_before_call
+            if _print_trace:
+                print_trace_summary(trace_context, duration)
 
-                            _raw_resp_str = _route["modelInvocationOutput"][
-                                "rawResponse"
-                            ]["content"]
-                            _raw_resp = json.loads(_raw_resp_str)
-                            _classification = (
-                                _raw_resp["content"][0]["text"]
-                                .replace("<a>", "")
-                                .replace("</a>", "")
-                            )
+            if trace_level == "all":
+                print(f"Returning agent answer as: {_agent_answer}")
 
-                            if _classification == UNDECIDABLE_CLASSIFICATION:
-                                print(
-                                    colored(
-                                        f"Routing classifier did not find a matching collaborator. Reverting to 'SUPERVISOR' mode.",
-                                        "magenta",
-                                    )
-                                )
-                            elif _classification == "keep_previous_agent":
-                                print(
-                                    colored(
-                                        f"Continuing conversation with previous collaborator.",
-                                        "magenta",
-                                    )
-                                )
-                            else:
-                                _sub_agent_name = _classification
-                                print(
-                                    colored(
-                                        f"Routing classifier chose collaborator: '{_classification}'",
-                                        "magenta",
-                                    )
-                                )
-                            print(
-                                colored(
-                                    f"Routing classifier took {_route_duration.total_seconds():,.1f}s, using {_in_tokens+_out_tokens} tokens (in: {_in_tokens}, out: {_out_tokens}).\n",
-                                    "yellow",
-                                )
-                            )
+        return _agent_answer, _citations_event
 
-                    if "failureTrace" in _event["trace"]["trace"]:
-                        print(
-                            colored(
-                                f"Agent error: {_event['trace']['trace']['failureTrace']['failureReason']}",
-                                "red",
-                            )
-                        )
+    @staticmethod
+    def _record_response_metadata(metrics: InvocationMetrics, agent_resp: Dict) -> None:
+        """Copies the request ID, retries and HTTP status of an API response into metrics."""
+        _response_metadata = agent_resp["ResponseMetadata"]
+        metrics.request_id = _response_metadata.get("RequestId")
+        metrics.retry_attempts = _response_metadata.get("RetryAttempts", 0)
+        metrics.http_status_code = _response_metadata.get("HTTPStatusCode")
 
-                    if "orchestrationTrace" in _event["trace"]["trace"]:
-                        _orch = _event["trace"]["trace"]["orchestrationTrace"]
-
-                        if trace_level in ["core", "outline"]:
-                            if "rationale" in _orch:
-                                _rationale = _orch["rationale"]
-                                print(colored(f"{_rationale['text']}", "blue"))
-
-                            if "invocationInput" in _orch:
-                                # NOTE: when agent determines invocations should happen in parallel
-                                # the trace objects for invocation input still come back one at a time.
-                                _input = _orch["invocationInput"]
-
-                                if "actionGroupInvocationInput" in _input:
-                                    if trace_level == "outline":
-                                        print(
-                                            colored(
-                                                f"Using tool: {_input['actionGroupInvocationInput']['function']}",
-                                                "magenta",
-                                            )
-                                        )
-                                    else:
-                                        if (
-                                            "function"
-                                            not in _input["actionGroupInvocationInput"]
-                                        ):
-                                            print(
-                                                colored(
-                                                    f"EXPECTING to capture 'Using tool', but 'function' not found\n{_input['actionGroupInvocationInput']}",
-                                                    "red",
-                                                )
-                                            )
-                                        else:
-                                            print(
-                                                colored(
-                                                    f"Using tool: {_input['actionGroupInvocationInput']['function']} with these inputs:",
-                                                    "magenta",
-                                                )
-                                            )
-                                            if (
-                                                "parameters"
-                                                in _input["actionGroupInvocationInput"]
-                                            ):
-                                                if (
-                                                    len(
-                                                        _input[
-                                                            "actionGroupInvocationInput"
-                                                        ]["parameters"]
-                                                    )
-                                                    == 1
-                                                ) and (
-                                                    _input[
-                                                        "actionGroupInvocationInput"
-                                                    ]["parameters"][0]["name"]
-                                                    == "input_text"
-                                                ):
-                                                    print(
-                                                        colored(
-                                                            f"{_input['actionGroupInvocationInput']['parameters'][0]['value']}",
-                                                            "magenta",
-                                                        )
-                                                    )
-                                                else:
-                                                    print(
-                                                        colored(
-                                                            f"{_input['actionGroupInvocationInput']['parameters']}\n",
-                                                            "magenta",
-                                                        )
-                                                    )
-                                            else:
-                                                print(
-                                                    colored(
-                                                        f"    no input parameters being sent\n",
-                                                        "magenta",
-                                                    )
-                                                )
-
-                                elif "agentCollaboratorInvocationInput" in _input:
-                                    _collab_name = _input[
-                                        "agentCollaboratorInvocationInput"
-                                    ]["agentCollaboratorName"]
-                                    _sub_agent_name = _collab_name
-                                    _collab_input_text = _input[
-                                        "agentCollaboratorInvocationInput"
-                                    ]["input"]["text"]
-                                    _collab_arn = _input[
-                                        "agentCollaboratorInvocationInput"
-                                    ]["agentCollaboratorAliasArn"]
-                                    _collab_ids = _collab_arn.split("/", 1)[1]
-
-                                    if trace_level == "outline":
-                                        print(
-                                            colored(
-                                                f"Using sub-agent collaborator: '{_collab_name} [{_collab_ids}]'",
-                                                "magenta",
-                                            )
-                                        )
-                                    else:
-                                        print(
-                                            colored(
-                                                f"Using sub-agent collaborator: '{_collab_name} [{_collab_ids}]' passing input text:",
-                                                "magenta",
-                                            )
-                                        )
-                                        print(
-                                            colored(
-                                                f"{_collab_input_text[0:TRACE_TRUNCATION_LENGTH]}\n",
-                                                "magenta",
-                                            )
-                                        )
-
-                                elif "codeInterpreterInvocationInput" in _input:
-                                    if trace_level == "outline":
-                                        print(
-                                            colored(
-                                                f"Using code interpreter", "magenta"
-                                            )
-                                        )
-                                    else:
-                                        console = Console()
-                                        _gen_code = _input[
-                                            "codeInterpreterInvocationInput"
-                                        ]["code"]
-                                        _code = f"```python\n{_gen_code}\n```"
-
-                                        console.print(
-                                            Markdown(f"**Generated code**\n{_code}")
-                                        )
-
-                                elif "knowledgeBaseLookupInput" in _input:
-                                    if trace_level == "outline":
-                                        print(
-                                            colored(f"Using knowledge base", "magenta")
-                                        )
-                                    else:
-                                        _kb_id = _input["knowledgeBaseLookupInput"][
-                                            "knowledgeBaseId"
-                                        ]
-                                        _kb_query = _input["knowledgeBaseLookupInput"][
-                                            "text"
-                                        ]
-                                        print(
-                                            colored(
-                                                f"Using knowledge base id: {_kb_id} to search for:",
-                                                "magenta",
-                                            )
-                                        )
-                                        print(colored(f"  {_kb_query}\n", "magenta"))
-
-                            if "observation" in _orch:
-                                if trace_level == "core":
-                                    _output = _orch["observation"]
-                                    if "actionGroupInvocationOutput" in _output:
-                                        print(
-                                            colored(
-                                                f"--tool outputs:\n{_output['actionGroupInvocationOutput']['text'][0:TRACE_TRUNCATION_LENGTH]}...\n",
-                                                "magenta",
-                                            )
-                                        )
-
-                                    if "agentCollaboratorInvocationOutput" in _output:
-                                        _collab_name = _output[
-                                            "agentCollaboratorInvocationOutput"
-                                        ]["agentCollaboratorName"]
-                                        _collab_output_text = _output[
-                                            "agentCollaboratorInvocationOutput"
-                                        ]["output"]["text"][0:TRACE_TRUNCATION_LENGTH]
-                                        print(
-                                            colored(
-                                                f"\n----sub-agent {_collab_name} output text:\n{_collab_output_text}...\n",
-                                                "magenta",
-                                            )
-                                        )
-
-                                    if "codeInterpreterInvocationOutput" in _output:
-                                        if (
-                                            "executionError"
-                                            in _output[
-                                                "codeInterpreterInvocationOutput"
-                                            ]
-                                        ):
-                                            _err = _output[
-                                                "codeInterpreterInvocationOutput"
-                                            ]["executionError"]
-                                            print(
-                                                colored(
-                                                    f"--- Code interpreter execution ERROR:\n{_err}\n---\n",
-                                                    "red",
-                                                )
-                                            )
-                                        elif (
-                                            "executionOutput"
-                                            in _output[
-                                                "codeInterpreterInvocationOutput"
-                                            ]
-                                        ):
-                                            _output = _output[
-                                                "codeInterpreterInvocationOutput"
-                                            ]["executionOutput"]
-                                            print(
-                                                colored(
-                                                    f"--- Code interpreter execution OUTPUT:\n{_output}\n---\n",
-                                                    "magenta",
-                                                )
-                                            )
-
-                                    if "knowledgeBaseLookupOutput" in _output:
-                                        _refs = _output["knowledgeBaseLookupOutput"][
-                                            "retrievedReferences"
-                                        ]
-                                        _ref_count = len(_refs)
-                                        print(
-                                            colored(
-                                                f"Knowledge base lookup output, {_ref_count} references:\n",
-                                                "magenta",
-                                            )
-                                        )
-                                        _curr = 1
-                                        for _ref in _refs:
-                                            print(
-                                                colored(
-                                                    f"  ({_curr}) {_ref['content']['text'][0:TRACE_TRUNCATION_LENGTH]}...\n",
-                                                    "magenta",
-                                                )
-                                            )
-                                            _curr += 1
-
-                                    if "finalResponse" in _output:
-                                        print(
-                                            colored(
-                                                f"Final response:\n{_output['finalResponse']['text'][0:TRACE_TRUNCATION_LENGTH]}...",
-                                                "cyan",
-                                            )
-                                        )
-
-                        if "modelInvocationOutput" in _orch:
-                            if _sub_agent_alias_id is not None:
-                                _sub_step += 1
-                                print(
-                                    colored(
-                                        f"---- Step {_orch_step}.{_sub_step} [using sub-agent name:{_sub_agent_name}, id:{_sub_agent_alias_id}] ----",
-                                        "green",
-                                    )
-                                )
-                            else:
-                                _orch_step += 1
-                                _sub_step = 0
-                                print(colored(f"---- Step {_orch_step} ----", "green"))
-
-                            _total_llm_calls += 1
-                            _orch_duration = (
-                                datetime.datetime.now() - _time_before_orchestration
-                            )
+    def _response_cache_key(
+        self,
+        target: str,
+        input_text: str,
+        session_id: str,
+        session_state: Dict,
+        use_cache: bool,
+    ) -> str:
+        """Returns the response cache key of an invocation, or None if the cache must not be used:
+        no cache is set, use_cache is False, the session state carries conversation state, or the
+        session already had a turn, whose conversation the answer may depend on."""
+        if self._response_cache is None:
+            return None
+        # recorded even when the cache is bypassed, so that the next turns of the session bypass it too
+        _first_turn = self._response_cache.start_turn(session_id)
+        if not (
+            _first_turn and use_cache and ResponseCache.is_cacheable(session_state)
+        ):
+            return None
+        return ResponseCache.make_key(target, input_text, session_state)
 
-                            if "metadata" in _orch["modelInvocationOutput"]:
-                                _llm_usage = _orch["modelInvocationOutput"]["metadata"][
-                                    "usage"
-                                ]
-                                _in_tokens = _llm_usage["inputTokens"]
-                                _total_in_tokens += _in_tokens
-
-                                _out_tokens = _llm_usage["outputTokens"]
-                                _total_out_tokens += _out_tokens
-
-                                print(
-                                    colored(
-                                        f"Took {_orch_duration.total_seconds():,.1f}s, using {_in_tokens+_out_tokens} tokens (in: {_in_tokens}, out: {_out_tokens}) to complete prior action, observe, orchestrate.",
-                                        "yellow",
-                                    )
-                                )
-                            else:
-                                print(
-                                    colored(
-                                        f"Took {_orch_duration.total_seconds():,.1f}s [token count metadata was not returned] to complete prior action, observe, orchestrate.",
-                                        "yellow",
-                                    )
-                                )
-
-                            # restart the clock for next step/sub-step
-                            _time_before_orchestration = datetime.datetime.now()
-
-                    elif "preProcessingTrace" in _event["trace"]["trace"]:
-                        _pre = _event["trace"]["trace"]["preProcessingTrace"]
-                        if "modelInvocationOutput" in _pre:
-                            _llm_usage = _pre["modelInvocationOutput"]["metadata"][
-                                "usage"
-                            ]
-                            _in_tokens = _llm_usage["inputTokens"]
-                            _total_in_tokens += _in_tokens
-
-                            _out_tokens = _llm_usage["outputTokens"]
-                            _total_out_tokens += _out_tokens
-
-                            _total_llm_calls += 1
-
-                            print(
-                                colored(
-                                    "Pre-processing trace, agent came up with an initial plan.",
-                                    "yellow",
-                                )
-                            )
-                            print(
-                                colored(
-                                    f"Used LLM tokens, in: {_in_tokens}, out: {_out_tokens}",
-                                    "yellow",
-                                )
-                            )
+    def _cached_answer(
+        self,
+        cache_key: str,
+        enable_trace: bool,
+        metrics_callback: Callable[[InvocationMetrics], None],
+        metrics: InvocationMetrics,
+    ) -> str:
+        """Returns the cached answer for cache_key, or None on a miss."""
+        _answer = self._response_cache.get(cache_key)
+        if _answer is None:
+            return None
+        if enable_trace:
+            print(colored("Answer served from the response cache.", "yellow"))
+        if metrics is not None:
+            metrics.cache_hit = True
+            self._emit_metrics(metrics_callback, metrics)
+        return _answer
 
-                    elif "postProcessingTrace" in _event["trace"]["trace"]:
-                        _post = _event["trace"]["trace"]["postProcessingTrace"]
-                        if "modelInvocationOutput" in _post:
-                            _llm_usage = _post["modelInvocationOutput"]["metadata"][
-                                "usage"
-                            ]
-                            _in_tokens = _llm_usage["inputTokens"]
-                            _total_in_tokens += _in_tokens
-
-                            _out_tokens = _llm_usage["outputTokens"]
-                            _total_out_tokens += _out_tokens
-
-                            _total_llm_calls += 1
-                            print(colored("Agent post-processing complete.", "yellow"))
-                            print(
-                                colored(
-                                    f"Used LLM tokens, in: {_in_tokens}, out: {_out_tokens}",
-                                    "yellow",
-                                )
-                            )
+    def _emit_metrics(
+        self,
+        metrics_callback: Callable[[InvocationMetrics], None],
+        metrics: InvocationMetrics,
+        error: Any = None,
+    ) -> None:
+        """Completes the metrics of an invocation and hands them to metrics_callback. Errors raised
+        by the callback are printed, so that a failing metrics pipeline does not fail the invocation.
+        """
+        metrics.duration = (
+            datetime.datetime.now() - metrics.start_time
+        ).total_seconds()
+        if error is not None:
+            metrics.error = str(error)
+        try:
+            metrics_callback(metrics)
+        except Exception as e:
+            print(f"Error in metrics callback: {e}")
 
-                    if trace_level == "all":
-                        print(json.dumps(_event["trace"], indent=2))
+    def invoke_inline_agent(
+        self,
+        request_params: Dict = {},
+        trace_level: str = "core",
+        trace_dispatcher: TraceDispatcher = None,
+        metrics_callback: Callable[[InvocationMetrics], None] = None,
+        use_cache: bool = True,
+    ):
+        """Invokes an inline agent, given the request parameters of invokeInlineAgent.
 
-                if "files" in _event.keys() and enable_trace:
-                    console = Console()
-                    files_event = _event["files"]
-                    console.print(Markdown("**Files**"))
+        Args:
+            request_params (Dict): parameters of the invokeInlineAgent API call.
+            trace_level (str, optional): The level of trace printed when enableTrace is set. Defaults to "core".
+            trace_dispatcher (TraceDispatcher, optional): Handlers for the trace events, used instead of
+            printing the trace. Trace is requested from the API whenever it has handlers.
+            metrics_callback (Callable, optional): Called with the InvocationMetrics of the invocation once it
+            completes or fails. Trace is requested from the API to collect the LLM calls.
+            use_cache (bool, optional): Whether the response cache, if one is set, may answer this call.
+            Only the first turn of a session is ever answered from the cache. Defaults to True.
 
-                    files_list = files_event["files"]
-                    for this_file in files_list:
-                        print(f"{this_file['name']} ({this_file['type']})")
-                        file_bytes = this_file["bytes"]
+        Returns:
+            str: The answer from the agent, or the returnControl payload.
+        """
+        if "enableTrace" in request_params:
+            enable_trace = request_params["enableTrace"]
+        else:
+            request_params["enableTrace"] = enable_trace = False
+        if trace_dispatcher or metrics_callback is not None:
+            request_params["enableTrace"] = True
 
-                        # save bytes to file, given the name of file and the bytes
-                        file_name = os.path.join("output", this_file["name"])
-                        with open(file_name, "wb") as f:
-                            f.write(file_bytes)
-                        # if this_file['type'] == 'image/png' or this_file['type'] == 'image/jpeg':
-                        #     img = mpimg.imread(file_name)
-                        #     # plt.imshow(img)
-                        #     # plt.show()
+        if "sessionId" in request_params:
+            session_id = request_params["sessionId"]
+        else:
+            request_params["sessionId"] = session_id = str(uuid.uuid4())
 
-            if enable_trace:
-                duration = datetime.datetime.now() - _time_before_call
+        _time_before_call = datetime.datetime.now()
+        _metrics = None
+        if metrics_callback is not None:
+            _metrics = InvocationMetrics(
+                session_id=session_id, start_time=_time_before_call
+            )
 
-                if trace_level in ["core", "outline"]:
-                    print(
-                        colored(
-                            f"Agent made a total of {_total_llm_calls} LLM calls, "
-                            + f"using {_total_in_tokens+_total_out_tokens} tokens "
-                            + f"(in: {_total_in_tokens}, out: {_total_out_tokens})"
-                            + f", and took {duration.total_seconds():,.1f} total seconds",
-                            "yellow",
-                        )
-                    )
+        _cache_key = self._response_cache_key(
+            ResponseCache.inline_agent_target(request_params),
+            request_params["inputText"],
+            session_id,
+            request_params.get("inlineSessionState", {}),
+            use_cache,
+        )
+        if _cache_key is not None:
+            _cached_answer = self._cached_answer(
+                _cache_key, enable_trace, metrics_callback, _metrics
+            )
+            if _cached_answer is not None:
+                return _cached_answer
 
-                if trace_level == "all":
-                    print(f"Returning agent answer as: {_agent_answer}")
+        try:
+            _agent_resp = self._bedrock_agent_runtime_client.invoke_inline_agent(
+                **request_params
+            )
+        except Exception as e:
+            if _metrics is not None:
+                self._emit_metrics(metrics_callback, _metrics, e)
+            raise
+        if _metrics is not None:
+            self._record_response_metadata(_metrics, _agent_resp)
 
-            # if stream_final_response and enable_trace and trace_level == "all":
-            #     print(f"\nagent answer: ^^^{_agent_answer}^^^\n")
+        if _agent_resp["ResponseMetadata"]["RetryAttempts"] > 0:
+            print(
+                colored(
+                    f"  ** invokeAgent boto3 retries executed: {_agent_resp['ResponseMetadata']['RetryAttempts']}",
+                    "red",
+                )
+            )
+
+        if enable_trace:
+            if trace_level == "all":
+                print(f"invokeAgent API response object: {_agent_resp}")
+            else:
+                print(
+                    f"invokeAgent API request ID: {_agent_resp['ResponseMetadata']['RequestId']}"
+                )
+                print(f"invokeAgent API session ID: {session_id}")
+
+        # Return error message if invoke was unsuccessful
+        if _agent_resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            _error_message = f"API Response was not 200: {_agent_resp}"
+            if enable_trace and trace_level == "all":
+                print(_error_message)
+            if _metrics is not None:
+                self._emit_metrics(metrics_callback, _metrics, _error_message)
+            return _error_message
+
+        try:
+            _agent_answer, _citations_event = self._consume_completion(
+                _agent_resp["completion"],
+                _time_before_call,
+                enable_trace=enable_trace,
+                trace_level=trace_level,
+                trace_dispatcher=trace_dispatcher,
+                trace_context=TraceContext(trace_level=trace_level),
+                return_control_answer=True,
+                metrics=_metrics,
+            )
 
             _agent_answer = self._make_fully_cited_answer(
                 _agent_answer, _citations_event, enable_trace, trace_level
             )
+            if _cache_key is not None and isinstance(_agent_answer, str):
+                self._response_cache.put(_cache_key, _agent_answer)
+            if _metrics is not None:
+                self._emit_metrics(metrics_callback, _metrics)
 
             return _agent_answer
 
         except Exception as e:
+            if _metrics is not None and _metrics.duration is None:
+                self._emit_metrics(metrics_callback, _metrics, e)
             print(f"Caught exception while processing input to invokeAgent:\n")
             print(f"  for input text:\n{request_params['inputText']}\n")
             print(
@@ -1997,6 +2553,9 @@ class AgentsForAmazonBedrock:
         trace_level: str = "core",
         multi_agent_names: dict = {},
         stream_final_response: bool = False,
+        trace_dispatcher: TraceDispatcher = None,
+        metrics_callback: Callable[[InvocationMetrics], None] = None,
+        use_cache: bool = True,
     ):
         """Invokes an agent with a given input text, while optional parameters
         also let you leverage an agent session, or target a specific agent alias.
@@ -2010,23 +2569,60 @@ class AgentsForAmazonBedrock:
             enable_trace (bool, optional): Whether to enable trace. Defaults to False.
             end_session (bool, optional): Whether to end the session. Defaults to False.
             trace_level (str, optional): The level of trace. Defaults to "none". Possible values are "none", "all", "core".
+            trace_dispatcher (TraceDispatcher, optional): Handlers for the trace events, used instead of
+            printing the trace. Trace is requested from the API whenever it has handlers.
+            metrics_callback (Callable, optional): Called with the InvocationMetrics of the invocation once it
+            completes or fails. Trace is requested from the API to collect the LLM calls.
+            use_cache (bool, optional): Whether the response cache, if one is set, may answer this call.
+            Only the first turn of a session is ever answered from the cache. Defaults to True.
 
         Returns:
             str: The answer from the agent.
         """
 
         _time_before_call = datetime.datetime.now()
+        _metrics = None
+        if metrics_callback is not None:
+            _metrics = InvocationMetrics(
+                agent_id=agent_id,
+                agent_alias_id=agent_alias_id,
+                session_id=session_id,
+                start_time=_time_before_call,
+            )
 
-        _agent_resp = self._bedrock_agent_runtime_client.invoke_agent(
-            inputText=input_text,
-            agentId=agent_id,
-            agentAliasId=agent_alias_id,
-            sessionId=session_id,
-            sessionState=session_state,
-            enableTrace=enable_trace,
-            endSession=end_session,
-            streamingConfigurations={"streamFinalResponse": stream_final_response},
+        _cache_key = self._response_cache_key(
+            ResponseCache.agent_target(agent_id, agent_alias_id),
+            input_text,
+            session_id,
+            session_state,
+            use_cache,
         )
+        if _cache_key is not None:
+            _cached_answer = self._cached_answer(
+                _cache_key, enable_trace, metrics_callback, _metrics
+            )
+            if _cached_answer is not None:
+                return _cached_answer
+
+        try:
+            _agent_resp = self._bedrock_agent_runtime_client.invoke_agent(
+                inputText=input_text,
+                agentId=agent_id,
+                agentAliasId=agent_alias_id,
+                sessionId=session_id,
+                sessionState=session_state,
+                enableTrace=enable_trace
+                or bool(trace_dispatcher)
+                or _metrics is not None,
+                endSession=end_session,
+                streamingConfigurations={"streamFinalResponse": stream_final_response},
+            )
+        except Exception as e:
+            if _metrics is not None:
+                self._emit_metrics(metrics_callback, _metrics, e)
+            raise
+        if _metrics is not None:
+            self._record_response_metadata(_metrics, _agent_resp)
 
         if enable_trace:
             if trace_level == "all":
@@ -2043,534 +2639,392 @@ class AgentsForAmazonBedrock:
             _error_message = f"API Response was not 200: {_agent_resp}"
             if enable_trace and trace_level == "all":
                 print(_error_message)
+            if _metrics is not None:
+                self._emit_metrics(metrics_callback, _metrics, _error_message)
             return _error_message
 
-        _total_in_tokens = 0
-        _total_out_tokens = 0
-        _total_llm_calls = 0
-        _orch_step = 0
-        _sub_step = 0
-        _num_response_chunks = 0
-        _time_before_orchestration = _overall_start_time = datetime.datetime.now()
-        _citations = []
-        _citations_event = None
-
-        _agent_answer = ""
-        _event_stream = _agent_resp["completion"]
-
         try:
-            _sub_agent_name = "<collab-name-not-yet-provided>"
-            for _event in _event_stream:
-                _sub_agent_alias_id = None
-
-                if "chunk" in _event:
-                    _data = _event["chunk"]["bytes"]
-                    _tmp_agent_answer = _data.decode("utf8")
-                    if enable_trace and trace_level == "all":
-                        print(
-                            f"tmp answer: '{_tmp_agent_answer}', streaming: {stream_final_response}, trace: {enable_trace}"
-                        )
+            _agent_answer, _citations_event = self._consume_completion(
+                _agent_resp["completion"],
+                _time_before_call,
+                enable_trace=enable_trace,
+                trace_level=trace_level,
+                trace_dispatcher=trace_dispatcher,
+                trace_context=TraceContext(
+                    trace_level=trace_level, agent_names=multi_agent_names
+                ),
+                stream_final_response=stream_final_response,
+                metrics=_metrics,
+            )
 
-                    # continue to build up the full answer
-                    _agent_answer += _tmp_agent_answer
+            if stream_final_response and enable_trace and trace_level == "all":
+                print(f"\nagent answer: ^^^{_agent_answer}^^^\n")
 
-                    if _num_response_chunks == 0:
-                        _time_to_first_token = (
-                            datetime.datetime.now() - _overall_start_time
-                        )
-                        if enable_trace and stream_final_response:
-                            print(
-                                colored(
-                                    f"Time to first token: {_time_to_first_token.total_seconds():,.1f}s\n",
-                                    "yellow",
-                                )
-                            )
-                    _num_response_chunks += 1
+            _agent_answer = self._make_fully_cited_answer(
+                _agent_answer, _citations_event, enable_trace, trace_level
+            )
+            if _cache_key is not None and isinstance(_agent_answer, str):
+                self._response_cache.put(_cache_key, _agent_answer)
+            if _metrics is not None:
+                self._emit_metrics(metrics_callback, _metrics)
 
-                    if (
-                        enable_trace
-                        and stream_final_response
-                        and _num_response_chunks < 3
-                    ):
-                        print(
-                            colored(
-                                f"Answer chunk [{_num_response_chunks}]: {_tmp_agent_answer}",
-                                "blue",
-                            )
-                        )
+            return _agent_answer
 
-                    # print all keys in _event["chunk"] dictionary if more than just 'bytes' provided
-                    if enable_trace and trace_level == "all":
-                        if len(_event["chunk"].keys()) > 1:
-                            print(
-                                f"chunk keys beyond just 'bytes': {list(_event['chunk'].keys())}"
-                            )
+        except Exception as e:
+            if _metrics is not None and _metrics.duration is None:
+                self._emit_metrics(metrics_callback, _metrics, e)
+            print(f"Caught exception while processing input to invokeAgent:\n")
+            print(f"  for input text:\n{input_text}\n")
+            print(f"  on agent: {agent_id}, alias: {agent_alias_id}")
+            print(
+                f"  request ID: {_agent_resp['ResponseMetadata']['RequestId']}, retries: {_agent_resp['ResponseMetadata']['RetryAttempts']}\n"
+            )
+            print(f"Error: {e}")
+            raise Exception("Unexpected exception: ", e)
 
-                    # remember the citations, if any are provided
-                    if "attribution" in _event["chunk"]:
-                        if "citations" in _event["chunk"]["attribution"]:
-                            _citations_event = copy.deepcopy(_event)
-                            _citations = _event["chunk"]["attribution"]["citations"]
-                            if enable_trace and trace_level == "all":
-                                print(colored(f"Citations: {_citations}", "blue"))
-
-                if "trace" in _event and enable_trace:
-                    if trace_level == "all":
-                        print("---")
-                    else:
-                        if "callerChain" in _event["trace"]:
-                            if len(_event["trace"]["callerChain"]) > 1:
-                                _sub_agent_alias_arn = _event["trace"]["callerChain"][
-                                    1
-                                ]["agentAliasArn"]
-                                # get sub agent id by grabbing all text following the first '/' character
-                                _sub_agent_alias_id = _sub_agent_alias_arn.split(
-                                    "/", 1
-                                )[1]
-                                _sub_agent_name = multi_agent_names[_sub_agent_alias_id]
-                                # _sub_agent_name = "<not-yet-provided>"
-
-                        # if 'collaboratorName' in _event['trace']:
-                        #     _sub_agent_name = _event['trace']['collaboratorName']
-                        # else:
-                        #     _sub_agent_name = "<collab-name-not-yet-provided>"
-
-                    if "routingClassifierTrace" in _event["trace"]["trace"]:
-                        _route = _event["trace"]["trace"]["routingClassifierTrace"]
-
-                        if "modelInvocationInput" in _route:
-                            _orch_step += 1
-                            print(colored(f"---- Step {_orch_step} ----", "green"))
-                            _time_before_routing = datetime.datetime.now()
-                            print(
-                                colored(
-                                    "Classifying request to immediately route to one collaborator if possible.",
-                                    "blue",
-                                )
-                            )
+    def _invoke_agent_stream(
+        self,
+        input_text: str,
+        agent_id: str,
+        agent_alias_id: str,
+        session_id: str,
+        session_state: dict,
+        enable_trace: bool,
+        end_session: bool,
+        stream_final_response: bool,
+    ):
+        """Calls invokeAgent and returns the raw completion event stream."""
+        _agent_resp = self._bedrock_agent_runtime_client.invoke_agent(
+            **self._invoke_agent_stream_params(
+                input_text,
+                agent_id,
+                agent_alias_id,
+                session_id,
+                session_state,
+                enable_trace,
+                end_session,
+                stream_final_response,
+            )
+        )
+        if _agent_resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            raise Exception(f"API Response was not 200: {_agent_resp}")
+        return _agent_resp["completion"]
 
-                        if "modelInvocationOutput" in _route:
-                            _llm_usage = _route["modelInvocationOutput"]["metadata"][
-                                "usage"
-                            ]
-                            _in_tokens = _llm_usage["inputTokens"]
-                            _total_in_tokens += _in_tokens
+    @staticmethod
+    def _invoke_agent_stream_params(
+        input_text: str,
+        agent_id: str,
+        agent_alias_id: str,
+        session_id: str,
+        session_state: dict,
+        enable_trace: bool,
+        end_session: bool,
+        stream_final_response: bool,
+    ) -> Dict:
+        """Returns the invokeAgent parameters of stream() and astream()."""
+        return dict(
+            inputText=input_text,
+            agentId=agent_id,
+            agentAliasId=agent_alias_id,
+            sessionId=session_id,
+            sessionState=session_state or {},
+            enableTrace=enable_trace,
+            endSession=end_session,
+            streamingConfigurations={"streamFinalResponse": stream_final_response},
+        )
 
-                            _out_tokens = _llm_usage["outputTokens"]
-                            _total_out_tokens += _out_tokens
+    def stream(
+        self,
+        input_text: str,
+        agent_id: str,
+        agent_alias_id: str = DEFAULT_ALIAS,
+        session_id: str = None,
+        session_state: dict = None,
+        enable_trace: bool = False,
+        end_session: bool = False,
+        stream_final_response: bool = True,
+    ) -> Iterator[AgentStreamEvent]:
+        """Invokes an agent and yields typed events as soon as they arrive on the
+        completion stream, instead of waiting for the full answer like invoke() does.
 
-                            _total_llm_calls += 1
-                            _route_duration = (
-                                datetime.datetime.now() - _time_before_routing
-                            )
+        Args:
+            input_text (str): The text to be processed by the agent.
+            agent_id (str): The ID of the agent to invoke.
+            agent_alias_id (str, optional): The alias ID of the agent to invoke. Defaults to DEFAULT_ALIAS.
+            session_id (str, optional): The ID of the session. Defaults to a new UUID.
+            session_state (dict, optional): The state of the session. Defaults to an empty dict.
+            enable_trace (bool, optional): Whether to request trace events. Defaults to False.
+            end_session (bool, optional): Whether to end the session. Defaults to False.
+            stream_final_response (bool, optional): Whether the agent streams its final response
+            in several chunks. Defaults to True.
 
-                            _raw_resp_str = _route["modelInvocationOutput"][
-                                "rawResponse"
-                            ]["content"]
-                            _raw_resp = json.loads(_raw_resp_str)
-                            _classification = (
-                                _raw_resp["content"][0]["text"]
-                                .replace("<a>", "")
-                                .replace("</a>", "")
-                            )
+        Yields:
+            AgentStreamEvent: chunk, citation, trace, returnControl and files events, in arrival order.
+        """
+        _event_stream = self._invoke_agent_stream(
+            input_text,
+            agent_id,
+            agent_alias_id,
+            session_id or str(uuid.uuid4()),
+            session_state,
+            enable_trace,
+            end_session,
+            stream_final_response,
+        )
+        for _event in _event_stream:
+            yield from _to_stream_events(_event)
 
-                            if _classification == UNDECIDABLE_CLASSIFICATION:
-                                print(
-                                    colored(
-                                        f"Routing classifier did not find a matching collaborator. Reverting to 'SUPERVISOR' mode.",
-                                        "magenta",
-                                    )
-                                )
-                            elif _classification == "keep_previous_agent":
-                                print(
-                                    colored(
-                                        f"Continuing conversation with previous collaborator.",
-                                        "magenta",
-                                    )
-                                )
-                                # # since we replaced the typical orchestration step with a simple routing
-                                # # classification, bump the step count.
-                                # _orch_step += 1
-                            else:
-                                _sub_agent_name = _classification
-                                print(
-                                    colored(
-                                        f"Routing classifier chose collaborator: '{_classification}'",
-                                        "magenta",
-                                    )
-                                )
-                                # # since we replaced the typical orchestration step with a simple routing
-                                # # classification, bump the step count.
-                                # _orch_step += 1
-                            print(
-                                colored(
-                                    f"Routing classifier took {_route_duration.total_seconds():,.1f}s, using {_in_tokens+_out_tokens} tokens (in: {_in_tokens}, out: {_out_tokens}).\n",
-                                    "yellow",
-                                )
-                            )
+    async def astream(
+        self,
+        input_text: str,
+        agent_id: str,
+        agent_alias_id: str = DEFAULT_ALIAS,
+        session_id: str = None,
+        session_state: dict = None,
+        enable_trace: bool = False,
+        end_session: bool = False,
+        stream_final_response: bool = True,
+        executor=None,
+    ) -> AsyncIterator[AgentStreamEvent]:
+        """Asynchronous version of stream(), for use from an asyncio event loop.
 
-                    if "failureTrace" in _event["trace"]["trace"]:
-                        print(
-                            colored(
-                                f"Agent error: {_event['trace']['trace']['failureTrace']['failureReason']}",
-                                "red",
-                            )
-                        )
+        When aiobotocore is installed and no executor is given, the call and the completion stream
+        are awaited on a non-blocking client of the AwsContext, so sessions in flight hold no
+        thread, only a connection: raise the max_pool_connections of the AwsContext to stream more
+        sessions at once. Close the client with AwsContext.close_async_clients() before the event
+        loop ends.
 
-                    if "orchestrationTrace" in _event["trace"]["trace"]:
-                        _orch = _event["trace"]["trace"]["orchestrationTrace"]
-
-                        if trace_level in ["core", "outline"]:
-                            if "rationale" in _orch:
-                                _rationale = _orch["rationale"]
-                                print(colored(f"{_rationale['text']}", "blue"))
-
-                            if "invocationInput" in _orch:
-                                # NOTE: when agent determines invocations should happen in parallel
-                                # the trace objects for invocation input still come back one at a time.
-                                _input = _orch["invocationInput"]
-
-                                if "actionGroupInvocationInput" in _input:
-                                    if trace_level == "outline":
-                                        print(
-                                            colored(
-                                                f"Using tool: {_input['actionGroupInvocationInput']['function']}",
-                                                "magenta",
-                                            )
-                                        )
-                                    else:
-                                        if (
-                                            "function"
-                                            not in _input["actionGroupInvocationInput"]
-                                        ):
-                                            print(
-                                                colored(
-                                                    f"EXPECTING to capture 'Using tool', but 'function' not found\n{_input['actionGroupInvocationInput']}",
-                                                    "red",
-                                                )
-                                            )
-                                        else:
-                                            print(
-                                                colored(
-                                                    f"Using tool: {_input['actionGroupInvocationInput']['function']} with these inputs:",
-                                                    "magenta",
-                                                )
-                                            )
-                                            if (
-                                                "parameters"
-                                                in _input["actionGroupInvocationInput"]
-                                            ):
-                                                if (
-                                                    len(
-                                                        _input[
-                                                            "actionGroupInvocationInput"
-                                                        ]["parameters"]
-                                                    )
-                                                    == 1
-                                                ) and (
-                                                    _input[
-                                                        "actionGroupInvocationInput"
-                                                    ]["parameters"][0]["name"]
-                                                    == "input_text"
-                                                ):
-                                                    print(
-                                                        colored(
-                                                            f"{_input['actionGroupInvocationInput']['parameters'][0]['value']}",
-                                                            "magenta",
-                                                        )
-                                                    )
-                                                else:
-                                                    print(
-                                                        colored(
-                                                            f"{_input['actionGroupInvocationInput']['parameters']}\n",
-                                                            "magenta",
-                                                        )
-                                                    )
-                                            else:
-                                                print(
-                                                    colored(
-                                                        f"    no input parameters being sent\n",
-                                                        "magenta",
-                                                    )
-                                                )
-
-                                elif "agentCollaboratorInvocationInput" in _input:
-                                    _collab_name = _input[
-                                        "agentCollaboratorInvocationInput"
-                                    ]["agentCollaboratorName"]
-                                    _sub_agent_name = _collab_name
-                                    _collab_input_text = _input[
-                                        "agentCollaboratorInvocationInput"
-                                    ]["input"]["text"]
-                                    _collab_arn = _input[
-                                        "agentCollaboratorInvocationInput"
-                                    ]["agentCollaboratorAliasArn"]
-                                    _collab_ids = _collab_arn.split("/", 1)[1]
-
-                                    if trace_level == "outline":
-                                        print(
-                                            colored(
-                                                f"Using sub-agent collaborator: '{_collab_name} [{_collab_ids}]'",
-                                                "magenta",
-                                            )
-                                        )
-                                    else:
-                                        print(
-                                            colored(
-                                                f"Using sub-agent collaborator: '{_collab_name} [{_collab_ids}]' passing input text:",
-                                                "magenta",
-                                            )
-                                        )
-                                        print(
-                                            colored(
-                                                f"{_collab_input_text[0:TRACE_TRUNCATION_LENGTH]}\n",
-                                                "magenta",
-                                            )
-                                        )
-
-                                elif "codeInterpreterInvocationInput" in _input:
-                                    if trace_level == "outline":
-                                        print(
-                                            colored(
-                                                f"Using code interpreter", "magenta"
-                                            )
-                                        )
-                                    else:
-                                        console = Console()
-                                        _gen_code = _input[
-                                            "codeInterpreterInvocationInput"
-                                        ]["code"]
-                                        _code = f"```python\n{_gen_code}\n```"
-
-                                        console.print(
-                                            Markdown(f"**Generated code**\n{_code}")
-                                        )
-
-                                elif "knowledgeBaseLookupInput" in _input:
-                                    if trace_level == "outline":
-                                        print(
-                                            colored(f"Using knowledge base", "magenta")
-                                        )
-                                    else:
-                                        _kb_id = _input["knowledgeBaseLookupInput"][
-                                            "knowledgeBaseId"
-                                        ]
-                                        _kb_query = _input["knowledgeBaseLookupInput"][
-                                            "text"
-                                        ]
-                                        print(
-                                            colored(
-                                                f"Using knowledge base id: {_kb_id} to search for:",
-                                                "magenta",
-                                            )
-                                        )
-                                        print(colored(f"  {_kb_query}\n", "magenta"))
-
-                            if "observation" in _orch:
-                                if trace_level == "core":
-                                    _output = _orch["observation"]
-                                    if "actionGroupInvocationOutput" in _output:
-                                        print(
-                                            colored(
-                                                f"--tool outputs:\n{_output['actionGroupInvocationOutput']['text'][0:TRACE_TRUNCATION_LENGTH]}...\n",
-                                                "magenta",
-                                            )
-                                        )
-
-                                    if "agentCollaboratorInvocationOutput" in _output:
-                                        _collab_name = _output[
-                                            "agentCollaboratorInvocationOutput"
-                                        ]["agentCollaboratorName"]
-                                        _collab_output_text = _output[
-                                            "agentCollaboratorInvocationOutput"
-                                        ]["output"]["text"][0:TRACE_TRUNCATION_LENGTH]
-                                        print(
-                                            colored(
-                                                f"\n----sub-agent {_collab_name} output text:\n{_collab_output_text}...\n",
-                                                "magenta",
-                                            )
-                                        )
-
-                                    if "knowledgeBaseLookupOutput" in _output:
-                                        _refs = _output["knowledgeBaseLookupOutput"][
-                                            "retrievedReferences"
-                                        ]
-                                        _ref_count = len(_refs)
-                                        print(
-                                            colored(
-                                                f"Knowledge base lookup output, {_ref_count} references:\n",
-                                                "magenta",
-                                            )
-                                        )
-                                        _curr = 1
-                                        for _ref in _refs:
-                                            print(
-                                                colored(
-                                                    f"  ({_curr}) {_ref['content']['text'][0:TRACE_TRUNCATION_LENGTH]}...\n",
-                                                    "magenta",
-                                                )
-                                            )
-                                            _curr += 1
-
-                                    if "finalResponse" in _output:
-                                        print(
-                                            colored(
-                                                f"Final response:\n{_output['finalResponse']['text'][0:TRACE_TRUNCATION_LENGTH]}...",
-                                                "cyan",
-                                            )
-                                        )
-
-                        if "modelInvocationOutput" in _orch:
-                            if _sub_agent_alias_id is not None:
-                                _sub_step += 1
-                                print(
-                                    colored(
-                                        f"---- Step {_orch_step}.{_sub_step} [using sub-agent name:{_sub_agent_name}, id:{_sub_agent_alias_id}] ----",
-                                        "green",
-                                    )
-                                )
-                            else:
-                                _orch_step += 1
-                                _sub_step = 0
-                                print(colored(f"---- Step {_orch_step} ----", "green"))
-
-                            _total_llm_calls += 1
-                            _orch_duration = (
-                                datetime.datetime.now() - _time_before_orchestration
-                            )
+        Otherwise boto3, which blocks, runs the invokeAgent call and each read from the completion
+        stream in a thread of an executor. A session waiting for its next event holds one of its
+        threads, so at most as many sessions as the executor has threads are streamed at once, and
+        the others wait for a free thread.
 
-                            if "metadata" in _orch["modelInvocationOutput"]:
-                                _llm_usage = _orch["modelInvocationOutput"]["metadata"][
-                                    "usage"
-                                ]
-                                _in_tokens = _llm_usage["inputTokens"]
-                                _total_in_tokens += _in_tokens
-
-                                _out_tokens = _llm_usage["outputTokens"]
-                                _total_out_tokens += _out_tokens
-
-                                print(
-                                    colored(
-                                        f"Took {_orch_duration.total_seconds():,.1f}s, using {_in_tokens+_out_tokens} tokens (in: {_in_tokens}, out: {_out_tokens}) to complete prior action, observe, orchestrate.",
-                                        "yellow",
-                                    )
-                                )
-                            else:
-                                print(
-                                    colored(
-                                        f"Took {_orch_duration.total_seconds():,.1f}s [token count metadata was not returned] to complete prior action, observe, orchestrate.",
-                                        "yellow",
-                                    )
-                                )
-
-                            # restart the clock for next step/sub-step
-                            _time_before_orchestration = datetime.datetime.now()
-
-                    elif "preProcessingTrace" in _event["trace"]["trace"]:
-                        _pre = _event["trace"]["trace"]["preProcessingTrace"]
-                        if "modelInvocationOutput" in _pre:
-                            _llm_usage = _pre["modelInvocationOutput"]["metadata"][
-                                "usage"
-                            ]
-                            _in_tokens = _llm_usage["inputTokens"]
-                            _total_in_tokens += _in_tokens
-
-                            _out_tokens = _llm_usage["outputTokens"]
-                            _total_out_tokens += _out_tokens
-
-                            _total_llm_calls += 1
-
-                            print(
-                                colored(
-                                    "Pre-processing trace, agent came up with an initial plan.",
-                                    "yellow",
-                                )
-                            )
-                            print(
-                                colored(
-                                    f"Used LLM tokens, in: {_in_tokens}, out: {_out_tokens}",
-                                    "yellow",
-                                )
-                            )
+        The completion stream is closed, and its connection released, when the consumer stops
+        iterating early.
 
-                    elif "postProcessingTrace" in _event["trace"]["trace"]:
-                        _post = _event["trace"]["trace"]["postProcessingTrace"]
-                        if "modelInvocationOutput" in _post:
-                            _llm_usage = _post["modelInvocationOutput"]["metadata"][
-                                "usage"
-                            ]
-                            _in_tokens = _llm_usage["inputTokens"]
-                            _total_in_tokens += _in_tokens
-
-                            _out_tokens = _llm_usage["outputTokens"]
-                            _total_out_tokens += _out_tokens
-
-                            _total_llm_calls += 1
-                            print(colored("Agent post-processing complete.", "yellow"))
-                            print(
-                                colored(
-                                    f"Used LLM tokens, in: {_in_tokens}, out: {_out_tokens}",
-                                    "yellow",
-                                )
-                            )
+        Args:
+            input_text (str): The text to be processed by the agent.
+            agent_id (str): The ID of the agent to invoke.
+            agent_alias_id (str, optional): The alias ID of the agent to invoke. Defaults to DEFAULT_ALIAS.
+            session_id (str, optional): The ID of the session. Defaults to a new UUID.
+            session_state (dict, optional): The state of the session. Defaults to an empty dict.
+            enable_trace (bool, optional): Whether to request trace events. Defaults to False.
+            end_session (bool, optional): Whether to end the session. Defaults to False.
+            stream_final_response (bool, optional): Whether the agent streams its final response
+            in several chunks. Defaults to True.
+            executor (concurrent.futures.Executor, optional): Executor running blocking boto3 calls
+            instead of aiobotocore. Defaults to aiobotocore when it is installed, else to a shared
+            executor of DEFAULT_ASYNC_STREAM_WORKERS threads.
+
+        Yields:
+            AgentStreamEvent: chunk, citation, trace, returnControl and files events, in arrival order.
+        """
+        _session_id = session_id or str(uuid.uuid4())
+        if executor is None and _AIOBOTOCORE_AVAILABLE:
+            _service_name, _config_options = _CONTEXT_CLIENTS[
+                "_bedrock_agent_runtime_client"
+            ]
+            _client = await self._aws_context().async_client(
+                _service_name, **_config_options
+            )
+            _agent_resp = await _client.invoke_agent(
+                **self._invoke_agent_stream_params(
+                    input_text,
+                    agent_id,
+                    agent_alias_id,
+                    _session_id,
+                    session_state,
+                    enable_trace,
+                    end_session,
+                    stream_final_response,
+                )
+            )
+            if _agent_resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                raise Exception(f"API Response was not 200: {_agent_resp}")
+            _event_stream = _agent_resp["completion"]
+            try:
+                async for _event in _event_stream:
+                    for _typed_event in _to_stream_events(_event):
+                        yield _typed_event
+            finally:
+                _event_stream.close()
+            return
 
-                    if trace_level == "all":
-                        print(json.dumps(_event["trace"], indent=2))
+        _loop = asyncio.get_running_loop()
+        if executor is None:
+            executor = _default_async_stream_executor()
+        _event_stream = await _loop.run_in_executor(
+            executor,
+            self._invoke_agent_stream,
+            input_text,
+            agent_id,
+            agent_alias_id,
+            _session_id,
+            session_state,
+            enable_trace,
+            end_session,
+            stream_final_response,
+        )
+        try:
+            _iterator = iter(_event_stream)
+            _end_of_stream = object()
+            while True:
+                _event = await _loop.run_in_executor(
+                    executor, next, _iterator, _end_of_stream
+                )
+                if _event is _end_of_stream:
+                    break
+                for _typed_event in _to_stream_events(_event):
+                    yield _typed_event
+        finally:
+            _event_stream.close()
+
+    async def ainvoke(
+        self,
+        input_text: str,
+        agent_id: str,
+        agent_alias_id: str = DEFAULT_ALIAS,
+        session_id: str = None,
+        session_state: dict = None,
+        end_session: bool = False,
+        executor=None,
+    ):
+        """Asynchronous version of invoke(). Many calls can be awaited concurrently, for example
+        with asyncio.gather(); see astream() for how many run at once.
 
-                if "files" in _event.keys() and enable_trace:
-                    console = Console()
-                    files_event = _event["files"]
-                    console.print(Markdown("**Files**"))
+        Args:
+            input_text (str): The text to be processed by the agent.
+            agent_id (str): The ID of the agent to invoke.
+            agent_alias_id (str, optional): The alias ID of the agent to invoke. Defaults to DEFAULT_ALIAS.
+            session_id (str, optional): The ID of the session. Defaults to a new UUID.
+            session_state (dict, optional): The state of the session. Defaults to an empty dict.
+            end_session (bool, optional): Whether to end the session. Defaults to False.
+            executor (concurrent.futures.Executor, optional): Executor running blocking boto3 calls
+            instead of aiobotocore. Defaults to aiobotocore when it is installed, else to a shared
+            executor of DEFAULT_ASYNC_STREAM_WORKERS threads.
 
-                    files_list = files_event["files"]
-                    for this_file in files_list:
-                        print(f"{this_file['name']} ({this_file['type']})")
-                        file_bytes = this_file["bytes"]
+        Returns:
+            str: The answer from the agent, or the returnControl payload for ROC action groups.
+        """
+        _agent_answer = ""
+        _citations_event = None
+        async for _event in self.astream(
+            input_text,
+            agent_id,
+            agent_alias_id=agent_alias_id,
+            session_id=session_id,
+            session_state=session_state,
+            end_session=end_session,
+            stream_final_response=False,
+            executor=executor,
+        ):
+            if _event.type == STREAM_EVENT_CHUNK:
+                _agent_answer += _event.data
+            elif _event.type == STREAM_EVENT_CITATION:
+                _citations_event = _event.raw
+            elif _event.type == STREAM_EVENT_RETURN_CONTROL:
+                return _event.data
+        return self._make_fully_cited_answer(_agent_answer, _citations_event)
+
+    def invoke_many(
+        self,
+        inputs: List,
+        agent_id: str,
+        agent_alias_id: str = DEFAULT_ALIAS,
+        max_concurrency: int = 4,
+        rate_limit: float = None,
+        max_retries: int = 5,
+        multi_agent_names: dict = {},
+        verbose: bool = False,
+        local_tools: LocalToolExecutor = None,
+    ) -> List[InvocationResult]:
+        """Invokes an agent once per input, running up to max_concurrency invocations at a time.
+        Each input runs in its own session unless a session_id is supplied with it, and throttled
+        calls are retried with exponential backoff and jitter.
 
-                        # save bytes to file, given the name of file and the bytes
-                        file_name = os.path.join("output", this_file["name"])
-                        with open(file_name, "wb") as f:
-                            f.write(file_bytes)
-                        # if this_file['type'] == 'image/png' or this_file['type'] == 'image/jpeg':
-                        #     img = mpimg.imread(file_name)
-                        #     # plt.imshow(img)
-                        #     # plt.show()
+        Args:
+            inputs (List): input texts, or dicts with an "input_text" key and optional "session_id"
+            and "session_state" keys.
+            agent_id (str): The ID of the agent to invoke.
+            agent_alias_id (str, optional): The alias ID of the agent to invoke. Defaults to DEFAULT_ALIAS.
+            max_concurrency (int, optional): Maximum number of invocations in flight. Defaults to 4.
+            rate_limit (float, optional): Maximum number of invokeAgent calls started per second across
+            all workers, to stay within the account quota. Defaults to None (no limit).
+            max_retries (int, optional): Retries for a throttled input before giving up. Defaults to 5.
+            multi_agent_names (dict, optional): Mapping of alias ids to agent names, as used by invoke().
+            verbose (bool, optional): Whether to print a summary of the batch. Defaults to False.
+            local_tools (LocalToolExecutor, optional): runs the return of control tools of the agent
+            locally, see invoke_with_local_tools(). Defaults to None.
 
-            if enable_trace:
-                duration = datetime.datetime.now() - _time_before_call
+        Returns:
+            List[InvocationResult]: one result per input, in the same order as the inputs. Failed
+            inputs carry the error instead of raising, so one failure does not lose the batch.
+        """
+        _limiter = _RateLimiter(rate_limit) if rate_limit else None
 
-                if trace_level in ["core", "outline"]:
-                    print(
-                        colored(
-                            f"Agent made a total of {_total_llm_calls} LLM calls, "
-                            + f"using {_total_in_tokens+_total_out_tokens} tokens "
-                            + f"(in: {_total_in_tokens}, out: {_total_out_tokens})"
-                            + f", and took {duration.total_seconds():,.1f} total seconds",
-                            "yellow",
+        def _invoke_one(index: int, item) -> InvocationResult:
+            if isinstance(item, dict):
+                _input_text = item["input_text"]
+                _session_id = item.get("session_id") or str(uuid.uuid4())
+                _session_state = item.get("session_state", {})
+            else:
+                _input_text = item
+                _session_id = str(uuid.uuid4())
+                _session_state = {}
+
+            _result = InvocationResult(index, _input_text, _session_id)
+            _start = time.monotonic()
+            while True:
+                if _limiter is not None:
+                    _limiter.acquire()
+                _result.attempts += 1
+                try:
+                    if local_tools is not None:
+                        _result.output = self.invoke_with_local_tools(
+                            _input_text,
+                            agent_id,
+                            local_tools,
+                            agent_alias_id=agent_alias_id,
+                            session_id=_session_id,
+                            session_state=_session_state,
+                            multi_agent_names=multi_agent_names,
                         )
-                    )
-
-                if trace_level == "all":
-                    print(f"Returning agent answer as: {_agent_answer}")
-
-            if stream_final_response and enable_trace and trace_level == "all":
-                print(f"\nagent answer: ^^^{_agent_answer}^^^\n")
-
-            _agent_answer = self._make_fully_cited_answer(
-                _agent_answer, _citations_event, enable_trace, trace_level
-            )
-
-            return _agent_answer
+                    else:
+                        _result.output = self.invoke(
+                            _input_text,
+                            agent_id,
+                            agent_alias_id=agent_alias_id,
+                            session_id=_session_id,
+                            session_state=_session_state,
+                            multi_agent_names=multi_agent_names,
+                        )
+                    _result.error = None
+                    break
+                except Exception as e:
+                    _result.error = e
+                    if not _is_throttling_error(e) or _result.attempts > max_retries:
+                        break
+                    time.sleep(random.uniform(0, min(30, 2**_result.attempts)))
+            _result.duration = time.monotonic() - _start
+            return _result
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as _executor:
+            _futures = [
+                _executor.submit(_invoke_one, _idx, _item)
+                for _idx, _item in enumerate(inputs)
+            ]
+            _results = [_future.result() for _future in _futures]
 
-        except Exception as e:
-            print(f"Caught exception while processing input to invokeAgent:\n")
-            print(f"  for input text:\n{input_text}\n")
-            print(f"  on agent: {agent_id}, alias: {agent_alias_id}")
+        if verbose:
+            _failed = [_r for _r in _results if not _r.succeeded]
             print(
-                f"  request ID: {_agent_resp['ResponseMetadata']['RequestId']}, retries: {_agent_resp['ResponseMetadata']['RetryAttempts']}\n"
+                f"invoke_many: {len(_results) - len(_failed)} of {len(_results)} inputs succeeded"
             )
-            print(f"Error: {e}")
-            raise Exception("Unexpected exception: ", e)
+            for _r in _failed:
+                print(
+                    f"  input {_r.index} failed after {_r.attempts} attempts: {_r.error}"
+                )
+        return _results
 
     def invoke_roc(
         self,
@@ -2657,12 +3111,140 @@ class AgentsForAmazonBedrock:
         except Exception as e:
             raise Exception("unexpected event.", e)
 
+    def invoke_with_local_tools(
+        self,
+        input_text: str,
+        agent_id: str,
+        local_tools: LocalToolExecutor,
+        agent_alias_id: str = DEFAULT_ALIAS,
+        session_id: str = None,
+        session_state: dict = None,
+        enable_trace: bool = False,
+        max_rounds: int = DEFAULT_MAX_ROC_ROUNDS,
+        trace_level: str = "core",
+        multi_agent_names: dict = {},
+        trace_dispatcher: TraceDispatcher = None,
+        metrics_callback: Callable[[InvocationMetrics], None] = None,
+        use_cache: bool = True,
+    ) -> str:
+        """Invokes an agent whose tools are return of control action groups run locally: the
+        invocation inputs of each returnControl event are executed concurrently by local_tools, and
+        their results are sent back to the agent in one call, until the agent answers.
+
+        Args:
+            input_text (str): The text to be processed by the agent.
+            agent_id (str): The ID of the agent to invoke.
+            local_tools (LocalToolExecutor): Runs the tools of the agent.
+            agent_alias_id (str, optional): The alias ID of the agent to invoke. Defaults to DEFAULT_ALIAS.
+            session_id (str, optional): The ID of the session. Defaults to a new UUID.
+            session_state (dict, optional): The state of the session. Defaults to an empty dict.
+            enable_trace (bool, optional): Whether to print the trace. Defaults to False.
+            max_rounds (int, optional): returnControl events handled before raising. Defaults to DEFAULT_MAX_ROC_ROUNDS.
+            trace_level, multi_agent_names, trace_dispatcher, metrics_callback, use_cache: as for
+            invoke(). The trace of every round goes to the trace dispatcher, and the metrics cover
+            all the rounds of the invocation.
+
+        Returns:
+            str: The answer from the agent.
+        """
+        _session_id = session_id or str(uuid.uuid4())
+        _session_state = dict(session_state or {})
+        _time_before_call = datetime.datetime.now()
+        _metrics = None
+        if metrics_callback is not None:
+            _metrics = InvocationMetrics(
+                agent_id=agent_id,
+                agent_alias_id=agent_alias_id,
+                session_id=_session_id,
+                start_time=_time_before_call,
+            )
+
+        _cache_key = self._response_cache_key(
+            ResponseCache.agent_target(agent_id, agent_alias_id),
+            input_text,
+            _session_id,
+            _session_state,
+            use_cache,
+        )
+        if _cache_key is not None:
+            _cached_answer = self._cached_answer(
+                _cache_key, enable_trace, metrics_callback, _metrics
+            )
+            if _cached_answer is not None:
+                return _cached_answer
+
+        _input_text = input_text
+        for _ in range(max_rounds + 1):
+            try:
+                _agent_resp = self._bedrock_agent_runtime_client.invoke_agent(
+                    inputText=_input_text,
+                    agentId=agent_id,
+                    agentAliasId=agent_alias_id,
+                    sessionId=_session_id,
+                    sessionState=_session_state,
+                    enableTrace=enable_trace
+                    or bool(trace_dispatcher)
+                    or _metrics is not None,
+                    streamingConfigurations={"streamFinalResponse": False},
+                )
+                if _metrics is not None:
+                    self._record_response_metadata(_metrics, _agent_resp)
+                if _agent_resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                    raise Exception(f"API Response was not 200: {_agent_resp}")
+                _answer, _citations_event = self._consume_completion(
+                    _agent_resp["completion"],
+                    _time_before_call,
+                    enable_trace=enable_trace,
+                    trace_level=trace_level,
+                    trace_dispatcher=trace_dispatcher,
+                    trace_context=TraceContext(
+                        trace_level=trace_level, agent_names=multi_agent_names
+                    ),
+                    return_control_answer=True,
+                    metrics=_metrics,
+                )
+            except Exception as e:
+                if _metrics is not None:
+                    self._emit_metrics(metrics_callback, _metrics, e)
+                raise
+
+            if not isinstance(_answer, dict):
+                _answer = self._make_fully_cited_answer(
+                    _answer, _citations_event, enable_trace, trace_level
+                )
+                if _cache_key is not None:
+                    self._response_cache.put(_cache_key, _answer)
+                if _metrics is not None:
+                    self._emit_metrics(metrics_callback, _metrics)
+                return _answer
+
+            _results = local_tools.execute(
+                _answer, _session_id, _session_state, input_text
+            )
+            # the results replace the input text of the next call
+            _input_text = ""
+            _session_state = {
+                **{
+                    _key: _value
+                    for _key, _value in _session_state.items()
+                    if _key not in ["invocationId", "returnControlInvocationResults"]
+                },
+                "invocationId": _answer["invocationId"],
+                "returnControlInvocationResults": _results,
+            }
+        _error = f"Agent {agent_id} still returned control after {max_rounds} rounds of local tool calls"
+        if _metrics is not None:
+            self._emit_metrics(metrics_callback, _metrics, _error)
+        raise Exception(_error)
+
     def update_agent(
         self,
         agent_name: str,
         new_model_id: str = None,
         new_instructions: str = None,
         guardrail_id: str = None,
+        new_description: str = None,
+        prepare_agent: bool = True,
     ):
         """Updates an agent with new details.
 
@@ -2671,6 +3253,8 @@ class AgentsForAmazonBedrock:
             new_model_id (str, optional): The new model ID to use. Defaults to None.
             new_instructions (str, optional): The new instructions to use. Defaults to None.
             guardrail_id (str, optional): ID of the new guardrail to use. Defaults to None.
+            new_description (str, optional): The new description to use. Defaults to None.
+            prepare_agent (bool, optional): Whether to prepare the agent after the update. Defaults to True.
 
         Returns:
             dict: UpdateAgent response.
@@ -2690,6 +3274,10 @@ class AgentsForAmazonBedrock:
         if new_instructions is not None:
             _agent_details["instruction"] = new_instructions
 
+        # Update description.
+        if new_description is not None:
+            _agent_details["description"] = new_description
+
         # Update guardrail or if there was none, this will add it.
         if guardrail_id is not None:
             _agent_details["guardrailConfiguration"] = {
@@ -2733,13 +3321,368 @@ class AgentsForAmazonBedrock:
             **_agent_details
         )
 
-        time.sleep(3)
+        self.wait_agent_status_update(_agent_id, verbose=False)
 
         # Prepare Agent
-        self._bedrock_agent_client.prepare_agent(agentId=_agent_id)
+        if prepare_agent:
+            self._bedrock_agent_client.prepare_agent(agentId=_agent_id)
 
         return _update_agent_response
 
+    @staticmethod
+    def _normalize_functions(functions: List[Dict]) -> List[Dict]:
+        """Puts function definitions in the shape returned by GetAgentActionGroup, with
+        defaults filled in, so that desired and deployed definitions can be compared."""
+        _normalized = []
+        for _function in functions or []:
+            _parameters = {}
+            for _param_name, _param in _function.get("parameters", {}).items():
+                _parameters[_param_name] = {
+                    "description": _param.get("description", ""),
+                    "type": _param["type"],
+                    "required": _param.get("required", False),
+                }
+            _normalized.append(
+                {
+                    "name": _function["name"],
+                    "description": _function.get("description", ""),
+                    "parameters": _parameters,
+                    "requireConfirmation": _function.get(
+                        "requireConfirmation", "DISABLED"
+                    ),
+                }
+            )
+        return sorted(_normalized, key=lambda f: f["name"])
+
+    def agent_spec_fingerprint(
+        self,
+        agent_description: str,
+        agent_instructions: str,
+        model_id: str,
+        action_groups: List[Dict] = None,
+        kb_id: str = None,
+        kb_descr: str = None,
+        guardrail_id: str = None,
+        code_interpretation: bool = False,
+    ) -> str:
+        """Returns a hash of the desired definition of an agent, including the code of its
+        Lambda functions. See reconcile_agent() for the arguments.
+
+        Returns:
+            str: hex digest that changes whenever any part of the definition changes
+        """
+        _action_groups = []
+        for _ag in action_groups or []:
+            _executor = _ag["executor"]
+            if _executor != "ROC" and "arn:" not in _executor:
+                _executor = self._code_sha256(
+                    self._package_lambda_code(_executor, _ag.get("package_paths"))
+                )
+            _action_groups.append(
+                {
+                    "name": _ag["action_group_name"],
+                    "description": _ag.get("description"),
+                    "functions": self._normalize_functions(_ag["functions"]),
+                    "executor": _executor,
+                    "lambda_function_name": _ag.get("lambda_function_name"),
+                    "requirements": sorted(_ag.get("requirements") or []),
+                }
+            )
+        _spec = {
+            "description": agent_description.replace("\n", ""),
+            "instructions": agent_instructions,
+            "model_id": model_id,
+            "action_groups": _action_groups,
+            "kb_id": kb_id,
+            "kb_descr": kb_descr if kb_id is not None else None,
+            "guardrail_id": guardrail_id,
+            "code_interpretation": code_interpretation,
+        }
+        return hashlib.sha256(
+            json.dumps(_spec, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _reconcile_lambda(
+        self, agent_name: str, action_group: Dict, verbose: bool = False
+    ) -> Tuple[str, bool]:
+        """Makes sure the Lambda function of an action group exists and runs the current code,
+        with the dependency layer of its current requirements.
+
+        Returns:
+            Tuple[str, bool]: ARN of the function, and whether it was created or updated
+        """
+        _function_name = action_group["lambda_function_name"]
+        _zip_content = self._package_lambda_code(
+            action_group["executor"], action_group.get("package_paths")
+        )
+        try:
+            _function = self._lambda_client.get_function(FunctionName=_function_name)
+        except self._lambda_client.exceptions.ResourceNotFoundException:
+            _lambda_arn = self.create_lambda(
+                agent_name,
+                _function_name,
+                action_group["executor"],
+                additional_function_iam_policy=action_group.get(
+                    "additional_function_iam_policy"
+                ),
+                package_paths=action_group.get("package_paths"),
+                requirements=action_group.get("requirements"),
+            )
+            return _lambda_arn, True
+
+        _lambda_arn = _function["Configuration"]["FunctionArn"]
+        _updated = deploy_function_code(
+            self._lambda_client,
+            _function_name,
+            LambdaPackage(_zip_content, []),
+            verbose=verbose,
+        )
+        # changed requirements only change the layers of the function
+        _layers_updated = self._update_function_layers(
+            _function["Configuration"],
+            self._dependency_layers(action_group.get("requirements")),
+        )
+        if _layers_updated and verbose:
+            print(f"Updated the layers of Lambda function {_function_name}")
+        return _lambda_arn, _updated or _layers_updated
+
+    def reconcile_agent(
+        self,
+        agent_name: str,
+        agent_description: str,
+        agent_instructions: str,
+        model_id: str,
+        action_groups: List[Dict] = None,
+        kb_id: str = None,
+        kb_descr: str = " ",
+        guardrail_id: str = None,
+        code_interpretation: bool = False,
+        verbose: bool = False,
+        check_drift: bool = False,
+    ) -> List[str]:
+        """Brings an existing agent in line with its desired definition using the fewest update
+        calls, instead of deleting and recreating it. The fingerprint of the definition is saved
+        as a tag on the agent, so an agent that is already up to date costs a single call. The tag
+        only reflects the last reconcile: changes made to the agent by other means, e.g. in the
+        console, are only detected and repaired with check_drift.
+        When something changed, the agent is prepared once and its latest alias is moved to a
+        new version, so the alias ARN used by supervisors stays the same.
+
+        Args:
+            agent_name (str): name of the existing agent
+            agent_description (str): description of the agent
+            agent_instructions (str): instructions for the agent
+            model_id (str): ID of the foundation model
+            action_groups (List[Dict], Optional): desired action groups, each with action_group_name,
+            description, functions and executor. The executor is "ROC" for return of control, the ARN
+            of an existing Lambda function, or a local source file for the Lambda function named
+            lambda_function_name (optionally with additional_function_iam_policy, and with the
+            package_paths and requirements of create_lambda()).
+            kb_id (str, Optional): id of the Knowledge Base to associate with the agent
+            kb_descr (str, Optional): description of the Knowledge Base
+            guardrail_id (str, Optional): id of the guardrail
+            code_interpretation (bool, Optional): whether code interpretation is enabled
+            verbose (bool, Optional): whether to print the changes. Defaults to False.
+            check_drift (bool, Optional): whether to compare the deployed agent with the definition
+            even when the fingerprint tag matches it. Defaults to False.
+
+        Returns:
+            List[str]: the changes that were applied, empty if the agent was up to date
+        """
+        _target_agent = self._lookup_agent(agent_name)
+        if _target_agent is None:
+            raise ValueError(f"Agent {agent_name} not found")
+        _agent_id = _target_agent["agentId"]
+        _agent_arn = _target_agent["agentArn"]
+        action_groups = action_groups or []
+
+        _fingerprint = self.agent_spec_fingerprint(
+            agent_description,
+            agent_instructions,
+            model_id,
+            action_groups,
+            kb_id,
+            kb_descr,
+            guardrail_id,
+            code_interpretation,
+        )
+        _tags = self._bedrock_agent_client.list_tags_for_resource(
+            resourceArn=_agent_arn
+        ).get("tags", {})
+        if not check_drift and _tags.get(AGENT_SPEC_FINGERPRINT_TAG) == _fingerprint:
+            if verbose:
+                print(f"Agent {agent_name} is up to date")
+            return []
+
+        _changes = []
+        self.wait_agent_status_update(_agent_id, verbose=False)
+
+        # agent definition
+        _agent = self._bedrock_agent_client.get_agent(agentId=_agent_id)["agent"]
+        _deployed_guardrail_id = _agent.get("guardrailConfiguration", {}).get(
+            "guardrailIdentifier"
+        )
+        _description = agent_description.replace("\n", "")
+        if (
+            _agent.get("instruction") != agent_instructions
+            or _agent.get("description", "") != _description
+            or _agent["foundationModel"] != model_id
+            or _deployed_guardrail_id != guardrail_id
+        ):
+            self.update_agent(
+                agent_name,
+                new_model_id=model_id,
+                new_instructions=agent_instructions,
+                guardrail_id=guardrail_id,
+                new_description=_description,
+                prepare_agent=False,
+            )
+            _changes.append("agent definition")
+
+        # action groups
+        _deployed_action_groups = {}
+        _paginator = self._bedrock_agent_client.get_paginator(
+            "list_agent_action_groups"
+        )
+        for _page in _paginator.paginate(agentId=_agent_id, agentVersion="DRAFT"):
+            for _summary in _page["actionGroupSummaries"]:
+                _deployed_action_groups[_summary["actionGroupName"]] = _summary
+
+        _lambda_arns = {}
+        for _ag in action_groups:
+            _executor = _ag["executor"]
+            if _executor == "ROC":
+                _action_group_executor = {"customControl": "RETURN_CONTROL"}
+            elif "arn:" in _executor:
+                _action_group_executor = {"lambda": _executor}
+            else:
+                _function_name = _ag["lambda_function_name"]
+                if _function_name not in _lambda_arns:
+                    _lambda_arns[_function_name], _code_changed = (
+                        self._reconcile_lambda(agent_name, _ag, verbose)
+                    )
+                    if _code_changed:
+                        _changes.append(f"Lambda function {_function_name}")
+                _action_group_executor = {"lambda": _lambda_arns[_function_name]}
+
+            _ag_kwargs = dict(
+                agentId=_agent_id,
+                agentVersion="DRAFT",
+                actionGroupExecutor=_action_group_executor,
+                actionGroupName=_ag["action_group_name"],
+                functionSchema={"functions": _ag["functions"]},
+                description=(_ag.get("description") or "")[0:199],
+            )
+            _deployed = _deployed_action_groups.pop(_ag["action_group_name"], None)
+            if _deployed is None:
+                self._bedrock_agent_client.create_agent_action_group(**_ag_kwargs)
+                _changes.append(f"new action group {_ag['action_group_name']}")
+                continue
+
+            _deployed = self._bedrock_agent_client.get_agent_action_group(
+                agentId=_agent_id,
+                agentVersion="DRAFT",
+                actionGroupId=_deployed["actionGroupId"],
+            )["agentActionGroup"]
+            if (
+                _deployed.get("actionGroupExecutor") != _action_group_executor
+                or self._normalize_functions(
+                    _deployed.get("functionSchema", {}).get("functions")
+                )
+                != self._normalize_functions(_ag["functions"])
+                or _deployed.get("description", "") != _ag_kwargs["description"]
+                or _deployed["actionGroupState"] != "ENABLED"
+            ):
+                self._bedrock_agent_client.update_agent_action_group(
+                    actionGroupId=_deployed["actionGroupId"],
+                    actionGroupState="ENABLED",
+                    **_ag_kwargs,
+                )
+                _changes.append(f"action group {_ag['action_group_name']}")
+
+        if code_interpretation:
+            if _deployed_action_groups.pop(DEFAULT_CI_ACTION_GROUP_NAME, None) is None:
+                self._bedrock_agent_client.create_agent_action_group(
+                    agentId=_agent_id,
+                    agentVersion="DRAFT",
+                    actionGroupName=DEFAULT_CI_ACTION_GROUP_NAME,
+                    parentActionGroupSignature="AMAZON.CodeInterpreter",
+                    actionGroupState="ENABLED",
+                )
+                _changes.append("code interpreter enabled")
+
+        for _ag_name, _summary in _deployed_action_groups.items():
+            self._bedrock_agent_client.delete_agent_action_group(
+                agentId=_agent_id,
+                agentVersion="DRAFT",
+                actionGroupId=_summary["actionGroupId"],
+                skipResourceInUseCheck=True,
+            )
+            _changes.append(f"removed action group {_ag_name}")
+
+        # knowledge base
+        _deployed_kbs = {
+            _kb["knowledgeBaseId"]: _kb
+            for _kb in self._bedrock_agent_client.list_agent_knowledge_bases(
+                agentId=_agent_id, agentVersion="DRAFT"
+            )["agentKnowledgeBaseSummaries"]
+        }
+        if kb_id is not None:
+            _deployed_kb = _deployed_kbs.pop(kb_id, None)
+            if _deployed_kb is None:
+                self._bedrock_agent_client.associate_agent_knowledge_base(
+                    agentId=_agent_id,
+                    agentVersion="DRAFT",
+                    description=kb_descr,
+                    knowledgeBaseId=kb_id,
+                    knowledgeBaseState="ENABLED",
+                )
+                _changes.append(f"knowledge base {kb_id} associated")
+            elif (
+                _deployed_kb.get("description") != kb_descr
+                or _deployed_kb["knowledgeBaseState"] != "ENABLED"
+            ):
+                self._bedrock_agent_client.update_agent_knowledge_base(
+                    agentId=_agent_id,
+                    agentVersion="DRAFT",
+                    description=kb_descr,
+                    knowledgeBaseId=kb_id,
+                    knowledgeBaseState="ENABLED",
+                )
+                _changes.append(f"knowledge base {kb_id}")
+        for _other_kb_id in _deployed_kbs:
+            self._bedrock_agent_client.disassociate_agent_knowledge_base(
+                agentId=_agent_id, agentVersion="DRAFT", knowledgeBaseId=_other_kb_id
+            )
+            _changes.append(f"knowledge base {_other_kb_id} disassociated")
+
+        if _changes:
+            if verbose:
+                print(f"Updating agent {agent_name}: {', '.join(_changes)}")
+            self.wait_agent_status_update(_agent_id, verbose=False)
+            self._bedrock_agent_client.prepare_agent(agentId=_agent_id)
+            self.wait_agent_status_update(_agent_id, verbose=False)
+
+            # point the latest alias at a new version of the agent
+            _alias_id = self.get_agent_latest_alias_id(_agent_id)
+            if _alias_id and _alias_id != DEFAULT_ALIAS:
+                _alias = self._bedrock_agent_client.get_agent_alias(
+                    agentId=_agent_id, agentAliasId=_alias_id
+                )["agentAlias"]
+                self._bedrock_agent_client.update_agent_alias(
+                    agentId=_agent_id,
+                    agentAliasId=_alias_id,
+                    agentAliasName=_alias["agentAliasName"],
+                )
+                self.wait_agent_alias_status_update(_agent_id, _alias_id)
+        elif verbose:
+            print(f"Agent {agent_name} is up to date")
+
+        self._bedrock_agent_client.tag_resource(
+            resourceArn=_agent_arn, tags={AGENT_SPEC_FINGERPRINT_TAG: _fingerprint}
+        )
+        return _changes
+
     def create_dynamodb(self, table_name, pk_item, sk_item):
         try:
             table = self._dynamodb_resource.create_table(
@@ -2795,92 +3738,49 @@ class AgentsForAmazonBedrock:
         except self._dynamodb_client.exceptions.ResourceInUseException:
             print(f"Error querying table: {table_name}.")
 
-    def create_lambda_file(self, func: Callable, output_dir: str = ".") -> str:
+    def create_lambda_file(
+        self,
+        func: Union[Callable, List[Callable]],
+        output_dir: str = ".",
+        file_name: str = None,
+    ) -> str:
         """
-        Creates a Lambda function file that wraps the given function with the necessary handler code.
+        Creates a Lambda function file serving the given functions through an ActionGroupDispatcher,
+        which routes each event to its function and converts the parameters to the annotated types.
+        create_lambda() packages the action_group_runtime module with the file.
 
         Args:
-            func: The function to wrap
+            func: The function to wrap, or a list of functions served by the same Lambda
             output_dir: Directory where the Lambda file should be created
+            file_name: Name of the Lambda file. Defaults to lambda_<function names>.py
 
         Returns:
             str: Path to the created Lambda file
         """
-        # Get the function's source code
-        func_source = inspect.getsource(func)
-
-        # Get the function's name
-        func_name = func.__name__
+        funcs = func if isinstance(func, list) else [func]
+        func_names = [_func.__name__ for _func in funcs]
 
+        # the names the functions commonly use in their annotations and bodies
         lambda_code = [
             "import json",
-            "import inspect",
-            "from typing import Any, Dict",
-            "",
-            "def get_named_parameter(event: Dict[str, Any], name: str) -> Any:",
-            '    """Extract a named parameter from the event object."""',
-            "    if 'parameters' in event:",
-            "        return next(item for item in event['parameters'] if item['name'] == name)['value']",
-            "    else:",
-            "        return None",
-            "",
-            "def populate_function_response(event: Dict[str, Any], response_body: Any) -> Dict[str, Any]:",
-            '    """Create the response structure expected by the agent."""',
-            "    return {",
-            "        'response': {",
-            "            'actionGroup': event['actionGroup'],",
-            "            'function': event['function'],",
-            "            'functionResponse': {",
-            "                'responseBody': {",
-            "                    'TEXT': {'body': str(response_body)}",
-            "                }",
-            "            }",
-            "        }",
-            "    }",
+            "from typing import Any, Dict, List, Optional",
             "",
-            func_source,
+            f"from {action_group_runtime.RUNTIME_MODULE} import ActionGroupDispatcher",
             "",
-            "def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:",
-            '    """',
-            "    AWS Lambda handler that wraps the main function.",
-            "    Extracts parameters from the event and formats the response.",
-            '    """',
-            '    print(f"Received event: {event}")',
-            "",
-            f"    function = event['function']",
-            f"    if function == '{func_name}':",
-            "        # Get parameters from the event",
-            "        params = {}",
-            f"        for param_name in inspect.signature({func_name}).parameters:",
-            "            param_value = get_named_parameter(event, param_name)",
-            "            if param_value is None:",
-            "                # Check session state if parameter not found",
-            "                session_state = event.get('sessionAttributes', {})",
-            "                if session_state and param_name in session_state:",
-            "                    param_value = session_state[param_name]",
-            "                else:",
-            '                    result = f"Missing required parameter: {param_name}"',
-            "                    return populate_function_response(event, result)",
-            "            params[param_name] = param_value",
-            "",
-            "        try:",
-            "            # Call the function with extracted parameters",
-            f"            result = {func_name}(**params)",
-            "            return populate_function_response(event, result)",
-            "        except Exception as e:",
-            f'            error_message = f"Error executing {func_name}: {{str(e)}}"',
-            "            print(error_message)",
-            "            return populate_function_response(event, error_message)",
-            "    else:",
-            "        result = f\"Error: Function '{function}' not recognized\"",
-            "        return populate_function_response(event, result)",
         ]
+        for _func in funcs:
+            lambda_code += [dedent(inspect.getsource(_func)), ""]
+        lambda_code += ["dispatcher = ActionGroupDispatcher()"]
+        lambda_code += [f"dispatcher.register({_name})" for _name in func_names]
+        lambda_code += ["lambda_handler = dispatcher.lambda_handler", ""]
 
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
 
         # Create the Lambda file
-        file_path = os.path.join(output_dir, f"lambda_{func_name}.py")
+        file_path = os.path.join(
+            output_dir, file_name or f"lambda_{'_'.join(func_names)}.py"
+        )
         with open(file_path, "w") as f:
             f.write("\n".join(lambda_code))
 
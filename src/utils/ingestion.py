@@ -0,0 +1,359 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module coordinates the ingestion jobs of a knowledge base data source.
+
+A data source runs a single ingestion job at a time, and every job scans the whole data source.
+An IngestionCoordinator is told about changed documents with notify(), waits until the changes stop
+for a debounce period, and then runs one job for the whole burst. Changes that arrive while a job
+runs are coalesced into the next job. Each job is polled with adaptive backoff and reported as an
+IngestionResult with its scanned/indexed/failed counters and, for the documents that were notified,
+their individual ingestion status. The changes of a job that fails to run are kept pending, and
+retried by the next notify() or flush().
+"""
+
+import datetime
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+from botocore.exceptions import ClientError
+
+from .waiters import DEFAULT_WAIT_TIMEOUT, poll_until
+
+DEFAULT_INGESTION_DEBOUNCE = 30.0  # seconds without changes before a job is started
+INGESTION_RUNNING_STATUSES = ["STARTING", "IN_PROGRESS", "STOPPING"]
+INGESTION_DONE_STATUSES = ["COMPLETE", "FAILED", "STOPPED"]
+# maximum number of documents of a GetKnowledgeBaseDocuments call
+_DOCUMENT_BATCH_SIZE = 10
+_MAX_START_ATTEMPTS = 5
+
+
+@dataclass
+class IngestionResult:
+    """Outcome of one ingestion job.
+
+    document_status maps the S3 URI of each notified document to its status after the job,
+    e.g. "INDEXED" or "FAILED".
+    """
+
+    job_id: str
+    status: str
+    documents_scanned: int = 0
+    metadata_documents_scanned: int = 0
+    new_documents_indexed: int = 0
+    modified_documents_indexed: int = 0
+    metadata_documents_modified: int = 0
+    documents_deleted: int = 0
+    documents_failed: int = 0
+    documents_skipped: int = 0
+    failure_reasons: List[str] = field(default_factory=list)
+    duration: float = None
+    changes_coalesced: int = 0
+    document_status: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_job(cls, job: Dict, duration: float = None) -> "IngestionResult":
+        _stats = job.get("statistics", {})
+        return cls(
+            job_id=job["ingestionJobId"],
+            status=job["status"],
+            documents_scanned=_stats.get("numberOfDocumentsScanned", 0),
+            metadata_documents_scanned=_stats.get(
+                "numberOfMetadataDocumentsScanned", 0
+            ),
+            new_documents_indexed=_stats.get("numberOfNewDocumentsIndexed", 0),
+            modified_documents_indexed=_stats.get(
+                "numberOfModifiedDocumentsIndexed", 0
+            ),
+            metadata_documents_modified=_stats.get(
+                "numberOfMetadataDocumentsModified", 0
+            ),
+            documents_deleted=_stats.get("numberOfDocumentsDeleted", 0),
+            documents_failed=_stats.get("numberOfDocumentsFailed", 0),
+            documents_skipped=_stats.get("numberOfDocumentsSkipped", 0),
+            failure_reasons=job.get("failureReasons", []),
+            duration=duration,
+        )
+
+    @property
+    def documents_indexed(self) -> int:
+        return self.new_documents_indexed + self.modified_documents_indexed
+
+    def summary(self) -> str:
+        _summary = (
+            f"Ingestion job {self.job_id} {self.status}: {self.documents_scanned} scanned, "
+            f"{self.new_documents_indexed} new, {self.modified_documents_indexed} modified, "
+            f"{self.documents_deleted} deleted, {self.documents_failed} failed"
+        )
+        if self.duration is not None:
+            _summary += f", took {self.duration:,.1f}s"
+        for _reason in self.failure_reasons:
+            _summary += f"\n  failure: {_reason}"
+        return _summary
+
+
+class IngestionCoordinator:
+    """Debounces and coalesces the changes of a data source into as few ingestion jobs as possible."""
+
+    def __init__(
+        self,
+        bedrock_agent_client,
+        kb_id: str,
+        ds_id: str,
+        bucket_name: str = None,
+        debounce: float = DEFAULT_INGESTION_DEBOUNCE,
+        timeout: float = DEFAULT_WAIT_TIMEOUT,
+        on_result: Callable[[IngestionResult], None] = None,
+        verbose: bool = False,
+    ):
+        """Args:
+        bedrock_agent_client: boto3 bedrock-agent client
+        kb_id (str): knowledge base id
+        ds_id (str): data source id
+        bucket_name (str, optional): S3 bucket of the data source, used to report the status of
+        the notified documents. Defaults to None (no per-document status).
+        debounce (float, optional): seconds without new changes before a job is started
+        timeout (float, optional): seconds to wait for a job to complete
+        on_result (Callable, optional): called with the IngestionResult of each job started by notify()
+        verbose (bool, optional): whether to print each job. Defaults to False.
+        """
+        self._client = bedrock_agent_client
+        self._kb_id = kb_id
+        self._ds_id = ds_id
+        self._bucket_name = bucket_name
+        self._debounce = debounce
+        self._timeout = timeout
+        self._on_result = on_result
+        self._verbose = verbose
+
+        self._lock = threading.Lock()
+        self._pending_keys = set()
+        self._pending_changes = 0
+        self._ready = False
+        self._timer = None
+        self._worker = None
+        self._idle = threading.Event()
+        self._idle.set()
+        self.last_result: IngestionResult = None
+        # error of the last job started by the coordinator, None if it completed
+        self.last_error: Exception = None
+
+    def notify(self, keys: List[str] = None) -> None:
+        """Records changed documents of the data source. The job starts once no change was
+        notified for the debounce period, or when flush() is called.
+
+        Args:
+            keys (List[str], optional): S3 keys of the changed documents, to report their status
+        """
+        with self._lock:
+            self._pending_keys.update(keys or [])
+            self._pending_changes += len(keys) if keys else 1
+            self._ready = False
+            self._idle.clear()
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self._debounce, self._on_debounce)
+            self._timer.args = (self._timer,)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self) -> IngestionResult:
+        """Starts the job for the pending changes without waiting for the debounce period,
+        and waits for all jobs to complete. Changes kept pending by a failed job are retried.
+
+        Returns:
+            IngestionResult: the result of the last job, None if no job was needed
+
+        Raises:
+            RuntimeError: if the job could not be run or did not complete; its changes stay pending
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        self._on_debounce()
+        _result = self.wait()
+        if self.last_error is not None:
+            raise RuntimeError(
+                f"Ingestion job of data source {self._ds_id} failed, "
+                f"{self._pending_changes} changes are still pending: {self.last_error}"
+            ) from self.last_error
+        return _result
+
+    def wait(self, timeout: float = None) -> IngestionResult:
+        """Waits until no change is pending and no job is running, or until the last job failed,
+        see last_error.
+
+        Returns:
+            IngestionResult: the result of the last job
+        """
+        self._idle.wait(timeout)
+        return self.last_result
+
+    def _on_debounce(self, timer: threading.Timer = None) -> None:
+        with self._lock:
+            if timer is not None and timer is not self._timer:
+                # superseded by a later notify() while waiting for the lock
+                return
+            self._timer = None
+            if self._pending_changes == 0:
+                if self._worker is None:
+                    self._idle.set()
+                return
+            self._ready = True
+            # changes kept pending by a failed job are retried without a new notify()
+            self._idle.clear()
+            if self._worker is not None:
+                # the running worker starts the next job once its own completes
+                return
+            self._worker = threading.Thread(target=self._drain, daemon=True)
+            self._worker.start()
+
+    def _drain(self) -> None:
+        while True:
+            with self._lock:
+                if not self._ready or self._pending_changes == 0:
+                    self._worker = None
+                    if self._timer is None:
+                        self._idle.set()
+                    return
+                _keys = sorted(self._pending_keys)
+                _changes = self._pending_changes
+                self._pending_keys = set()
+                self._pending_changes = 0
+                self._ready = False
+
+            _result = None
+            try:
+                _result = self.run_ingestion(
+                    description=f"{_changes} coalesced changes", keys=_keys
+                )
+                _result.changes_coalesced = _changes
+                _error = None
+                if _result.status != "COMPLETE":
+                    _error = RuntimeError(
+                        f"Ingestion job {_result.job_id} ended {_result.status}: "
+                        + "; ".join(_result.failure_reasons)
+                    )
+            except Exception as e:
+                _error = e
+            if _error is not None:
+                print(
+                    f"Error running ingestion job for data source {self._ds_id}: {_error}"
+                )
+                # keep the changes for the next notify() or flush(), which retry them
+                with self._lock:
+                    self._pending_keys.update(_keys)
+                    self._pending_changes += _changes
+                    self.last_error = _error
+            else:
+                self.last_error = None
+            if _result is None:
+                continue
+            self.last_result = _result
+            if self._on_result is not None:
+                try:
+                    self._on_result(_result)
+                except Exception as e:
+                    print(f"Error in ingestion result callback: {e}")
+
+    def running_job(self) -> Dict:
+        """Returns the summary of the ingestion job running on the data source, None if there is none."""
+        _resp = self._client.list_ingestion_jobs(
+            knowledgeBaseId=self._kb_id,
+            dataSourceId=self._ds_id,
+            filters=[
+                {
+                    "attribute": "STATUS",
+                    "operator": "EQ",
+                    "values": INGESTION_RUNNING_STATUSES,
+                }
+            ],
+            sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"},
+            maxResults=1,
+        )
+        _jobs = _resp.get("ingestionJobSummaries", [])
+        return _jobs[0] if _jobs else None
+
+    def _wait_for_job(self, job_id: str) -> Dict:
+        return poll_until(
+            lambda: self._client.get_ingestion_job(
+                knowledgeBaseId=self._kb_id,
+                dataSourceId=self._ds_id,
+                ingestionJobId=job_id,
+            )["ingestionJob"],
+            lambda job: job["status"] in INGESTION_DONE_STATUSES,
+            description=f"ingestion job {job_id}",
+            timeout=self._timeout,
+            initial_delay=2.0,
+            max_delay=30.0,
+        )
+
+    def run_ingestion(
+        self, description: str = None, keys: List[str] = None
+    ) -> IngestionResult:
+        """Runs one ingestion job and waits for it to complete. A job already running on the
+        data source is waited for first, since it may have scanned the data before the changes.
+
+        Args:
+            description (str, optional): description of the job
+            keys (List[str], optional): S3 keys of documents whose status should be reported
+
+        Returns:
+            IngestionResult: the counters of the job, and the status of the documents of keys
+        """
+        for _attempt in range(_MAX_START_ATTEMPTS):
+            _running = self.running_job()
+            if _running is not None:
+                if self._verbose:
+                    print(
+                        f"Waiting for running ingestion job {_running['ingestionJobId']}"
+                    )
+                self._wait_for_job(_running["ingestionJobId"])
+            _start_args = {"knowledgeBaseId": self._kb_id, "dataSourceId": self._ds_id}
+            if description:
+                _start_args["description"] = description
+            _time_before_job = datetime.datetime.now()
+            try:
+                _job = self._client.start_ingestion_job(**_start_args)["ingestionJob"]
+                break
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConflictException":
+                    raise
+                # another client started a job in the meantime: wait for it too
+        else:
+            raise RuntimeError(
+                f"Could not start an ingestion job on data source {self._ds_id} "
+                f"after {_MAX_START_ATTEMPTS} attempts"
+            )
+
+        if self._verbose:
+            print(f"Started ingestion job {_job['ingestionJobId']}")
+        _job = self._wait_for_job(_job["ingestionJobId"])
+        _result = IngestionResult.from_job(
+            _job, (datetime.datetime.now() - _time_before_job).total_seconds()
+        )
+        if keys and self._bucket_name is not None:
+            _result.document_status = self.document_status(keys)
+        if self._verbose:
+            print(_result.summary())
+        return _result
+
+    def document_status(self, keys: List[str]) -> Dict[str, str]:
+        """Returns the ingestion status of documents of the data source, by S3 URI."""
+        _uris = [f"s3://{self._bucket_name}/{_key}" for _key in keys]
+        _status = {}
+        for _start in range(0, len(_uris), _DOCUMENT_BATCH_SIZE):
+            _resp = self._client.get_knowledge_base_documents(
+                knowledgeBaseId=self._kb_id,
+                dataSourceId=self._ds_id,
+                documentIdentifiers=[
+                    {"dataSourceType": "S3", "s3": {"uri": _uri}}
+                    for _uri in _uris[_start : _start + _DOCUMENT_BATCH_SIZE]
+                ],
+            )
+            for _doc in _resp["documentDetails"]:
+                _status[_doc["identifier"]["s3"]["uri"]] = _doc["status"]
+        return _status
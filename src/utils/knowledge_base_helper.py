@@ -9,18 +9,39 @@ IAM roles and OpenSearch Serverless.
 """
 
 import json
-import boto3
 import time
 from botocore.exceptions import ClientError
 from opensearchpy import (
     OpenSearch,
     RequestsHttpConnection,
     AWSV4SignerAuth,
+    AuthorizationException,
+    NotFoundError,
     RequestError,
 )
 import pprint
 from retrying import retry
 import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from .aws_context import AwsContext, default_context
+from .provisioning import provision
+from .retrieval_cache import RetrievalCache
+from .retrieval_fusion import DEFAULT_RRF_K, FusedChunk, fuse_results, source_uri
+from .vector_index import EMBEDDING_MODEL_DIMENSIONS, VectorIndexProfile
+from .waiters import poll_until
+from .ingestion import (
+    DEFAULT_INGESTION_DEBOUNCE,
+    IngestionCoordinator,
+    IngestionResult,
+)
+from .s3_sync import (
+    DEFAULT_SYNC_CONCURRENCY,
+    DEFAULT_MULTIPART_THRESHOLD,
+    SyncResult,
+    sync_directory_to_bucket,
+)
 
 valid_embedding_models = [
     "cohere.embed-multilingual-v3",
@@ -29,6 +50,19 @@ valid_embedding_models = [
     "amazon.titan-embed-text-v2:0",
 ]
 pp = pprint.PrettyPrinter(indent=2)
+# lookups of retrieve_many() running at once
+DEFAULT_RETRIEVAL_CONCURRENCY = 8
+# seconds to wait for newly created policies and indexes to take effect
+DEFAULT_READINESS_TIMEOUT = 300
+_NOT_READY = object()
+# clients resolved through the AWS context on first use: attribute -> service
+_CONTEXT_CLIENTS = {
+    "iam_client": "iam",
+    "aoss_client": "opensearchserverless",
+    "s3_client": "s3",
+    "bedrock_agent_client": "bedrock-agent",
+    "bedrock_agent_runtime_client": "bedrock-agent-runtime",
+}
 
 
 def interactive_sleep(seconds: int):
@@ -53,43 +87,62 @@ class KnowledgeBasesForAmazonBedrock:
         - Deletion of all resources created
     """
 
-    def __init__(self, suffix=None):
+    def __init__(
+        self,
+        suffix=None,
+        retrieval_cache: RetrievalCache = None,
+        context: AwsContext = None,
+    ):
         """
         Class initializer
+        Args:
+            retrieval_cache: cache of the results of retrieve(), invalidated by synchronize_data().
+            Defaults to None (no cache)
+            context: session and clients to use, shared with the other helpers. Defaults to the
+            default context
         """
-        boto3_session = boto3.session.Session()
-        self.region_name = boto3_session.region_name
-        self.iam_client = boto3_session.client("iam", region_name=self.region_name)
-        self.account_number = (
-            boto3.client("sts", region_name=self.region_name)
-            .get_caller_identity()
-            .get("Account")
-        )
+        self._context = context if context is not None else default_context()
+        self.region_name = self._context.region
         self.suffix = random.randrange(200, 900)
-        self.identity = boto3.client(
-            "sts", region_name=self.region_name
-        ).get_caller_identity()["Arn"]
-        self.aoss_client = boto3_session.client(
-            "opensearchserverless", region_name=self.region_name
-        )
-        self.s3_client = boto3.client("s3", region_name=self.region_name)
-        self.bedrock_agent_client = boto3.client(
-            "bedrock-agent", region_name=self.region_name
-        )
-        self.bedrock_agent_client = boto3.client(
-            "bedrock-agent", region_name=self.region_name
-        )
-        credentials = boto3.Session().get_credentials()
-        self.awsauth = AWSV4SignerAuth(credentials, self.region_name, "aoss")
+        # backends answering retrieve() instead of Amazon Bedrock, by knowledge base id (None for all)
+        self._retrieval_backends = {}
+        self.retrieval_cache = retrieval_cache
         self.oss_client = None
         self.data_bucket_name = None
 
+    def __getattr__(self, name: str):
+        """Resolves the clients, account number, caller identity and OpenSearch request signer
+        through the AWS context on first use, and keeps them as attributes. A helper answering
+        retrieve() from a local backend needs no AWS credentials."""
+        _context = self.__dict__.get("_context")
+        if _context is None:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'"
+            )
+        if name in _CONTEXT_CLIENTS:
+            _value = _context.client(_CONTEXT_CLIENTS[name])
+        elif name == "account_number":
+            _value = _context.account_id
+        elif name == "identity":
+            _value = _context.caller_identity["Arn"]
+        elif name == "awsauth":
+            _value = AWSV4SignerAuth(
+                _context.session.get_credentials(), self.region_name, "aoss"
+            )
+        else:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'"
+            )
+        setattr(self, name, _value)
+        return _value
+
     def create_or_retrieve_knowledge_base(
         self,
         kb_name: str,
         kb_description: str = None,
         data_bucket_name: str = None,
         embedding_model: str = "amazon.titan-embed-text-v2:0",
+        index_profile: VectorIndexProfile = None,
     ):
         """
         Function used to create a new Knowledge Base or retrieve an existent one
@@ -99,6 +152,8 @@ class KnowledgeBasesForAmazonBedrock:
             kb_description: Knowledge Base Description
             data_bucket_name: Name of s3 Bucket containing Knowledge Base Data
             embedding_model: Name of Embedding model to be used on Knowledge Base creation
+            index_profile: settings of the vector index. Defaults to
+            VectorIndexProfile.for_embedding_model(embedding_model)
 
         Returns:
             kb_id: str - Knowledge base id
@@ -143,6 +198,13 @@ class KnowledgeBasesForAmazonBedrock:
                     f"Invalid embedding model. Your embedding model should be one of {valid_embeddings_str}"
                 )
             # self.embedding_model = embedding_model
+            if index_profile is None:
+                index_profile = VectorIndexProfile.for_embedding_model(embedding_model)
+            else:
+                # fails early if the index does not fit the embeddings
+                VectorIndexProfile.for_embedding_model(
+                    embedding_model, index_profile.dimension
+                )
             encryption_policy_name = f"{kb_name}-sp-{self.suffix}"
             network_policy_name = f"{kb_name}-np-{self.suffix}"
             access_policy_name = f"{kb_name}-ap-{self.suffix}"
@@ -156,77 +218,68 @@ class KnowledgeBasesForAmazonBedrock:
             oss_policy_name = f"AmazonBedrockOSSPolicyForKnowledgeBase_{self.suffix}"
             vector_store_name = f"{kb_name}-{self.suffix}"
             index_name = f"{kb_name}-index-{self.suffix}"
-            print(
-                "========================================================================================"
-            )
-            print(
-                f"Step 1 - Creating or retrieving {data_bucket_name} S3 bucket for Knowledge Base documents"
-            )
-            self.create_s3_bucket(data_bucket_name)
-            print(
-                "========================================================================================"
-            )
-            print(
-                f"Step 2 - Creating Knowledge Base Execution Role ({kb_execution_role_name}) and Policies"
-            )
-            bedrock_kb_execution_role = self.create_bedrock_kb_execution_role(
-                embedding_model,
-                data_bucket_name,
-                fm_policy_name,
-                s3_policy_name,
-                kb_execution_role_name,
-            )
-            print(
-                "========================================================================================"
-            )
-            print(f"Step 3 - Creating OSS encryption, network and data access policies")
-            encryption_policy, network_policy, access_policy = (
-                self.create_policies_in_oss(
-                    encryption_policy_name,
-                    vector_store_name,
-                    network_policy_name,
-                    bedrock_kb_execution_role,
-                    access_policy_name,
-                )
-            )
-            print(
-                "========================================================================================"
-            )
-            print(
-                f"Step 4 - Creating OSS Collection (this step takes a couple of minutes to complete)"
-            )
-            host, collection, collection_id, collection_arn = self.create_oss(
-                vector_store_name, oss_policy_name, bedrock_kb_execution_role
-            )
-            # Build the OpenSearch client
-            self.oss_client = OpenSearch(
-                hosts=[{"host": host, "port": 443}],
-                http_auth=self.awsauth,
-                use_ssl=True,
-                verify_certs=True,
-                connection_class=RequestsHttpConnection,
-                timeout=300,
-            )
 
+            # each step starts as soon as the steps it depends on are done
+            builders = {
+                "s3_bucket": lambda deps: self.create_s3_bucket(data_bucket_name),
+                "execution_role": lambda deps: self.create_bedrock_kb_execution_role(
+                    embedding_model,
+                    data_bucket_name,
+                    fm_policy_name,
+                    s3_policy_name,
+                    kb_execution_role_name,
+                ),
+                "encryption_policy": lambda deps: self._create_oss_encryption_policy(
+                    encryption_policy_name, vector_store_name
+                ),
+                "network_policy": lambda deps: self._create_oss_network_policy(
+                    network_policy_name, vector_store_name
+                ),
+                "access_policy": lambda deps: self._create_oss_access_policy(
+                    access_policy_name, vector_store_name, deps["execution_role"]
+                ),
+                "collection": lambda deps: self._create_collection(vector_store_name),
+                "oss_role_policy": lambda deps: self.create_oss_policy_attach_bedrock_execution_role(
+                    deps["collection"]["id"],
+                    oss_policy_name,
+                    deps["execution_role"],
+                ),
+                "vector_index": lambda deps: self.create_vector_index(
+                    index_name, collection=deps["collection"], profile=index_profile
+                ),
+                "knowledge_base": lambda deps: self._create_knowledge_base_when_ready(
+                    deps["collection"]["arn"],
+                    index_name,
+                    data_bucket_name,
+                    embedding_model,
+                    kb_name,
+                    kb_description,
+                    deps["execution_role"],
+                    index_profile.dimension,
+                ),
+            }
+            depends_on = {
+                "access_policy": ["execution_role"],
+                "collection": ["encryption_policy", "network_policy"],
+                "oss_role_policy": ["collection", "execution_role"],
+                "vector_index": ["collection", "access_policy"],
+                "knowledge_base": [
+                    "s3_bucket",
+                    "execution_role",
+                    "collection",
+                    "vector_index",
+                    "oss_role_policy",
+                ],
+            }
             print(
                 "========================================================================================"
             )
-            print(f"Step 5 - Creating OSS Vector Index")
-            self.create_vector_index(index_name)
             print(
-                "========================================================================================"
+                f"Provisioning S3 bucket {data_bucket_name}, execution role {kb_execution_role_name}, "
+                f"OSS collection {vector_store_name} and index {index_name} for Knowledge Base {kb_name}"
             )
-            print(f"Step 6 - Creating Knowledge Base")
-            knowledge_base, data_source = self.create_knowledge_base(
-                collection_arn,
-                index_name,
-                data_bucket_name,
-                embedding_model,
-                kb_name,
-                kb_description,
-                bedrock_kb_execution_role,
-            )
-            interactive_sleep(60)
+            built = provision(builders, depends_on, verbose=True)
+            knowledge_base, data_source = built["knowledge_base"]
             print(
                 "========================================================================================"
             )
@@ -257,6 +310,46 @@ class KnowledgeBasesForAmazonBedrock:
     def get_data_bucket_name(self):
         return self.data_bucket_name
 
+    def sync_directory_to_bucket(
+        self,
+        local_dir: str,
+        bucket_name: str = None,
+        prefix: str = "",
+        delete_removed: bool = False,
+        max_workers: int = DEFAULT_SYNC_CONCURRENCY,
+        multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD,
+        verbose: bool = False,
+    ) -> SyncResult:
+        """
+        Upload the new and changed files of a local directory to the knowledge base data bucket.
+        Unchanged files are detected by content hash, using a manifest kept in local_dir.
+        Args:
+            local_dir: local directory to upload, recursively
+            bucket_name: destination bucket. Defaults to the data bucket of this knowledge base
+            prefix: S3 key prefix of the files, e.g. "data/"
+            delete_removed: whether to delete objects under prefix that no longer exist locally
+            max_workers: number of files uploaded concurrently
+            multipart_threshold: size in bytes from which files use multipart uploads
+            verbose: whether to print each upload
+        Returns:
+            SyncResult, whose changed property tells if an ingestion job is needed
+        """
+        if bucket_name is None:
+            bucket_name = self.data_bucket_name
+        _s3_client = self.s3_client
+        if max_workers > self._context.config.max_pool_connections:
+            _s3_client = self._context.client("s3", max_pool_connections=max_workers)
+        return sync_directory_to_bucket(
+            _s3_client,
+            local_dir,
+            bucket_name,
+            prefix=prefix,
+            delete_removed=delete_removed,
+            max_workers=max_workers,
+            multipart_threshold=multipart_threshold,
+            verbose=verbose,
+        )
+
     def _get_knowledge_base_s3_bucket(self, knowledge_base_id, data_source_id):
         """Get the s3 bucket associated with a knowledge base, if there is one"""
         try:
@@ -468,6 +561,21 @@ class KnowledgeBasesForAmazonBedrock:
         Returns:
             encryption_policy, network_policy, access_policy
         """
+        encryption_policy = self._create_oss_encryption_policy(
+            encryption_policy_name, vector_store_name
+        )
+        network_policy = self._create_oss_network_policy(
+            network_policy_name, vector_store_name
+        )
+        access_policy = self._create_oss_access_policy(
+            access_policy_name, vector_store_name, bedrock_kb_execution_role
+        )
+        return encryption_policy, network_policy, access_policy
+
+    def _create_oss_encryption_policy(
+        self, encryption_policy_name: str, vector_store_name: str
+    ):
+        """Create the OpenSearch Serverless encryption policy of the collection, or retrieve it"""
         try:
             encryption_policy = self.aoss_client.create_security_policy(
                 name=encryption_policy_name,
@@ -489,7 +597,12 @@ class KnowledgeBasesForAmazonBedrock:
             encryption_policy = self.aoss_client.get_security_policy(
                 name=encryption_policy_name, type="encryption"
             )
+        return encryption_policy
 
+    def _create_oss_network_policy(
+        self, network_policy_name: str, vector_store_name: str
+    ):
+        """Create the OpenSearch Serverless network policy of the collection, or retrieve it"""
         try:
             network_policy = self.aoss_client.create_security_policy(
                 name=network_policy_name,
@@ -513,7 +626,15 @@ class KnowledgeBasesForAmazonBedrock:
             network_policy = self.aoss_client.get_security_policy(
                 name=network_policy_name, type="network"
             )
+        return network_policy
 
+    def _create_oss_access_policy(
+        self,
+        access_policy_name: str,
+        vector_store_name: str,
+        bedrock_kb_execution_role: str,
+    ):
+        """Create the OpenSearch Serverless data access policy of the collection, or retrieve it"""
         try:
             access_policy = self.aoss_client.create_access_policy(
                 name=access_policy_name,
@@ -559,7 +680,7 @@ class KnowledgeBasesForAmazonBedrock:
             access_policy = self.aoss_client.get_access_policy(
                 name=access_policy_name, type="data"
             )
-        return encryption_policy, network_policy, access_policy
+        return access_policy
 
     def create_oss(
         self,
@@ -574,90 +695,133 @@ class KnowledgeBasesForAmazonBedrock:
             oss_policy_name: name of the opensearch serverless access policy
             bedrock_kb_execution_role: name of the knowledge base execution role
         """
-        try:
-            collection = self.aoss_client.create_collection(
-                name=vector_store_name, type="VECTORSEARCH"
-            )
-            collection_id = collection["createCollectionDetail"]["id"]
-            collection_arn = collection["createCollectionDetail"]["arn"]
-        except self.aoss_client.exceptions.ConflictException:
-            collection = self.aoss_client.batch_get_collection(
-                names=[vector_store_name]
-            )["collectionDetails"][0]
-            pp.pprint(collection)
-            collection_id = collection["id"]
-            collection_arn = collection["arn"]
-        pp.pprint(collection)
-
-        # Get the OpenSearch serverless collection URL
-        host = collection_id + "." + self.region_name + ".aoss.amazonaws.com"
-        print(host)
-        # wait for collection creation
-        # This can take couple of minutes to finish
-        response = self.aoss_client.batch_get_collection(names=[vector_store_name])
-        # Periodically check collection status
-        while (response["collectionDetails"][0]["status"]) == "CREATING":
-            print("Creating collection...")
-            interactive_sleep(30)
-            response = self.aoss_client.batch_get_collection(names=[vector_store_name])
-        print("\nCollection successfully created:")
-        pp.pprint(response["collectionDetails"])
+        collection = self._create_collection(vector_store_name)
+        collection_id = collection["id"]
+        collection_arn = collection["arn"]
+        host = self._collection_host(collection)
         # create opensearch serverless access policy and attach it to Bedrock execution role
         try:
-            created = self.create_oss_policy_attach_bedrock_execution_role(
+            self.create_oss_policy_attach_bedrock_execution_role(
                 collection_id, oss_policy_name, bedrock_kb_execution_role
             )
-            if created:
-                # It can take up to a minute for data access rules to be enforced
-                print(
-                    "Sleeping for a minute to ensure data access rules have been enforced"
-                )
-                interactive_sleep(60)
+            # data access rules can take up to a minute to be enforced:
+            # create_vector_index() waits until they are
             return host, collection, collection_id, collection_arn
         except Exception as e:
             print("Policy already exists")
             pp.pprint(e)
 
-    def create_vector_index(self, index_name: str):
+    def _create_collection(self, vector_store_name: str):
+        """
+        Create OpenSearch Serverless Collection, or retrieve it, and wait until it is active
+        Args:
+            vector_store_name: name of the vector store
+        Returns:
+            collection details
+        """
+        try:
+            self.aoss_client.create_collection(
+                name=vector_store_name, type="VECTORSEARCH"
+            )
+        except self.aoss_client.exceptions.ConflictException:
+            print(f"Collection {vector_store_name} already exists, retrieving it!")
+        # collection creation can take a couple of minutes
+        collection = poll_until(
+            lambda: self.aoss_client.batch_get_collection(names=[vector_store_name])[
+                "collectionDetails"
+            ][0],
+            lambda collection: collection["status"] != "CREATING",
+            description=f"collection {vector_store_name}",
+            timeout=DEFAULT_READINESS_TIMEOUT * 2,
+            initial_delay=5.0,
+            max_delay=20.0,
+        )
+        if collection["status"] != "ACTIVE":
+            raise RuntimeError(
+                f"Collection {vector_store_name} is {collection['status']}"
+            )
+        print("\nCollection successfully created:")
+        pp.pprint(collection)
+        return collection
+
+    def _collection_host(self, collection) -> str:
+        """Get the OpenSearch serverless collection URL, and build the OpenSearch client for it"""
+        host = collection["id"] + "." + self.region_name + ".aoss.amazonaws.com"
+        self.oss_client = OpenSearch(
+            hosts=[{"host": host, "port": 443}],
+            http_auth=self.awsauth,
+            use_ssl=True,
+            verify_certs=True,
+            connection_class=RequestsHttpConnection,
+            pool_maxsize=self._context.config.max_pool_connections,
+            timeout=300,
+        )
+        return host
+
+    @staticmethod
+    def _until_ready(action, is_not_ready, description: str):
         """
-        Create OpenSearch Serverless vector index. If existent, ignore
+        Retry an action with backoff while it fails because a resource it needs is not ready yet,
+        e.g. while new access policies are not enforced
+        Args:
+            action: function to call
+            is_not_ready: returns True for the exceptions meaning "not ready yet"
+            description: what is being waited on, used in error messages
+        Returns:
+            the value returned by action
+        """
+
+        def _attempt():
+            try:
+                return action()
+            except Exception as e:
+                if is_not_ready(e):
+                    return _NOT_READY
+                raise
+
+        return poll_until(
+            _attempt,
+            lambda result: result is not _NOT_READY,
+            description=description,
+            timeout=DEFAULT_READINESS_TIMEOUT,
+            initial_delay=2.0,
+            max_delay=15.0,
+        )
+
+    def create_vector_index(
+        self,
+        index_name: str,
+        collection: dict = None,
+        profile: VectorIndexProfile = None,
+    ):
+        """
+        Create OpenSearch Serverless vector index. If existent, ignore.
+        Waits until the data access policy lets this identity create the index, and until the
+        index can be read.
         Args:
             index_name: name of the vector index
+            collection: collection details, to build the OpenSearch client for it. Defaults to
+            the client of the last collection created or retrieved
+            profile: dimension, HNSW parameters, space type, quantization, shards and replicas
+            of the index. Defaults to VectorIndexProfile(), a 1024 dimensions faiss HNSW index with l2
         """
-        body_json = {
-            "settings": {
-                "index.knn": "true",
-                "number_of_shards": 1,
-                "knn.algo_param.ef_search": 512,
-                "number_of_replicas": 0,
-            },
-            "mappings": {
-                "properties": {
-                    "vector": {
-                        "type": "knn_vector",
-                        "dimension": 1024,
-                        "method": {
-                            "name": "hnsw",
-                            "engine": "faiss",
-                            "space_type": "l2",
-                        },
-                    },
-                    "text": {"type": "text"},
-                    "text-metadata": {"type": "text"},
-                }
-            },
-        }
+        if collection is not None:
+            self._collection_host(collection)
+        if profile is None:
+            profile = VectorIndexProfile()
+        body_json = profile.index_body()
 
-        # Create index
+        # Create index, once the data access rules are enforced
         try:
-            response = self.oss_client.indices.create(
-                index=index_name, body=json.dumps(body_json)
+            response = self._until_ready(
+                lambda: self.oss_client.indices.create(
+                    index=index_name, body=json.dumps(body_json)
+                ),
+                lambda e: isinstance(e, AuthorizationException),
+                f"data access to create index {index_name}",
             )
             print("\nCreating index:")
             pp.pprint(response)
-
-            # index creation can take up to a minute
-            interactive_sleep(60)
         except RequestError as e:
             # you can delete the index if its already exists
             # oss_client.indices.delete(index=index_name)
@@ -665,6 +829,49 @@ class KnowledgeBasesForAmazonBedrock:
                 f"Error while trying to create the index, with error {e.error}\nyou may unmark the delete above to "
                 f"delete, and recreate the index"
             )
+        # index creation can take up to a minute to be visible
+        self._until_ready(
+            lambda: self.oss_client.indices.get(index=index_name),
+            lambda e: isinstance(e, (NotFoundError, AuthorizationException)),
+            f"index {index_name}",
+        )
+
+    def _create_knowledge_base_when_ready(self, *args):
+        """
+        Create Knowledge Base and its Data Source, retrying while the execution role cannot
+        be assumed yet or cannot access the index yet, and wait until the knowledge base is active
+        Args:
+            same as create_knowledge_base
+        Returns:
+            knowledge base object,
+            data source object
+        """
+
+        def _is_not_ready(e):
+            if not isinstance(e, ClientError):
+                return False
+            if e.response["Error"]["Code"] == "AccessDeniedException":
+                return True
+            message = e.response["Error"].get("Message", "").lower()
+            return e.response["Error"]["Code"] == "ValidationException" and any(
+                hint in message for hint in ["403", "assume", "security_exception"]
+            )
+
+        kb, ds = self._until_ready(
+            lambda: self.create_knowledge_base(*args),
+            _is_not_ready,
+            "knowledge base execution role permissions",
+        )
+        kb_status = poll_until(
+            lambda: self.bedrock_agent_client.get_knowledge_base(
+                knowledgeBaseId=kb["knowledgeBaseId"]
+            )["knowledgeBase"]["status"],
+            lambda status: status not in ["CREATING", "UPDATING"],
+            description=f"knowledge base {kb['knowledgeBaseId']}",
+        )
+        if kb_status != "ACTIVE":
+            raise RuntimeError(f"Knowledge base {kb['knowledgeBaseId']} is {kb_status}")
+        return kb, ds
 
     @retry(wait_random_min=1000, wait_random_max=2000, stop_max_attempt_number=7)
     def create_knowledge_base(
@@ -676,6 +883,7 @@ class KnowledgeBasesForAmazonBedrock:
         kb_name: str,
         kb_description: str,
         bedrock_kb_execution_role: str,
+        embedding_dimensions: int = None,
     ):
         """
         Create Knowledge Base and its Data Source. If existent, retrieve
@@ -687,6 +895,8 @@ class KnowledgeBasesForAmazonBedrock:
             kb_name: knowledge base name
             kb_description: knowledge base description
             bedrock_kb_execution_role: knowledge base execution role
+            embedding_dimensions: dimension of the embeddings, for models supporting several.
+            Defaults to the default dimension of the model
 
         Returns:
             knowledge base object,
@@ -721,13 +931,23 @@ class KnowledgeBasesForAmazonBedrock:
         embedding_model_arn = (
             f"arn:aws:bedrock:{self.region_name}::foundation-model/{embedding_model}"
         )
+        vector_kb_configuration = {"embeddingModelArn": embedding_model_arn}
+        if (
+            embedding_dimensions is not None
+            and embedding_dimensions
+            != EMBEDDING_MODEL_DIMENSIONS.get(embedding_model, [None])[0]
+        ):
+            # only models supporting several dimensions accept this configuration
+            vector_kb_configuration["embeddingModelConfiguration"] = {
+                "bedrockEmbeddingModelConfiguration": {
+                    "dimensions": embedding_dimensions
+                }
+            }
         print(
             str(
                 {
                     "type": "VECTOR",
-                    "vectorKnowledgeBaseConfiguration": {
-                        "embeddingModelArn": embedding_model_arn
-                    },
+                    "vectorKnowledgeBaseConfiguration": vector_kb_configuration,
                 }
             )
         )
@@ -738,9 +958,7 @@ class KnowledgeBasesForAmazonBedrock:
                 roleArn=bedrock_kb_execution_role["Role"]["Arn"],
                 knowledgeBaseConfiguration={
                     "type": "VECTOR",
-                    "vectorKnowledgeBaseConfiguration": {
-                        "embeddingModelArn": embedding_model_arn
-                    },
+                    "vectorKnowledgeBaseConfiguration": vector_kb_configuration,
                 },
                 storageConfiguration={
                     "type": "OPENSEARCH_SERVERLESS",
@@ -789,40 +1007,238 @@ class KnowledgeBasesForAmazonBedrock:
             pp.pprint(ds)
         return kb, ds
 
-    def synchronize_data(self, kb_id, ds_id):
+    def synchronize_data(self, kb_id, ds_id) -> IngestionResult:
         """
         Start an ingestion job to synchronize data from an S3 bucket to the Knowledge Base
-        and waits for the job to be completed
+        and waits for the job to be completed. A job already running on the data source is
+        waited for first.
         Args:
             kb_id: knowledge base id
             ds_id: data source id
+        Returns:
+            IngestionResult with the scanned, indexed and failed document counters of the job
         """
         # ensure that the kb is available
-        i_status = ["CREATING", "DELETING", "UPDATING"]
-        while (
-            self.bedrock_agent_client.get_knowledge_base(knowledgeBaseId=kb_id)[
+        poll_until(
+            lambda: self.bedrock_agent_client.get_knowledge_base(knowledgeBaseId=kb_id)[
                 "knowledgeBase"
-            ]["status"]
-            in i_status
-        ):
-            time.sleep(10)
-        # Start an ingestion job
-        start_job_response = self.bedrock_agent_client.start_ingestion_job(
-            knowledgeBaseId=kb_id, dataSourceId=ds_id
+            ]["status"],
+            lambda status: status not in ["CREATING", "DELETING", "UPDATING"],
+            description=f"knowledge base {kb_id}",
         )
-        job = start_job_response["ingestionJob"]
-        pp.pprint(job)
-        # Get job
-        while job["status"] != "COMPLETE" and job["status"] != "FAILED":
-            get_job_response = self.bedrock_agent_client.get_ingestion_job(
+        result = IngestionCoordinator(
+            self.bedrock_agent_client, kb_id, ds_id
+        ).run_ingestion()
+        self._invalidate_retrieval_cache(kb_id)
+        print(result.summary())
+        return result
+
+    def set_retrieval_cache(self, retrieval_cache: RetrievalCache):
+        """
+        Cache the results of retrieve(), or stop caching them
+        Args:
+            retrieval_cache: RetrievalCache, or None to disable caching
+        """
+        self.retrieval_cache = retrieval_cache
+
+    def _invalidate_retrieval_cache(self, kb_id):
+        if self.retrieval_cache is not None:
+            self.retrieval_cache.invalidate(kb_id)
+
+    def ingestion_coordinator(
+        self,
+        kb_id,
+        ds_id,
+        debounce: float = DEFAULT_INGESTION_DEBOUNCE,
+        on_result=None,
+        verbose: bool = False,
+    ) -> IngestionCoordinator:
+        """
+        Get a coordinator that turns bursts of document changes into single ingestion jobs.
+        Call its notify() with the changed S3 keys, and flush() to ingest without waiting.
+        Args:
+            kb_id: knowledge base id
+            ds_id: data source id
+            debounce: seconds without new changes before an ingestion job is started
+            on_result: called with the IngestionResult of each job, after the retrieval cache
+            of the knowledge base is invalidated
+            verbose: whether to print each job
+        """
+        bucket_name = self._get_knowledge_base_s3_bucket(kb_id, ds_id)
+        if bucket_name == "Data source is not an S3 bucket":
+            bucket_name = None
+
+        def _on_result(result: IngestionResult):
+            self._invalidate_retrieval_cache(kb_id)
+            if on_result is not None:
+                on_result(result)
+
+        return IngestionCoordinator(
+            self.bedrock_agent_client,
+            kb_id,
+            ds_id,
+            bucket_name=bucket_name,
+            debounce=debounce,
+            on_result=_on_result,
+            verbose=verbose,
+        )
+
+    def set_retrieval_backend(self, backend, kb_id: str = None):
+        """
+        Answer retrieve() with another backend than Amazon Bedrock, e.g. a LocalVectorStore for
+        offline tests and benchmarks
+        Args:
+            backend: object with the retrieve() method of the bedrock-agent-runtime client,
+            or None to use Amazon Bedrock again
+            kb_id: knowledge base answered by the backend. Defaults to all knowledge bases
+        """
+        if backend is None:
+            self._retrieval_backends.pop(kb_id, None)
+        else:
+            self._retrieval_backends[kb_id] = backend
+
+    def _retrieval_backend(self, kb_id: str):
+        backend = self._retrieval_backends.get(kb_id)
+        if backend is None:
+            backend = self._retrieval_backends.get(None)
+        if backend is None:
+            backend = self.bedrock_agent_runtime_client
+        return backend
+
+    def retrieve(
+        self,
+        kb_id: str,
+        query: str,
+        number_of_results: int = 5,
+        retrieval_filter: dict = None,
+        search_type: str = None,
+        use_cache: bool = True,
+    ):
+        """
+        Retrieve the chunks of a knowledge base most relevant to a query
+        Args:
+            kb_id: knowledge base id
+            query: query text
+            number_of_results: maximum number of chunks returned
+            retrieval_filter: metadata filter, e.g. {"equals": {"key": "access_level", "value": "Manager"}}
+            search_type: HYBRID or SEMANTIC. Defaults to the choice of Amazon Bedrock
+            use_cache: whether to use the retrieval cache, if one is set
+        Returns:
+            list of retrieval results, best first, each with its content, location, score and metadata
+        """
+        vector_search_configuration = {"numberOfResults": number_of_results}
+        if retrieval_filter:
+            vector_search_configuration["filter"] = retrieval_filter
+        if search_type:
+            vector_search_configuration["overrideSearchType"] = search_type
+        retrieval_configuration = {
+            "vectorSearchConfiguration": vector_search_configuration
+        }
+
+        def _retrieve():
+            return self._retrieval_backend(kb_id).retrieve(
                 knowledgeBaseId=kb_id,
-                dataSourceId=ds_id,
-                ingestionJobId=job["ingestionJobId"],
-            )
-            job = get_job_response["ingestionJob"]
-            interactive_sleep(5)
-        pp.pprint(job)
-        # interactive_sleep(40)
+                retrievalQuery={"text": query},
+                retrievalConfiguration=retrieval_configuration,
+            )["retrievalResults"]
+
+        if not use_cache or self.retrieval_cache is None:
+            return _retrieve()
+        return self.retrieval_cache.get_or_retrieve(
+            kb_id, query, retrieval_configuration, _retrieve
+        )
+
+    def retrieve_many(
+        self,
+        queries,
+        kb_ids,
+        number_of_results: int = 5,
+        retrieval_filter: dict = None,
+        search_type: str = None,
+        max_results: int = None,
+        max_chunks_per_source: int = None,
+        rrf_k: float = DEFAULT_RRF_K,
+        max_workers: int = DEFAULT_RETRIEVAL_CONCURRENCY,
+    ) -> List[FusedChunk]:
+        """
+        Run several queries against one or more knowledge bases concurrently, and fuse the results
+        into a single ranking with reciprocal rank fusion. A chunk returned by several lookups is
+        kept once
+        Args:
+            queries: query text, or list of query texts
+            kb_ids: knowledge base id, or list of knowledge base ids
+            number_of_results: chunks retrieved per query and knowledge base
+            retrieval_filter: metadata filter applied to every lookup
+            search_type: HYBRID or SEMANTIC. Defaults to the choice of Amazon Bedrock
+            max_results: number of chunks returned. Defaults to all the distinct chunks
+            max_chunks_per_source: chunks kept per source document. Defaults to no limit
+            rrf_k: reciprocal rank fusion constant
+            max_workers: lookups running at once
+        Returns:
+            list of FusedChunk, best first, with their text, source URI, fused score and the
+            knowledge bases and queries that returned them
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        if isinstance(kb_ids, str):
+            kb_ids = [kb_ids]
+        lookups = [(kb_id, query) for query in queries for kb_id in kb_ids]
+        ranked_results = []
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    self.retrieve,
+                    kb_id,
+                    query,
+                    number_of_results,
+                    retrieval_filter,
+                    search_type,
+                )
+                for kb_id, query in lookups
+            ]
+            for (kb_id, query), future in zip(lookups, futures):
+                try:
+                    ranked_results.append((kb_id, query, future.result()))
+                except Exception as e:
+                    # the other lookups still give results
+                    print(
+                        f"Error retrieving '{query}' from knowledge base {kb_id}: {e}"
+                    )
+                    errors.append(e)
+        if errors and len(errors) == len(lookups):
+            raise errors[0]
+        return fuse_results(
+            ranked_results,
+            rrf_k=rrf_k,
+            max_results=max_results,
+            max_chunks_per_source=max_chunks_per_source,
+        )
+
+    def retrieve_context(
+        self,
+        kb_id: str,
+        query: str,
+        number_of_results: int = 5,
+        retrieval_filter: dict = None,
+        search_type: str = None,
+    ) -> str:
+        """
+        Retrieve the chunks most relevant to a query as text to inject into a prompt, e.g. in the
+        input text or the prompt session attributes of an agent that does not need to look it up
+        Args:
+            same as retrieve
+        Returns:
+            the text of each chunk, followed by its source
+        """
+        context = []
+        for result in self.retrieve(
+            kb_id, query, number_of_results, retrieval_filter, search_type
+        ):
+            source = source_uri(result)
+            text = result["content"]["text"]
+            context.append(f"{text}\n(source: {source})" if source else text)
+        return "\n\n".join(context)
 
     def get_kb(self, kb_id):
         """
@@ -0,0 +1,281 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module builds and deploys the code of the AWS Lambda functions that implement agent action groups.
+
+Packages are zipped deterministically: files are added in sorted order with a fixed timestamp and
+permissions, so the same sources always give the same bytes, and the CodeSha256 of a deployed
+function tells whether its code changed. deploy_function_code() skips the upload when it did not.
+
+Third-party dependencies (e.g. requests, pandas) go to a Lambda layer, built with pip for the Lambda
+platform and named after the hash of the requirements. publish_dependency_layer() reuses the layer
+when it already exists, so a redeploy with unchanged requirements neither runs pip nor uploads
+anything, and functions sharing their requirements share the layer.
+"""
+
+import base64
+import fnmatch
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, List, Union
+
+# fixed, so unchanged code zips to the same bytes
+LAMBDA_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+DEFAULT_LAYER_RUNTIME = "python3.12"
+DEFAULT_LAYER_PLATFORM = "manylinux2014_x86_64"
+DEFAULT_PACKAGE_EXCLUDE = ["__pycache__", "*.pyc", ".DS_Store", ".git", "*.dist-info"]
+LAYER_NAME_PREFIX = "agent-deps-"
+# layer packages larger than this must be uploaded through S3
+MAX_DIRECT_UPLOAD_BYTES = 50 * 1024 * 1024
+_LAYER_HASH_DESCRIPTION_PREFIX = "requirements sha256 "
+
+
+@dataclass
+class LambdaPackage:
+    """A deterministic Lambda deployment package."""
+
+    zip_content: bytes
+    files: List[str]
+
+    @property
+    def code_sha256(self) -> str:
+        return code_sha256(self.zip_content)
+
+    @property
+    def size(self) -> int:
+        return len(self.zip_content)
+
+
+def code_sha256(zip_content: bytes) -> str:
+    """Returns the hash of a Lambda deployment package, in the format of the CodeSha256
+    returned by the Lambda API."""
+    return base64.b64encode(hashlib.sha256(zip_content).digest()).decode("utf-8")
+
+
+def _excluded(rel_path: str, exclude: List[str]) -> bool:
+    return any(
+        fnmatch.fnmatch(_part, _pattern)
+        for _part in rel_path.split("/")
+        for _pattern in exclude
+    )
+
+
+def _package_files(paths: List[str], base_dir: str, exclude: List[str]) -> List[tuple]:
+    _files = {}
+    for _path in paths:
+        if os.path.isdir(_path):
+            for _root, _dirs, _names in os.walk(_path):
+                for _name in _names:
+                    _file = os.path.join(_root, _name)
+                    _arcname = os.path.relpath(_file, base_dir).replace(os.sep, "/")
+                    if not _excluded(_arcname, exclude):
+                        _files[_arcname] = _file
+        else:
+            _arcname = os.path.relpath(_path, base_dir).replace(os.sep, "/")
+            _files[_arcname] = _path
+    for _arcname in _files:
+        if _arcname.startswith("../"):
+            raise ValueError(f"{_files[_arcname]} is outside of {base_dir}")
+    return sorted(_files.items())
+
+
+def build_package(
+    paths: Union[str, List[str]],
+    base_dir: str = None,
+    exclude: List[str] = None,
+    compress: bool = True,
+    extra_files: Dict[str, str] = None,
+) -> LambdaPackage:
+    """Zips files and directories deterministically into a Lambda deployment package.
+
+    Args:
+        paths (Union[str, List[str]]): files and directories to package, e.g. the handler file and
+        the modules it imports
+        base_dir (str, optional): directory the paths in the zip are relative to. Defaults to the
+        directory of the first path, so that the handler is at the root of the package.
+        exclude (List[str], optional): glob patterns of file or directory names to skip.
+        Defaults to DEFAULT_PACKAGE_EXCLUDE.
+        compress (bool, optional): whether to deflate the files. Defaults to True.
+        extra_files (Dict[str, str], optional): files from outside base_dir, by their path in the zip,
+        e.g. {"action_group_runtime.py": "/path/to/action_group_runtime.py"}. Files of the paths win.
+
+    Returns:
+        LambdaPackage: the zip content and the paths it holds
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    if base_dir is None:
+        _first = paths[0]
+        base_dir = _first if os.path.isdir(_first) else os.path.dirname(_first)
+    if exclude is None:
+        exclude = DEFAULT_PACKAGE_EXCLUDE
+    _files = _package_files(paths, base_dir or ".", exclude)
+    if extra_files:
+        _arcnames = {_arcname for _arcname, _ in _files}
+        _files = sorted(
+            _files
+            + [
+                (_arcname, _path)
+                for _arcname, _path in extra_files.items()
+                if _arcname not in _arcnames
+            ]
+        )
+
+    s = BytesIO()
+    with zipfile.ZipFile(s, "w") as z:
+        for _arcname, _path in _files:
+            _zip_info = zipfile.ZipInfo(_arcname, date_time=LAMBDA_ZIP_DATE_TIME)
+            _zip_info.external_attr = 0o644 << 16
+            _zip_info.compress_type = (
+                zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            )
+            with open(_path, "rb") as f:
+                z.writestr(_zip_info, f.read(), compresslevel=9)
+    return LambdaPackage(s.getvalue(), [_arcname for _arcname, _ in _files])
+
+
+def dependency_hash(
+    requirements: List[str],
+    runtime: str = DEFAULT_LAYER_RUNTIME,
+    platform: str = DEFAULT_LAYER_PLATFORM,
+) -> str:
+    """Returns the hash identifying the dependency layer of a set of requirements."""
+    _normalized = sorted(
+        {_req.strip().lower() for _req in requirements if _req.strip()}
+    )
+    _key = "\n".join([runtime, platform] + _normalized)
+    return hashlib.sha256(_key.encode("utf-8")).hexdigest()
+
+
+def build_dependency_layer(
+    requirements: List[str],
+    runtime: str = DEFAULT_LAYER_RUNTIME,
+    platform: str = DEFAULT_LAYER_PLATFORM,
+) -> LambdaPackage:
+    """Installs requirements with pip for the Lambda platform, and zips them as a layer.
+
+    Args:
+        requirements (List[str]): pip requirements, e.g. ["requests==2.32.3", "pandas"]
+        runtime (str, optional): Lambda runtime, e.g. python3.12. Defaults to DEFAULT_LAYER_RUNTIME.
+        platform (str, optional): pip platform of the Lambda architecture. Defaults to x86_64;
+        use manylinux2014_aarch64 for arm64 functions.
+
+    Returns:
+        LambdaPackage: the layer content
+    """
+    _python_version = runtime.replace("python", "")
+    with tempfile.TemporaryDirectory() as _tmp_dir:
+        _target = os.path.join(_tmp_dir, "python")
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "pip",
+                "install",
+                "--quiet",
+                "--target",
+                _target,
+                "--platform",
+                platform,
+                "--implementation",
+                "cp",
+                "--python-version",
+                _python_version,
+                "--only-binary=:all:",
+                "--no-compile",
+            ]
+            + list(requirements),
+            check=True,
+        )
+        # layers are extracted in /opt: python/ puts the packages on the path
+        return build_package(
+            _target,
+            base_dir=_tmp_dir,
+            exclude=["__pycache__", "*.pyc"],
+        )
+
+
+def publish_dependency_layer(
+    lambda_client,
+    requirements: List[str],
+    runtime: str = DEFAULT_LAYER_RUNTIME,
+    platform: str = DEFAULT_LAYER_PLATFORM,
+    s3_client=None,
+    s3_bucket: str = None,
+    verbose: bool = False,
+) -> str:
+    """Returns the ARN of a layer with the requirements, publishing it only if no layer with the
+    same requirements exists yet.
+
+    Args:
+        lambda_client: boto3 Lambda client
+        requirements (List[str]): pip requirements
+        runtime (str, optional): Lambda runtime. Defaults to DEFAULT_LAYER_RUNTIME.
+        platform (str, optional): pip platform of the Lambda architecture. Defaults to DEFAULT_LAYER_PLATFORM.
+        s3_client (optional): boto3 S3 client, to upload layers larger than MAX_DIRECT_UPLOAD_BYTES
+        s3_bucket (str, optional): bucket used for large layers
+        verbose (bool, optional): whether to print progress. Defaults to False.
+
+    Returns:
+        str: ARN of the layer version
+    """
+    _hash = dependency_hash(requirements, runtime, platform)
+    _layer_name = f"{LAYER_NAME_PREFIX}{_hash[:32]}"
+    _description = f"{_LAYER_HASH_DESCRIPTION_PREFIX}{_hash}"
+    _paginator = lambda_client.get_paginator("list_layer_versions")
+    for _page in _paginator.paginate(LayerName=_layer_name):
+        for _version in _page.get("LayerVersions", []):
+            if _version.get("Description") == _description:
+                if verbose:
+                    print(f"Reusing dependency layer {_version['LayerVersionArn']}")
+                return _version["LayerVersionArn"]
+
+    if verbose:
+        print(f"Building dependency layer {_layer_name} for {requirements}...")
+    _layer = build_dependency_layer(requirements, runtime, platform)
+    if _layer.size <= MAX_DIRECT_UPLOAD_BYTES:
+        _content = {"ZipFile": _layer.zip_content}
+    elif s3_client is not None and s3_bucket is not None:
+        _key = f"lambda-layers/{_layer_name}.zip"
+        s3_client.put_object(Bucket=s3_bucket, Key=_key, Body=_layer.zip_content)
+        _content = {"S3Bucket": s3_bucket, "S3Key": _key}
+    else:
+        raise ValueError(
+            f"Dependency layer of {_layer.size:,} bytes needs an S3 bucket to be uploaded"
+        )
+    _resp = lambda_client.publish_layer_version(
+        LayerName=_layer_name,
+        Description=_description,
+        Content=_content,
+        CompatibleRuntimes=[runtime],
+    )
+    if verbose:
+        print(f"Published dependency layer {_resp['LayerVersionArn']}")
+    return _resp["LayerVersionArn"]
+
+
+def deploy_function_code(
+    lambda_client, function_name: str, package: LambdaPackage, verbose: bool = False
+) -> bool:
+    """Updates the code of an existing Lambda function, unless it already runs this package.
+
+    Returns:
+        bool: whether the code was uploaded
+    """
+    _function = lambda_client.get_function(FunctionName=function_name)
+    if _function["Configuration"]["CodeSha256"] == package.code_sha256:
+        return False
+    if verbose:
+        print(f"Updating code of Lambda function {function_name}...")
+    lambda_client.update_function_code(
+        FunctionName=function_name, ZipFile=package.zip_content
+    )
+    lambda_client.get_waiter("function_updated").wait(FunctionName=function_name)
+    return True
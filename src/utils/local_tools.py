@@ -0,0 +1,383 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module runs the tools of an agent locally, instead of in the AWS Lambda functions of its action
+groups, for development, testing and benchmarks.
+
+The agent gets return of control (ROC) action groups with the same function definitions. Each
+returnControl event it sends is turned into the event a Lambda function would receive, passed to the
+same handler code in this process (or in a pool of worker processes), and the responses are turned
+into the returnControlInvocationResults of the next invokeAgent call.
+AgentsForAmazonBedrock.invoke_with_local_tools() runs that loop until the agent answers.
+
+All the invocation inputs of a returnControl event run concurrently, in a pool of threads (or of
+processes), so a round costs the latency of its slowest tool rather than the sum of all of them. A tool
+that runs past the timeout of the executor gets an error result, and the round goes on without it.
+
+Tools are either functions, served by an ActionGroupDispatcher, or Lambda handler files such as
+those written by create_lambda_file(), loaded once per process. LocalToolExecutor.execute() takes a
+returnControl payload and needs no AWS access, so the tools of an agent can be load tested with
+synthetic payloads, and their latency is recorded per tool in durations.
+"""
+
+import hashlib
+import importlib.util
+import inspect
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from . import action_group_runtime
+from .action_group_runtime import MESSAGE_VERSION, ActionGroupDispatcher
+
+DEFAULT_LOCAL_TOOL_PROCESSES = 4
+DEFAULT_LOCAL_TOOL_WORKERS = 8
+
+# Lambda source files imported in this process, by absolute path
+_LOADED_MODULES: Dict[str, Any] = {}
+_LOAD_LOCK = threading.Lock()
+# tools of a worker process, set by _init_worker()
+_WORKER_DISPATCHER: ActionGroupDispatcher = None
+_WORKER_LAMBDA_FILES: Dict[str, str] = {}
+
+
+def _load_lambda_module(lambda_file: str):
+    _path = os.path.abspath(lambda_file)
+    with _LOAD_LOCK:
+        if _path not in _LOADED_MODULES:
+            sys.modules.setdefault(
+                action_group_runtime.RUNTIME_MODULE, action_group_runtime
+            )
+            _dir = os.path.dirname(_path)
+            if _dir not in sys.path:
+                sys.path.insert(0, _dir)
+            _module_name = (
+                "local_lambda_" + hashlib.sha256(_path.encode("utf-8")).hexdigest()[:16]
+            )
+            _spec = importlib.util.spec_from_file_location(_module_name, _path)
+            _module = importlib.util.module_from_spec(_spec)
+            sys.modules[_module_name] = _module
+            _spec.loader.exec_module(_module)
+            _LOADED_MODULES[_path] = _module
+        return _LOADED_MODULES[_path]
+
+
+def load_lambda_handler(
+    lambda_file: str, handler_name: str = "lambda_handler"
+) -> Callable:
+    """Imports a Lambda source file once per process and returns its handler.
+
+    The directory of the file is added to sys.path, as it is the root of the Lambda package, and
+    handlers importing action_group_runtime get this package's module.
+    """
+    return getattr(_load_lambda_module(lambda_file), handler_name)
+
+
+def invocation_event(
+    invocation_input: Dict,
+    session_id: str = None,
+    session_state: Dict = None,
+    input_text: str = "",
+) -> Dict:
+    """Returns the Lambda event an action group would receive for an invocation input of a
+    returnControl payload."""
+    _session_state = session_state or {}
+    _event = {
+        "messageVersion": MESSAGE_VERSION,
+        "sessionId": session_id,
+        "inputText": input_text,
+        "sessionAttributes": _session_state.get("sessionAttributes") or {},
+        "promptSessionAttributes": _session_state.get("promptSessionAttributes") or {},
+    }
+    if "apiInvocationInput" in invocation_input:
+        _input = invocation_input["apiInvocationInput"]
+        _event.update(
+            {
+                "actionGroup": _input.get("actionGroup", ""),
+                "apiPath": _input.get("apiPath", ""),
+                "httpMethod": _input.get("httpMethod", ""),
+                "parameters": _input.get("parameters", []),
+                "requestBody": _input.get("requestBody", {}),
+            }
+        )
+    else:
+        _input = invocation_input["functionInvocationInput"]
+        _event.update(
+            {
+                "actionGroup": _input.get("actionGroup", ""),
+                "function": _input.get("function", ""),
+                "parameters": _input.get("parameters", []),
+            }
+        )
+    return _event
+
+
+def invocation_result(response: Dict) -> Dict:
+    """Returns the returnControlInvocationResults item of the response of a Lambda handler."""
+    _response = response["response"]
+    if "apiPath" in _response:
+        return {
+            "apiResult": {
+                "actionGroup": _response["actionGroup"],
+                "apiPath": _response["apiPath"],
+                "httpMethod": _response["httpMethod"],
+                "httpStatusCode": _response.get("httpStatusCode", 200),
+                "responseBody": _response.get("responseBody", {}),
+            }
+        }
+    return {
+        "functionResult": {
+            "actionGroup": _response["actionGroup"],
+            "function": _response["function"],
+            "responseBody": _response["functionResponse"]["responseBody"],
+        }
+    }
+
+
+def _tool_name(event: Dict) -> str:
+    if "apiPath" in event:
+        return f"{event.get('httpMethod', '').upper()} {event['apiPath']}"
+    return event.get("function", "")
+
+
+def _handle(
+    dispatcher: ActionGroupDispatcher, lambda_files: Dict[str, str], event: Dict
+) -> Dict:
+    _name = _tool_name(event)
+    _lambda_file = lambda_files.get(_name) or lambda_files.get(event.get("apiPath"))
+    if _lambda_file is None:
+        return dispatcher.dispatch(event)
+    try:
+        return load_lambda_handler(_lambda_file)(event, None)
+    except Exception as e:
+        _error = f"Error executing {_name}: {e}"
+        print(_error)
+        return ActionGroupDispatcher.response(event, _error)
+
+
+def _init_worker(dispatcher: ActionGroupDispatcher, lambda_files: Dict[str, str]):
+    global _WORKER_DISPATCHER, _WORKER_LAMBDA_FILES
+    _WORKER_DISPATCHER = dispatcher
+    _WORKER_LAMBDA_FILES = lambda_files
+
+
+def _handle_in_worker(event: Dict) -> Tuple[Dict, float]:
+    """Returns the response of a tool, and the seconds it took in the worker."""
+    _start = time.perf_counter()
+    _response = _handle(_WORKER_DISPATCHER, _WORKER_LAMBDA_FILES, event)
+    return _response, time.perf_counter() - _start
+
+
+class LocalToolExecutor:
+    """Runs the tools of return of control action groups locally, emulating their Lambda functions."""
+
+    def __init__(
+        self,
+        use_processes: bool = False,
+        max_processes: int = DEFAULT_LOCAL_TOOL_PROCESSES,
+        max_workers: int = DEFAULT_LOCAL_TOOL_WORKERS,
+        timeout: float = None,
+    ):
+        """Args:
+        use_processes (bool, optional): whether to run the tools in a pool of worker processes,
+        e.g. for CPU-bound tools. Functions must then be defined at module level, so that they can
+        be pickled. Defaults to False: tools run in a pool of threads.
+        max_processes (int, optional): size of the process pool. Defaults to DEFAULT_LOCAL_TOOL_PROCESSES.
+        max_workers (int, optional): size of the thread pool. Defaults to DEFAULT_LOCAL_TOOL_WORKERS.
+        timeout (float, optional): seconds each tool of a returnControl event gets, from the start of
+        the round; a tool still running then gets an error result. Defaults to None: no timeout.
+        """
+        self.use_processes = use_processes
+        self.max_processes = max_processes
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.durations: Dict[str, List[float]] = {}
+        self._dispatcher = ActionGroupDispatcher()
+        self._lambda_files: Dict[str, str] = {}
+        self._pool: ProcessPoolExecutor = None
+        self._threads: ThreadPoolExecutor = None
+        self._lock = threading.Lock()
+
+    def register(self, func: Callable, name: str = None) -> Callable:
+        """Registers a function as a tool, see ActionGroupDispatcher.register()."""
+        self._dispatcher.register(func, name)
+        self._reset_pool()
+        return func
+
+    def register_tools(
+        self, tools: Union[List[Callable], Dict[str, Callable], Any]
+    ) -> "LocalToolExecutor":
+        """Registers several tools at once.
+
+        Args:
+            tools: a list of functions, a dictionary of tool names to functions, a module whose
+            public functions defined in it are the tools, or an object (a class or an instance) whose
+            public methods are the tools
+
+        Returns:
+            LocalToolExecutor: this executor
+        """
+        if isinstance(tools, dict):
+            _tools = tools.items()
+        elif isinstance(tools, (list, tuple)):
+            _tools = [(_func.__name__, _func) for _func in tools]
+        elif inspect.ismodule(tools):
+            # names the module imports are not its tools
+            _tools = [
+                (_name, _func)
+                for _name, _func in vars(tools).items()
+                if not _name.startswith("_")
+                and inspect.isfunction(_func)
+                and _func.__module__ == tools.__name__
+            ]
+        else:
+            _tools = [
+                (_name, getattr(tools, _name))
+                for _name in dir(tools)
+                if not _name.startswith("_")
+                and (
+                    inspect.ismethod(getattr(tools, _name))
+                    or inspect.isfunction(getattr(tools, _name))
+                )
+            ]
+        for _name, _func in _tools:
+            self._dispatcher.register(_func, _name)
+        self._reset_pool()
+        return self
+
+    def add_lambda_file(self, lambda_file: str, function_names: List[str] = None):
+        """Serves tools with the handler of a Lambda source file.
+
+        Args:
+            lambda_file (str): Lambda source file, with a lambda_handler function
+            function_names (List[str], optional): functions of the action group the handler serves.
+            Defaults to the tools of its ActionGroupDispatcher, for files from create_lambda_file().
+        """
+        if function_names is None:
+            _module_dispatcher = getattr(
+                _load_lambda_module(lambda_file), "dispatcher", None
+            )
+            if not isinstance(_module_dispatcher, ActionGroupDispatcher):
+                raise ValueError(
+                    f"{lambda_file} has no ActionGroupDispatcher, pass its function names"
+                )
+            function_names = _module_dispatcher.tool_names
+        for _name in function_names:
+            self._lambda_files[_name] = lambda_file
+        self._reset_pool()
+
+    @property
+    def tool_names(self) -> List[str]:
+        return self._dispatcher.tool_names + list(self._lambda_files)
+
+    def _reset_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def _get_pool(self) -> Executor:
+        with self._lock:
+            if not self.use_processes:
+                if self._threads is None:
+                    self._threads = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="local-tool",
+                    )
+                return self._threads
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_processes,
+                    initializer=_init_worker,
+                    initargs=(self._dispatcher, dict(self._lambda_files)),
+                )
+            return self._pool
+
+    def _record(self, name: str, seconds: float):
+        with self._lock:
+            self.durations.setdefault(name, []).append(seconds)
+
+    def handle(self, event: Dict) -> Dict:
+        """Runs the tool of a Lambda event in this process, and returns its Lambda response."""
+        _start = time.perf_counter()
+        try:
+            return _handle(self._dispatcher, self._lambda_files, event)
+        finally:
+            self._record(_tool_name(event), time.perf_counter() - _start)
+
+    def execute(
+        self,
+        return_control: Dict,
+        session_id: str = None,
+        session_state: Dict = None,
+        input_text: str = "",
+    ) -> List[Dict]:
+        """Runs the tools requested by a returnControl payload, all at once.
+
+        Args:
+            return_control (Dict): returnControl payload of an invokeAgent response
+            session_id (str, optional): session id passed to the tools
+            session_state (Dict, optional): session state, for the session attributes passed to the tools
+            input_text (str, optional): user input passed to the tools
+
+        Returns:
+            List[Dict]: the returnControlInvocationResults, in the order of the invocation inputs
+        """
+        _events = [
+            invocation_event(_input, session_id, session_state, input_text)
+            for _input in return_control.get("invocationInputs", [])
+        ]
+        if len(_events) == 1 and not self.use_processes and self.timeout is None:
+            return [invocation_result(self.handle(_events[0]))]
+
+        _pool = self._get_pool()
+        _start = time.perf_counter()
+        _deadline = None if self.timeout is None else _start + self.timeout
+        _futures = [
+            _pool.submit(
+                _handle_in_worker if self.use_processes else self.handle, _event
+            )
+            for _event in _events
+        ]
+        _results = []
+        for _event, _future in zip(_events, _futures):
+            _name = _tool_name(_event)
+            try:
+                _response = _future.result(
+                    timeout=(
+                        None
+                        if _deadline is None
+                        else max(_deadline - time.perf_counter(), 0)
+                    )
+                )
+                # in threads, handle() records the duration of each tool, workers return it
+                if self.use_processes:
+                    _response, _seconds = _response
+                    self._record(_name, _seconds)
+            except FutureTimeoutError:
+                # a thread cannot be stopped: the tool keeps running, but the round goes on
+                _future.cancel()
+                _error = f"Error: {_name} timed out after {self.timeout}s"
+                print(_error)
+                _response = ActionGroupDispatcher.response(_event, _error)
+            _results.append(invocation_result(_response))
+        return _results
+
+    def close(self):
+        """Stops the worker threads and processes, if any."""
+        self._reset_pool()
+        with self._lock:
+            if self._threads is not None:
+                self._threads.shutdown(wait=False)
+                self._threads = None
+
+    def __enter__(self) -> "LocalToolExecutor":
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
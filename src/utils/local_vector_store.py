@@ -0,0 +1,500 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module contains a local stand-in for the retrieval of a Knowledge Base for Amazon Bedrock.
+
+LocalVectorStore keeps chunks, their metadata and their vectors in NumPy arrays, and answers
+retrieve() calls with the request and response shapes of the bedrock-agent-runtime Retrieve API,
+including the metadata filters of vectorSearchConfiguration (equals, in, andAll, ...). It can be
+given to KnowledgeBasesForAmazonBedrock.set_retrieval_backend(), or used directly, to measure
+retrieval latency and quality offline and to run tests without OpenSearch Serverless.
+
+Two indexes are available: ExactIndex scores every vector, and IVFIndex only scores the vectors of
+the clusters closest to the query, trading some recall for latency on large corpora. Scores follow
+the OpenSearch k-NN conventions of each space type, so that they are comparable with the scores of a
+knowledge base. Stores are saved as a .npy file of vectors and a JSON file of chunks, and the vectors
+are memory-mapped when loaded.
+
+Queries are embedded by a function given to the store: bedrock_embedder() calls an Amazon Bedrock
+embedding model, and HashingEmbedder is a deterministic embedder of words for tests without AWS access.
+NumPy is required: pip install numpy
+"""
+
+import hashlib
+import json
+import os
+import re
+import uuid
+from typing import Callable, Dict, List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NUMPY_AVAILABLE = np is not None
+DEFAULT_NUMBER_OF_RESULTS = 5
+DEFAULT_IVF_PROBES = 8
+SOURCE_URI_METADATA_KEY = "x-amz-bedrock-kb-source-uri"
+CHUNK_ID_METADATA_KEY = "x-amz-bedrock-kb-chunk-id"
+_VECTORS_FILE = "vectors.npy"
+_CHUNKS_FILE = "chunks.json"
+_SPACE_TYPES = ["l2", "innerproduct", "cosinesimil"]
+_SPACE_TYPE_ALIASES = {"cosine": "cosinesimil", "dot_product": "innerproduct"}
+# rows scored at once when assigning vectors to clusters, to bound memory
+_ASSIGN_BATCH_SIZE = 65536
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def _require_numpy(name: str) -> None:
+    if not NUMPY_AVAILABLE:
+        raise ImportError(f"{name} requires NumPy: pip install numpy")
+
+
+def _compare(operator: str, value, expected) -> bool:
+    if operator == "equals":
+        return value == expected
+    if operator == "notEquals":
+        return value != expected
+    if value is None:
+        return operator == "notIn"
+    if operator == "greaterThan":
+        return value > expected
+    if operator == "greaterThanOrEquals":
+        return value >= expected
+    if operator == "lessThan":
+        return value < expected
+    if operator == "lessThanOrEquals":
+        return value <= expected
+    if operator == "in":
+        return value in expected
+    if operator == "notIn":
+        return value not in expected
+    if operator == "startsWith":
+        return isinstance(value, str) and value.startswith(expected)
+    if operator == "listContains":
+        return isinstance(value, list) and expected in value
+    if operator == "stringContains":
+        if isinstance(value, list):
+            return any(isinstance(_v, str) and expected in _v for _v in value)
+        return isinstance(value, str) and expected in value
+    raise ValueError(f"Unsupported retrieval filter operator {operator}")
+
+
+def matches_filter(metadata: Dict, retrieval_filter: Dict) -> bool:
+    """Evaluates a retrieval filter of the Retrieve API against the metadata of a chunk.
+
+    Args:
+        metadata (Dict): metadata of the chunk
+        retrieval_filter (Dict): e.g. {"equals": {"key": "access_level", "value": "Manager"}},
+        or {"andAll": [...]} / {"orAll": [...]} of filters
+
+    Returns:
+        bool: True if the chunk matches the filter, or if there is no filter
+    """
+    if not retrieval_filter:
+        return True
+    if len(retrieval_filter) != 1:
+        raise ValueError(
+            f"A retrieval filter must have exactly one operator, got {list(retrieval_filter)}"
+        )
+    _operator, _operand = next(iter(retrieval_filter.items()))
+    if _operator == "andAll":
+        return all(matches_filter(metadata, _filter) for _filter in _operand)
+    if _operator == "orAll":
+        return any(matches_filter(metadata, _filter) for _filter in _operand)
+    return _compare(_operator, metadata.get(_operand["key"]), _operand["value"])
+
+
+class HashingEmbedder:
+    """Deterministic embedder hashing the words and word pairs of a text into a fixed number of
+    dimensions. Texts sharing words get similar vectors: enough for tests and benchmarks of the
+    retrieval machinery, not for measuring retrieval quality."""
+
+    def __init__(self, dimension: int = 256):
+        _require_numpy("HashingEmbedder")
+        self.dimension = dimension
+
+    def _bucket(self, token: str) -> Tuple[int, float]:
+        _digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        _value = int.from_bytes(_digest, "little")
+        return _value % self.dimension, 1.0 if (_value >> 63) & 1 else -1.0
+
+    def __call__(self, text: str):
+        _vector = np.zeros(self.dimension, dtype=np.float32)
+        _words = _TOKEN_PATTERN.findall(text.lower())
+        for _token in _words + [
+            f"{_first} {_second}" for _first, _second in zip(_words, _words[1:])
+        ]:
+            _index, _sign = self._bucket(_token)
+            _vector[_index] += _sign
+        _norm = np.linalg.norm(_vector)
+        return _vector / _norm if _norm > 0 else _vector
+
+
+def bedrock_embedder(
+    bedrock_runtime_client,
+    model_id: str = "amazon.titan-embed-text-v2:0",
+    dimensions: int = None,
+) -> Callable[[str], List[float]]:
+    """Returns an embedder calling an Amazon Bedrock embedding model, to index and query a
+    LocalVectorStore with the same vectors as a knowledge base.
+
+    Args:
+        bedrock_runtime_client: boto3 bedrock-runtime client
+        model_id (str, optional): a Titan or Cohere embedding model
+        dimensions (int, optional): dimension of the Titan v2 vectors. Defaults to the model default.
+    """
+
+    def _embed(text: str) -> List[float]:
+        if model_id.startswith("cohere."):
+            _body = {"texts": [text], "input_type": "search_query"}
+        else:
+            _body = {"inputText": text}
+            if dimensions is not None:
+                _body["dimensions"] = dimensions
+        _resp = bedrock_runtime_client.invoke_model(
+            modelId=model_id, body=json.dumps(_body)
+        )
+        _result = json.loads(_resp["body"].read())
+        if model_id.startswith("cohere."):
+            return _result["embeddings"][0]
+        return _result["embedding"]
+
+    return _embed
+
+
+class ExactIndex:
+    """Scores the query against every vector. Exact, and fast enough for up to a few hundred
+    thousand chunks."""
+
+    def __init__(self, space_type: str = "cosinesimil"):
+        _require_numpy(type(self).__name__)
+        self.space_type = _SPACE_TYPE_ALIASES.get(space_type, space_type)
+        if self.space_type not in _SPACE_TYPES:
+            raise ValueError(
+                f"Invalid space type {space_type}. It should be one of {_SPACE_TYPES}"
+            )
+        self._vectors = None
+        self._norms = None
+
+    def build(self, vectors) -> None:
+        """Indexes the vectors, an array of shape (number of chunks, dimension)."""
+        self._vectors = vectors
+        self._norms = np.linalg.norm(vectors, axis=1) if len(vectors) else None
+
+    def _scores(self, query, ids=None):
+        _vectors = self._vectors if ids is None else self._vectors[ids]
+        _norms = self._norms if ids is None else self._norms[ids]
+        _dot = _vectors @ query
+        if self.space_type == "cosinesimil":
+            _cos = _dot / np.maximum(_norms * np.linalg.norm(query), 1e-12)
+            return (1.0 + _cos) / 2.0
+        if self.space_type == "innerproduct":
+            return np.where(_dot >= 0, _dot + 1.0, 1.0 / (1.0 - _dot))
+        _squared_distance = np.maximum(
+            _norms * _norms - 2.0 * _dot + float(query @ query), 0.0
+        )
+        return 1.0 / (1.0 + _squared_distance)
+
+    def search(self, query, k: int, candidates=None) -> Tuple[List[int], List[float]]:
+        """Returns the ids and scores of the k best vectors, best first.
+
+        Args:
+            query: query vector
+            k (int): number of results
+            candidates (optional): boolean mask of the vectors allowed, e.g. by a metadata filter
+        """
+        if self._vectors is None or len(self._vectors) == 0:
+            return [], []
+        _ids = None if candidates is None else np.flatnonzero(candidates)
+        return self._top_k(query, k, _ids)
+
+    def _top_k(self, query, k: int, ids=None) -> Tuple[List[int], List[float]]:
+        if ids is not None and len(ids) == 0:
+            return [], []
+        _scores = self._scores(query, ids)
+        _k = min(k, len(_scores))
+        _best = np.argpartition(-_scores, _k - 1)[:_k]
+        _best = _best[np.argsort(-_scores[_best], kind="stable")]
+        _ids = _best if ids is None else ids[_best]
+        return _ids.tolist(), _scores[_best].tolist()
+
+
+class IVFIndex(ExactIndex):
+    """Inverted file index: vectors are clustered with k-means, and a query only scores the vectors
+    of the n_probe clusters closest to it. More probes give better recall and higher latency.
+    """
+
+    def __init__(
+        self,
+        space_type: str = "cosinesimil",
+        n_lists: int = None,
+        n_probe: int = DEFAULT_IVF_PROBES,
+        iterations: int = 10,
+        seed: int = 0,
+    ):
+        """Args:
+        space_type (str, optional): l2, innerproduct or cosinesimil. Defaults to cosinesimil.
+        n_lists (int, optional): number of clusters. Defaults to the square root of the number of vectors.
+        n_probe (int, optional): clusters scored per query. Defaults to DEFAULT_IVF_PROBES.
+        iterations (int, optional): k-means iterations
+        seed (int, optional): seed of the k-means initialization, for repeatable benchmarks
+        """
+        super().__init__(space_type)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.seed = seed
+        self._centroids = None
+        self._lists = []
+
+    def _clustered(self, vectors):
+        if self.space_type != "cosinesimil":
+            return np.asarray(vectors, dtype=np.float32)
+        _norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.asarray(vectors / np.maximum(_norms, 1e-12), dtype=np.float32)
+
+    def _assign(self, vectors):
+        _assignments = np.empty(len(vectors), dtype=np.int64)
+        _centroid_norms = (self._centroids * self._centroids).sum(axis=1)
+        for _start in range(0, len(vectors), _ASSIGN_BATCH_SIZE):
+            _batch = self._clustered(vectors[_start : _start + _ASSIGN_BATCH_SIZE])
+            # squared l2 distance, without the norm of the vectors that does not change the argmin
+            _distances = _centroid_norms - 2.0 * (_batch @ self._centroids.T)
+            _assignments[_start : _start + len(_batch)] = _distances.argmin(axis=1)
+        return _assignments
+
+    def build(self, vectors) -> None:
+        super().build(vectors)
+        if len(vectors) == 0:
+            self._centroids, self._lists = None, []
+            return
+        _n_lists = min(self.n_lists or max(1, int(np.sqrt(len(vectors)))), len(vectors))
+        _rng = np.random.default_rng(self.seed)
+        self._centroids = self._clustered(
+            vectors[np.sort(_rng.choice(len(vectors), _n_lists, replace=False))]
+        )
+        for _ in range(self.iterations):
+            _assignments = self._assign(vectors)
+            for _list in range(_n_lists):
+                _members = np.flatnonzero(_assignments == _list)
+                if len(_members):
+                    self._centroids[_list] = self._clustered(vectors[_members]).mean(
+                        axis=0
+                    )
+        _assignments = self._assign(vectors)
+        self._lists = [
+            np.flatnonzero(_assignments == _list) for _list in range(_n_lists)
+        ]
+
+    def search(self, query, k: int, candidates=None) -> Tuple[List[int], List[float]]:
+        if self._centroids is None:
+            return [], []
+        _query = self._clustered(np.asarray(query)[None, :])[0]
+        _distances = (self._centroids * self._centroids).sum(axis=1) - 2.0 * (
+            self._centroids @ _query
+        )
+        _ids = []
+        _found = 0
+        for _probe, _list in enumerate(np.argsort(_distances)):
+            _members = self._lists[_list]
+            if candidates is not None:
+                _members = _members[candidates[_members]]
+            _ids.append(_members)
+            _found += len(_members)
+            # a selective filter can leave too few candidates in the closest clusters
+            if _probe + 1 >= self.n_probe and _found >= k:
+                break
+        return self._top_k(query, k, np.concatenate(_ids))
+
+
+class LocalVectorStore:
+    """Chunks and vectors answering Retrieve API requests locally.
+
+    Example:
+        store = LocalVectorStore(HashingEmbedder(), knowledge_base_id="local-hr-kb")
+        store.add(["Managers get a yearly bonus"], uris=["s3://hr/bonus.md"],
+                  metadata=[{"access_level": "Manager"}])
+        store.retrieve(
+            knowledgeBaseId="local-hr-kb",
+            retrievalQuery={"text": "bonus"},
+            retrievalConfiguration={"vectorSearchConfiguration": {
+                "numberOfResults": 2,
+                "filter": {"equals": {"key": "access_level", "value": "Manager"}}}})
+    """
+
+    def __init__(
+        self,
+        embedder: Callable[[str], Sequence[float]],
+        index: ExactIndex = None,
+        knowledge_base_id: str = None,
+    ):
+        """Args:
+        embedder (Callable): returns the vector of a text, used for the queries and for the chunks
+        added without vectors
+        index (ExactIndex, optional): ExactIndex or IVFIndex. Defaults to an ExactIndex with cosine similarity.
+        knowledge_base_id (str, optional): id answered by retrieve(). Defaults to any id.
+        """
+        _require_numpy("LocalVectorStore")
+        self.embedder = embedder
+        self.index = index if index is not None else ExactIndex()
+        self.knowledge_base_id = knowledge_base_id
+        self._chunks: List[Dict] = []
+        self._vectors = None
+        self._stale = True
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def add(
+        self,
+        texts: List[str],
+        uris: List[str] = None,
+        metadata: List[Dict] = None,
+        vectors=None,
+    ) -> List[str]:
+        """Adds chunks to the store. The index is rebuilt by the next retrieve().
+
+        Args:
+            texts (List[str]): text of each chunk
+            uris (List[str], optional): source URI of each chunk, e.g. s3://bucket/doc.pdf
+            metadata (List[Dict], optional): metadata of each chunk, used by the filters
+            vectors (optional): vector of each chunk. Defaults to the vectors of the embedder.
+
+        Returns:
+            List[str]: the ids of the chunks
+        """
+        if vectors is None:
+            vectors = [self.embedder(_text) for _text in texts]
+        _vectors = np.asarray(vectors, dtype=np.float32)
+        if _vectors.ndim != 2 or len(_vectors) != len(texts):
+            raise ValueError("Expected one vector per text")
+        if self._vectors is not None and _vectors.shape[1] != self._vectors.shape[1]:
+            raise ValueError(
+                f"Expected vectors of dimension {self._vectors.shape[1]}, got {_vectors.shape[1]}"
+            )
+        _ids = []
+        for _position, _text in enumerate(texts):
+            _chunk_id = str(uuid.uuid4())
+            self._chunks.append(
+                {
+                    "id": _chunk_id,
+                    "text": _text,
+                    "uri": uris[_position] if uris else None,
+                    "metadata": dict(metadata[_position]) if metadata else {},
+                }
+            )
+            _ids.append(_chunk_id)
+        # copies a memory-mapped array into memory: saving again writes a new file
+        self._vectors = (
+            _vectors
+            if self._vectors is None
+            else np.concatenate([self._vectors, _vectors])
+        )
+        self._stale = True
+        return _ids
+
+    def build(self) -> None:
+        """Builds the index now, instead of on the next retrieve()."""
+        _vectors = (
+            self._vectors if self._vectors is not None else np.zeros((0, 0), np.float32)
+        )
+        self.index.build(_vectors)
+        self._stale = False
+
+    def save(self, path: str) -> None:
+        """Writes the vectors and chunks to a directory."""
+        os.makedirs(path, exist_ok=True)
+        _vectors = (
+            self._vectors if self._vectors is not None else np.zeros((0, 0), np.float32)
+        )
+        np.save(os.path.join(path, _VECTORS_FILE), _vectors)
+        with open(os.path.join(path, _CHUNKS_FILE), "w") as f:
+            json.dump(
+                {"knowledge_base_id": self.knowledge_base_id, "chunks": self._chunks}, f
+            )
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        embedder: Callable[[str], Sequence[float]],
+        index: ExactIndex = None,
+        mmap: bool = True,
+    ) -> "LocalVectorStore":
+        """Reads a store written by save().
+
+        Args:
+            path (str): directory of the store
+            embedder (Callable): embedder of the queries, the one used to build the store
+            index (ExactIndex, optional): index to build. Defaults to an ExactIndex with cosine similarity.
+            mmap (bool, optional): whether to memory-map the vectors instead of reading them. Defaults to True.
+        """
+        with open(os.path.join(path, _CHUNKS_FILE), "r") as f:
+            _saved = json.load(f)
+        _store = cls(embedder, index, _saved["knowledge_base_id"])
+        _store._chunks = _saved["chunks"]
+        _vectors = np.load(
+            os.path.join(path, _VECTORS_FILE), mmap_mode="r" if mmap else None
+        )
+        _store._vectors = _vectors if len(_vectors) else None
+        return _store
+
+    def _result(self, position: int, score: float) -> Dict:
+        _chunk = self._chunks[position]
+        _metadata = dict(_chunk["metadata"])
+        _metadata[CHUNK_ID_METADATA_KEY] = _chunk["id"]
+        _result = {
+            "content": {"text": _chunk["text"], "type": "TEXT"},
+            "score": score,
+            "metadata": _metadata,
+        }
+        if _chunk["uri"] is not None:
+            _metadata[SOURCE_URI_METADATA_KEY] = _chunk["uri"]
+            _result["location"] = {"type": "S3", "s3Location": {"uri": _chunk["uri"]}}
+        return _result
+
+    def retrieve(
+        self,
+        knowledgeBaseId: str = None,
+        retrievalQuery: Dict = None,
+        retrievalConfiguration: Dict = None,
+        **kwargs,
+    ) -> Dict:
+        """Answers a request of the bedrock-agent-runtime Retrieve API. The search type is always
+        semantic, and the results fit in one page.
+
+        Returns:
+            Dict: {"retrievalResults": [...]}, best first
+        """
+        if self.knowledge_base_id is not None and knowledgeBaseId not in [
+            None,
+            self.knowledge_base_id,
+        ]:
+            raise ValueError(
+                f"This store holds knowledge base {self.knowledge_base_id}, not {knowledgeBaseId}"
+            )
+        _config = (retrievalConfiguration or {}).get("vectorSearchConfiguration", {})
+        _k = _config.get("numberOfResults", DEFAULT_NUMBER_OF_RESULTS)
+        _filter = _config.get("filter")
+        if self._stale:
+            self.build()
+        _candidates = None
+        if _filter:
+            _candidates = np.fromiter(
+                (
+                    matches_filter(_chunk["metadata"], _filter)
+                    for _chunk in self._chunks
+                ),
+                dtype=bool,
+                count=len(self._chunks),
+            )
+        _query = np.asarray(self.embedder(retrievalQuery["text"]), dtype=np.float32)
+        _ids, _scores = self.index.search(_query, _k, _candidates)
+        return {
+            "retrievalResults": [
+                self._result(_id, _score) for _id, _score in zip(_ids, _scores)
+            ]
+        }
@@ -0,0 +1,130 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module contains a small provisioning planner used to stand up teams of Amazon Bedrock agents.
+
+Each resource (an agent, a supervisor, ...) is described by a builder function and the names of the
+resources it depends on. provision() orders the resulting dependency graph and runs every builder
+as soon as all of its dependencies are built, so that independent agents are created concurrently
+instead of one after another.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List
+
+DEFAULT_PROVISIONING_CONCURRENCY = 4
+
+
+def plan_provisioning(depends_on: Dict[str, List[str]]) -> List[List[str]]:
+    """Orders a dependency graph into stages. Every resource of a stage only depends on
+    resources of earlier stages, so the resources of one stage can be built concurrently.
+
+    Args:
+        depends_on (Dict[str, List[str]]): name of each resource to the names of the resources it depends on
+
+    Returns:
+        List[List[str]]: the stages, in build order
+
+    Raises:
+        ValueError: if a dependency is unknown or the graph has a cycle
+    """
+    for _name, _deps in depends_on.items():
+        for _dep in _deps:
+            if _dep not in depends_on:
+                raise ValueError(f"'{_name}' depends on unknown resource '{_dep}'")
+
+    _stages = []
+    _placed = set()
+    while len(_placed) < len(depends_on):
+        _stage = [
+            _name
+            for _name, _deps in depends_on.items()
+            if _name not in _placed and all(_dep in _placed for _dep in _deps)
+        ]
+        if not _stage:
+            _remaining = sorted(set(depends_on) - _placed)
+            raise ValueError(f"Dependency cycle between: {', '.join(_remaining)}")
+        _stages.append(_stage)
+        _placed.update(_stage)
+    return _stages
+
+
+def provision(
+    builders: Dict[str, Callable[[Dict[str, Any]], Any]],
+    depends_on: Dict[str, List[str]] = None,
+    max_workers: int = DEFAULT_PROVISIONING_CONCURRENCY,
+    verbose: bool = False,
+) -> Dict[str, Any]:
+    """Builds a set of resources concurrently, respecting their dependencies. A builder starts as
+    soon as all of its own dependencies are built, without waiting for the rest of their stage.
+
+    Args:
+        builders (Dict[str, Callable]): name of each resource to the function that builds it. The function
+        receives a dict with the already built dependencies of that resource, keyed by name.
+        depends_on (Dict[str, List[str]], optional): name of a resource to the names of the resources
+        it depends on. Resources that are not listed have no dependencies.
+        max_workers (int, optional): maximum number of builders running at once. Defaults to DEFAULT_PROVISIONING_CONCURRENCY.
+        verbose (bool, optional): whether to print progress. Defaults to False.
+
+    Returns:
+        Dict[str, Any]: name of each resource to the value returned by its builder
+
+    Raises:
+        ValueError: if the dependency graph is invalid
+        The first error raised by a builder. Builders that have not started yet are skipped,
+        and builders already running are allowed to finish.
+    """
+    if depends_on is None:
+        depends_on = {}
+    _graph = {_name: list(depends_on.get(_name, [])) for _name in builders}
+    for _name in depends_on:
+        if _name not in builders:
+            raise ValueError(f"No builder for resource '{_name}'")
+    _stages = plan_provisioning(_graph)
+    if verbose:
+        for _stage_num, _stage in enumerate(_stages, 1):
+            print(f"Provisioning stage {_stage_num}: {', '.join(_stage)}")
+
+    _built = {}
+    _lock = threading.Lock()
+    _pending = dict(_graph)
+    _error = None
+
+    def _build(name: str) -> Any:
+        with _lock:
+            _deps = {_dep: _built[_dep] for _dep in _graph[name]}
+        if verbose:
+            print(f"Provisioning {name}...")
+        return builders[name](_deps)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as _executor:
+        _running = {}
+        while _pending or _running:
+            if _error is None:
+                for _name in [
+                    _name
+                    for _name, _deps in _pending.items()
+                    if all(_dep in _built for _dep in _deps)
+                ]:
+                    del _pending[_name]
+                    _running[_executor.submit(_build, _name)] = _name
+            if not _running:
+                break
+            _done, _ = wait(_running, return_when=FIRST_COMPLETED)
+            for _future in _done:
+                _name = _running.pop(_future)
+                if _future.exception() is not None:
+                    if _error is None:
+                        _error = _future.exception()
+                        print(f"Error provisioning {_name}: {_error}")
+                    continue
+                with _lock:
+                    _built[_name] = _future.result()
+                if verbose:
+                    print(f"Provisioned {_name}")
+
+    if _error is not None:
+        raise _error
+    return _built
@@ -0,0 +1,353 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module contains an opt-in cache of agent answers, used by AgentsForAmazonBedrock.invoke() and
+invoke_inline_agent() to answer repeated questions without calling Amazon Bedrock again.
+
+Answers are keyed by the target agent (agent id and alias, or a hash of the inline agent
+configuration), the input text and the session attributes. Only the first turn of a session is
+served from the cache: Amazon Bedrock keeps the conversation of a session, so the answer to a later
+turn ("yes", "tell me more") depends on the earlier ones. A SessionTracker remembers the sessions
+seen by the process for SESSION_MEMORY_TTL seconds, apart from the answers. Invocations that carry
+conversation state, such as return of control results, conversation history or files, are never
+cached either, and callers can bypass the cache explicitly with use_cache=False.
+
+A turn answered from the cache is not sent to Amazon Bedrock, so the session it opened has no record
+of it: a later turn of that session runs without the question and answer of the first one. Callers
+that continue conversations should start a new session after a cached answer, or pass
+use_cache=False on the first turn.
+
+The entries are kept by a backend: MemoryCacheBackend (per process), SQLiteCacheBackend (shared by
+the processes of a host) or RedisCacheBackend (shared by a fleet, with any Redis-compatible server).
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+DEFAULT_RESPONSE_CACHE_TTL = 300  # seconds an answer is served from the cache
+DEFAULT_RESPONSE_CACHE_MAX_ENTRIES = 1024
+DEFAULT_REDIS_KEY_PREFIX = "bedrock-agent-response:"
+# seconds a session is remembered as started: the maximum idle session TTL of Amazon Bedrock agents
+SESSION_MEMORY_TTL = 3600
+DEFAULT_SESSION_MEMORY_MAX_ENTRIES = 100000
+
+# session state that makes an answer depend on more than the input text
+STATEFUL_SESSION_KEYS = [
+    "returnControlInvocationResults",
+    "invocationId",
+    "conversationHistory",
+    "files",
+]
+# invokeInlineAgent parameters that do not change the answer of an inline agent
+_INLINE_PARAMS_NOT_IN_KEY = [
+    "inputText",
+    "sessionId",
+    "enableTrace",
+    "endSession",
+    "inlineSessionState",
+    "streamingConfigurations",
+]
+
+
+class CacheBackend(ABC):
+    """Stores cached answers. Subclasses implement get(), set(), delete() and clear()."""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """Returns the value of a key, or None if it is missing or expired."""
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: float) -> None:
+        """Stores a value for ttl seconds."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Removes a key, if present."""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Removes every entry."""
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process backend, evicting the least recently used entry beyond max_entries."""
+
+    def __init__(self, max_entries: int = DEFAULT_RESPONSE_CACHE_MAX_ENTRIES):
+        self._max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            _entry = self._entries.get(key)
+            if _entry is None:
+                return None
+            _value, _expires_at = _entry
+            if _expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return _value
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Backend stored in a SQLite file, so that the processes of a host share the cache.
+    The least recently used entries are evicted beyond max_entries."""
+
+    def __init__(
+        self, path: str, max_entries: int = DEFAULT_RESPONSE_CACHE_MAX_ENTRIES
+    ):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS response_cache_last_used "
+                "ON response_cache (last_used)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        _now = time.time()
+        with self._lock, self._conn:
+            _row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if _row is None:
+                return None
+            if _row[1] <= _now:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE response_cache SET last_used = ? WHERE key = ?", (_now, key)
+            )
+            return _row[0]
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        _now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)",
+                (key, value, _now + ttl, _now),
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE expires_at <= ?", (_now,)
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM response_cache")
+
+
+class RedisCacheBackend(CacheBackend):
+    """Backend for Redis or any Redis-compatible server (e.g. Amazon ElastiCache, Valkey).
+    Entries expire through the server TTL; configure the server with an LRU maxmemory-policy
+    (e.g. allkeys-lru) to bound its size."""
+
+    def __init__(
+        self,
+        client=None,
+        url: str = "redis://localhost:6379/0",
+        key_prefix: str = DEFAULT_REDIS_KEY_PREFIX,
+    ):
+        """Args:
+        client (optional): a redis.Redis compatible client. Defaults to a client for url,
+        which requires: pip install redis
+        url (str, optional): URL of the server, when no client is given
+        key_prefix (str, optional): prefix of the keys, to share a server with other data
+        """
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError(
+                    "RedisCacheBackend requires a client or: pip install redis"
+                ) from e
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self._key_prefix = key_prefix
+
+    def get(self, key: str) -> Optional[str]:
+        _value = self._client.get(self._key_prefix + key)
+        if isinstance(_value, bytes):
+            _value = _value.decode("utf-8")
+        return _value
+
+    def set(self, key: str, value: str, ttl: float) -> None:
+        self._client.set(self._key_prefix + key, value, ex=max(1, int(ttl)))
+
+    def delete(self, key: str) -> None:
+        self._client.delete(self._key_prefix + key)
+
+    def clear(self) -> None:
+        for _key in self._client.scan_iter(match=self._key_prefix + "*"):
+            self._client.delete(_key)
+
+
+class SessionTracker:
+    """Remembers the sessions that had a turn in this process, for SESSION_MEMORY_TTL seconds.
+    Kept apart from the cached answers, so that sessions never evict answers and the reverse.
+
+    Beyond max_entries, the least recently seen session is forgotten. Until that session would
+    have expired, sessions that are not remembered are treated as already started, so that a
+    forgotten session is never answered from the cache.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_SESSION_MEMORY_MAX_ENTRIES,
+        ttl: float = SESSION_MEMORY_TTL,
+    ):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._sessions: OrderedDict = OrderedDict()
+        self._forgotten_until = 0.0
+        self._lock = threading.Lock()
+
+    def start_turn(self, session_id: str) -> bool:
+        """Records a turn of a session, and returns whether it is known to be its first one."""
+        _now = time.monotonic()
+        with self._lock:
+            while self._sessions and next(iter(self._sessions.values())) <= _now:
+                self._sessions.popitem(last=False)
+            _known = session_id in self._sessions
+            self._sessions[session_id] = _now + self._ttl
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self._max_entries:
+                _, _expires_at = self._sessions.popitem(last=False)
+                self._forgotten_until = max(self._forgotten_until, _expires_at)
+            return not _known and self._forgotten_until <= _now
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+            self._forgotten_until = 0.0
+
+
+class ResponseCache:
+    """Cache of agent answers to the first turn of a session, keyed by target agent, input text and
+    session attributes."""
+
+    def __init__(
+        self,
+        backend: CacheBackend = None,
+        ttl: float = DEFAULT_RESPONSE_CACHE_TTL,
+        session_tracker: SessionTracker = None,
+    ):
+        """Args:
+        backend (CacheBackend, optional): where entries are kept. Defaults to a MemoryCacheBackend.
+        ttl (float, optional): seconds an answer is served. Defaults to DEFAULT_RESPONSE_CACHE_TTL.
+        session_tracker (SessionTracker, optional): remembers the sessions seen. Defaults to a
+        SessionTracker of DEFAULT_SESSION_MEMORY_MAX_ENTRIES sessions.
+        """
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.ttl = ttl
+        self.session_tracker = (
+            session_tracker if session_tracker is not None else SessionTracker()
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def is_cacheable(session_state: Dict) -> bool:
+        """Returns False for invocations that continue a stateful exchange, whose answer
+        depends on more than the input text and session attributes."""
+        return not any(
+            (session_state or {}).get(_key) for _key in STATEFUL_SESSION_KEYS
+        )
+
+    def start_turn(self, session_id: str) -> bool:
+        """Records a turn of a session, and returns whether it is the first one seen by the
+        cache. Later turns depend on the conversation kept by the session, and are not cached.
+        Called for every invocation, even those that do not use the cache."""
+        return self.session_tracker.start_turn(session_id)
+
+    @staticmethod
+    def agent_target(agent_id: str, agent_alias_id: str) -> str:
+        return f"agent:{agent_id}/{agent_alias_id}"
+
+    @staticmethod
+    def inline_agent_target(request_params: Dict) -> str:
+        """Returns a hash of the configuration of an inline agent: its instructions, model,
+        action groups, knowledge bases and so on, without the per-request parameters."""
+        _config = {
+            _key: _value
+            for _key, _value in request_params.items()
+            if _key not in _INLINE_PARAMS_NOT_IN_KEY
+        }
+        _digest = hashlib.sha256(
+            json.dumps(_config, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        return f"inline:{_digest}"
+
+    @staticmethod
+    def make_key(target: str, input_text: str, session_state: Dict = None) -> str:
+        _session_state = session_state or {}
+        _key = {
+            "target": target,
+            "input": input_text,
+            "sessionAttributes": _session_state.get("sessionAttributes", {}),
+            "promptSessionAttributes": _session_state.get(
+                "promptSessionAttributes", {}
+            ),
+        }
+        return hashlib.sha256(
+            json.dumps(_key, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            _answer = self.backend.get(key)
+        except Exception as e:
+            # a cache that is down must not fail the invocation
+            print(f"Error reading response cache: {e}")
+            _answer = None
+        if _answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return _answer
+
+    def put(self, key: str, answer: str) -> None:
+        try:
+            self.backend.set(key, answer, self.ttl)
+        except Exception as e:
+            print(f"Error writing response cache: {e}")
+
+    def clear(self) -> None:
+        self.backend.clear()
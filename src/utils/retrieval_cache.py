@@ -0,0 +1,159 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module contains a client-side cache of knowledge base retrievals, used by
+KnowledgeBasesForAmazonBedrock.retrieve() to skip the Retrieve round-trip of repeated lookups.
+
+Results are keyed by knowledge base id, normalized query text (case and spacing do not matter),
+metadata filter, number of results and search type. Identical lookups running at the same time are
+deduplicated: one of them calls Amazon Bedrock and the others wait for its results.
+
+Each knowledge base has a generation, part of every key. invalidate() replaces it once an ingestion
+job completes, so that results retrieved before the new documents were indexed are never served
+again. The generation is kept in the cache backend, so that the processes sharing a SQLite or Redis
+backend see each other's invalidations; a generation evicted from the backend is replaced by a new
+one, which only causes misses. Entries are kept by the backends of the response cache.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from .response_cache import CacheBackend, MemoryCacheBackend
+
+DEFAULT_RETRIEVAL_CACHE_TTL = 600  # seconds results are served from the cache
+# generations outlive the entries they key
+_GENERATION_TTL = 30 * 24 * 3600
+_GENERATION_KEY_PREFIX = "kb-generation:"
+_TRAILING_PUNCTUATION = " ?!.;,"
+
+
+def normalize_query(query: str) -> str:
+    """Returns the query lowercased, with collapsed spaces and without trailing punctuation."""
+    return re.sub(r"\s+", " ", query).strip(_TRAILING_PUNCTUATION).lower()
+
+
+class RetrievalCache:
+    """Cache of knowledge base retrieval results, invalidated per knowledge base."""
+
+    def __init__(
+        self,
+        backend: CacheBackend = None,
+        ttl: float = DEFAULT_RETRIEVAL_CACHE_TTL,
+    ):
+        """Args:
+        backend (CacheBackend, optional): where entries are kept. Defaults to a MemoryCacheBackend.
+        ttl (float, optional): seconds results are served. Defaults to DEFAULT_RETRIEVAL_CACHE_TTL.
+        """
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, threading.Event] = {}
+
+    def _generation(self, kb_id: str) -> str:
+        _key = _GENERATION_KEY_PREFIX + kb_id
+        _generation = self.backend.get(_key)
+        if _generation is None:
+            _generation = uuid.uuid4().hex
+            self.backend.set(_key, _generation, _GENERATION_TTL)
+        return _generation
+
+    def make_key(
+        self, kb_id: str, query: str, retrieval_configuration: Dict = None
+    ) -> str:
+        _config = (retrieval_configuration or {}).get("vectorSearchConfiguration", {})
+        _key = {
+            "kb": kb_id,
+            "generation": self._generation(kb_id),
+            "query": normalize_query(query),
+            "filter": _config.get("filter"),
+            "numberOfResults": _config.get("numberOfResults"),
+            "searchType": _config.get("overrideSearchType"),
+        }
+        return hashlib.sha256(
+            json.dumps(_key, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        try:
+            _results = self.backend.get(key)
+        except Exception as e:
+            # a cache that is down must not fail the retrieval
+            print(f"Error reading retrieval cache: {e}")
+            _results = None
+        if _results is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(_results)
+
+    def put(self, key: str, results: List[Dict]) -> None:
+        try:
+            self.backend.set(key, json.dumps(results, default=str), self.ttl)
+        except Exception as e:
+            print(f"Error writing retrieval cache: {e}")
+
+    def get_or_retrieve(
+        self,
+        kb_id: str,
+        query: str,
+        retrieval_configuration: Dict,
+        retrieve: Callable[[], List[Dict]],
+    ) -> List[Dict]:
+        """Returns the cached results of a lookup, or calls retrieve() once for all the
+        identical lookups running at the same time, and caches its results.
+
+        Args:
+            kb_id (str): knowledge base id
+            query (str): query text
+            retrieval_configuration (Dict): retrievalConfiguration of the Retrieve request
+            retrieve (Callable): returns the retrieval results on a miss
+
+        Returns:
+            List[Dict]: the retrieval results
+        """
+        try:
+            _key = self.make_key(kb_id, query, retrieval_configuration)
+        except Exception as e:
+            print(f"Error reading retrieval cache: {e}")
+            return retrieve()
+        while True:
+            _results = self.get(_key)
+            if _results is not None:
+                return _results
+            with self._lock:
+                _running = self._in_flight.get(_key)
+                if _running is None:
+                    _done = self._in_flight[_key] = threading.Event()
+                    break
+                self.deduplicated += 1
+            # the identical lookup running now caches its results, unless it fails
+            _running.wait()
+        try:
+            _results = retrieve()
+            self.put(_key, _results)
+            return _results
+        finally:
+            with self._lock:
+                del self._in_flight[_key]
+            _done.set()
+
+    def invalidate(self, kb_id: str) -> None:
+        """Stops serving the results retrieved so far from a knowledge base, e.g. once an
+        ingestion job changed its documents."""
+        try:
+            self.backend.set(
+                _GENERATION_KEY_PREFIX + kb_id, uuid.uuid4().hex, _GENERATION_TTL
+            )
+        except Exception as e:
+            print(f"Error invalidating retrieval cache of knowledge base {kb_id}: {e}")
+
+    def clear(self) -> None:
+        self.backend.clear()
@@ -0,0 +1,117 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module merges the results of several knowledge base retrievals into one ranking, used by
+KnowledgeBasesForAmazonBedrock.retrieve_many().
+
+The scores of different knowledge bases (and of semantic and hybrid searches) are not comparable,
+so lists are combined with reciprocal rank fusion: a chunk gets 1 / (rrf_k + rank) from every list
+it appears in, and the sum ranks it. A chunk returned by several queries or knowledge bases is kept
+once, identified by its source URI and text, and the results are compacted to the fields a prompt
+needs.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from .local_vector_store import SOURCE_URI_METADATA_KEY
+
+DEFAULT_RRF_K = 60  # the constant of the original reciprocal rank fusion paper
+
+
+@dataclass
+class FusedChunk:
+    """A chunk of the fused ranking. score is its reciprocal rank fusion score, best_score the best
+    score a knowledge base gave it; kb_ids and queries are the lookups that returned it.
+    """
+
+    text: str
+    source_uri: str = None
+    score: float = 0.0
+    best_score: float = None
+    kb_ids: List[str] = field(default_factory=list)
+    queries: List[str] = field(default_factory=list)
+    metadata: Dict = field(default_factory=dict)
+
+
+def source_uri(result: Dict) -> str:
+    """Returns the source URI of a retrieval result, whatever the type of its data source."""
+    _uri = result.get("metadata", {}).get(SOURCE_URI_METADATA_KEY)
+    if _uri:
+        return _uri
+    _location = result.get("location", {})
+    for _value in _location.values():
+        if isinstance(_value, dict):
+            for _key in ["uri", "url"]:
+                if _value.get(_key):
+                    return _value[_key]
+    return None
+
+
+def _chunk_key(result: Dict) -> Tuple[str, str]:
+    _text = result.get("content", {}).get("text", "")
+    return source_uri(result), hashlib.sha256(_text.encode("utf-8")).hexdigest()
+
+
+def fuse_results(
+    ranked_results: List[Tuple[str, str, List[Dict]]],
+    rrf_k: float = DEFAULT_RRF_K,
+    max_results: int = None,
+    max_chunks_per_source: int = None,
+) -> List[FusedChunk]:
+    """Fuses ranked retrieval results into a single ranking of distinct chunks.
+
+    Args:
+        ranked_results (List[Tuple[str, str, List[Dict]]]): (kb id, query, retrieval results best first)
+        of each lookup
+        rrf_k (float, optional): reciprocal rank fusion constant; higher values flatten the
+        advantage of top ranks. Defaults to DEFAULT_RRF_K.
+        max_results (int, optional): number of chunks returned. Defaults to all.
+        max_chunks_per_source (int, optional): chunks kept per source document, to diversify the
+        results. Defaults to no limit.
+
+    Returns:
+        List[FusedChunk]: the chunks, best first
+    """
+    _chunks: Dict[Tuple[str, str], FusedChunk] = {}
+    for _kb_id, _query, _results in ranked_results:
+        for _rank, _result in enumerate(_results, start=1):
+            _key = _chunk_key(_result)
+            _chunk = _chunks.get(_key)
+            if _chunk is None:
+                _chunk = _chunks[_key] = FusedChunk(
+                    text=_result.get("content", {}).get("text", ""),
+                    source_uri=_key[0],
+                    metadata=_result.get("metadata", {}),
+                )
+            _chunk.score += 1.0 / (rrf_k + _rank)
+            _score = _result.get("score")
+            if _score is not None and (
+                _chunk.best_score is None or _score > _chunk.best_score
+            ):
+                _chunk.best_score = _score
+            if _kb_id not in _chunk.kb_ids:
+                _chunk.kb_ids.append(_kb_id)
+            if _query not in _chunk.queries:
+                _chunk.queries.append(_query)
+
+    _ranking = sorted(
+        _chunks.values(),
+        key=lambda _chunk: (
+            _chunk.score,
+            _chunk.best_score if _chunk.best_score is not None else 0.0,
+        ),
+        reverse=True,
+    )
+    if max_chunks_per_source is not None:
+        _per_source: Dict[str, int] = {}
+        _diverse = []
+        for _chunk in _ranking:
+            _count = _per_source.get(_chunk.source_uri, 0)
+            if _chunk.source_uri is None or _count < max_chunks_per_source:
+                _per_source[_chunk.source_uri] = _count + 1
+                _diverse.append(_chunk)
+        _ranking = _diverse
+    return _ranking if max_results is None else _ranking[:max_results]
@@ -0,0 +1,268 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module synchronizes a local directory with an Amazon S3 prefix, typically the data source
+bucket of a knowledge base.
+
+Files are identified by the SHA-256 of their content. A manifest kept in a cache directory (one per
+local directory and destination, under SYNC_MANIFEST_DIR) remembers the hash, size and modification
+time of every uploaded file, so that later runs only hash the files that were touched and only upload
+the ones whose content changed. The hash is also
+stored as object metadata, so that a run without a manifest (e.g. on another machine) still skips
+objects that are already up to date. Uploads run concurrently, and large files use multipart uploads.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+DEFAULT_SYNC_CONCURRENCY = 16
+DEFAULT_MULTIPART_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+SYNC_MANIFEST_FILE = ".kb-sync-manifest.json"
+# manifests are kept out of the synchronized directories, which are often in a source tree
+SYNC_MANIFEST_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "bedrock-agents",
+    "kb-sync",
+)
+SHA256_METADATA_KEY = "sha256"
+DEFAULT_SYNC_EXCLUDE = [".DS_Store", ".*.swp"]
+_HASH_BLOCK_SIZE = 1024 * 1024
+_DELETE_BATCH_SIZE = 1000  # maximum number of keys of a DeleteObjects call
+
+
+@dataclass
+class SyncResult:
+    """Outcome of sync_directory_to_bucket(). Each list holds S3 keys."""
+
+    uploaded: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)
+    bytes_uploaded: int = 0
+
+    @property
+    def changed(self) -> bool:
+        """True if the bucket content changed, i.e. an ingestion job is needed."""
+        return bool(self.uploaded or self.deleted)
+
+
+def _file_sha256(path: str) -> str:
+    _hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for _block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            _hash.update(_block)
+    return _hash.hexdigest()
+
+
+def default_manifest_path(local_dir: str, bucket_name: str, prefix: str = "") -> str:
+    """Returns the manifest of a local directory and destination, in SYNC_MANIFEST_DIR."""
+    _key = hashlib.sha256(
+        f"{os.path.abspath(local_dir)}\n{bucket_name}\n{prefix}".encode("utf-8")
+    ).hexdigest()[:16]
+    return os.path.join(
+        SYNC_MANIFEST_DIR,
+        f"{os.path.basename(os.path.abspath(local_dir))}-{_key}{SYNC_MANIFEST_FILE}",
+    )
+
+
+def _load_manifest(manifest_path: str, bucket_name: str, prefix: str) -> Dict:
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r") as f:
+            _manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable sync manifest {manifest_path}: {e}")
+        return {}
+    if _manifest.get("bucket") != bucket_name or _manifest.get("prefix") != prefix:
+        # the manifest describes another destination
+        return {}
+    return _manifest.get("files", {})
+
+
+def _write_manifest(
+    manifest_path: str, bucket_name: str, prefix: str, files: Dict
+) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    _tmp_path = f"{manifest_path}.tmp"
+    with open(_tmp_path, "w") as f:
+        json.dump(
+            {"bucket": bucket_name, "prefix": prefix, "files": files},
+            f,
+            indent=1,
+            sort_keys=True,
+        )
+    os.replace(_tmp_path, manifest_path)
+
+
+def _list_objects(s3_client, bucket_name: str, prefix: str) -> Dict[str, Dict]:
+    _objects = {}
+    _paginator = s3_client.get_paginator("list_objects_v2")
+    for _page in _paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for _obj in _page.get("Contents", []):
+            _objects[_obj["Key"]] = _obj
+    return _objects
+
+
+def sync_directory_to_bucket(
+    s3_client,
+    local_dir: str,
+    bucket_name: str,
+    prefix: str = "",
+    delete_removed: bool = False,
+    exclude: List[str] = None,
+    manifest_path: str = None,
+    max_workers: int = DEFAULT_SYNC_CONCURRENCY,
+    multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD,
+    multipart_chunksize: int = DEFAULT_MULTIPART_CHUNKSIZE,
+    verbose: bool = False,
+) -> SyncResult:
+    """Uploads the new and changed files of a local directory tree to an S3 prefix.
+
+    Args:
+        s3_client: boto3 S3 client. Give it max_pool_connections of at least max_workers.
+        local_dir (str): root of the local tree; S3 keys are prefix + the path relative to it
+        bucket_name (str): destination bucket
+        prefix (str, optional): key prefix, e.g. "data/". Defaults to the bucket root.
+        delete_removed (bool, optional): whether to delete objects under prefix that no longer
+        exist locally. Defaults to False.
+        exclude (List[str], optional): glob patterns of file names or relative paths to skip.
+        Defaults to DEFAULT_SYNC_EXCLUDE.
+        manifest_path (str, optional): where the manifest is kept. Defaults to a file of
+        SYNC_MANIFEST_DIR named after local_dir, bucket_name and prefix. A manifest inside local_dir
+        is never uploaded.
+        max_workers (int, optional): files hashed and uploaded concurrently. Defaults to DEFAULT_SYNC_CONCURRENCY.
+        multipart_threshold (int, optional): size in bytes from which files use multipart uploads
+        multipart_chunksize (int, optional): size in bytes of each part of a multipart upload
+        verbose (bool, optional): whether to print each upload. Defaults to False.
+
+    Returns:
+        SyncResult: the uploaded, unchanged, deleted and failed keys
+    """
+    if exclude is None:
+        exclude = DEFAULT_SYNC_EXCLUDE
+    if manifest_path is None:
+        manifest_path = default_manifest_path(local_dir, bucket_name, prefix)
+    _manifest_abspath = os.path.abspath(manifest_path)
+    _previous = _load_manifest(manifest_path, bucket_name, prefix)
+
+    _local_files = {}
+    for _root, _, _files in os.walk(local_dir):
+        for _file in _files:
+            _path = os.path.join(_root, _file)
+            _rel_path = os.path.relpath(_path, local_dir).replace(os.sep, "/")
+            if os.path.abspath(_path) in [
+                _manifest_abspath,
+                f"{_manifest_abspath}.tmp",
+            ]:
+                continue
+            if any(
+                fnmatch.fnmatch(_file, _pattern) or fnmatch.fnmatch(_rel_path, _pattern)
+                for _pattern in exclude
+            ):
+                continue
+            _local_files[prefix + _rel_path] = _path
+
+    _remote = _list_objects(s3_client, bucket_name, prefix)
+    _result = SyncResult()
+    _manifest = {}
+    _transfer_config = TransferConfig(
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=multipart_chunksize,
+        # files are already uploaded concurrently, so each one uses few threads
+        max_concurrency=4,
+    )
+
+    def _sync_file(key: str, path: str) -> Tuple[Dict, bool]:
+        _stat = os.stat(path)
+        _entry = {"size": _stat.st_size, "mtime_ns": _stat.st_mtime_ns}
+        _known = _previous.get(key)
+        if (
+            _known is not None
+            and _known["size"] == _stat.st_size
+            and _known["mtime_ns"] == _stat.st_mtime_ns
+        ):
+            # untouched since the last sync: no need to read it again
+            _entry["sha256"] = _known["sha256"]
+        else:
+            _entry["sha256"] = _file_sha256(path)
+
+        _remote_obj = _remote.get(key)
+        if _remote_obj is not None and _remote_obj["Size"] == _stat.st_size:
+            if _known is not None and _known["sha256"] == _entry["sha256"]:
+                if _known.get("etag") == _remote_obj["ETag"]:
+                    _entry["etag"] = _remote_obj["ETag"]
+                    return _entry, False
+            try:
+                _head = s3_client.head_object(Bucket=bucket_name, Key=key)
+                if (
+                    _head.get("Metadata", {}).get(SHA256_METADATA_KEY)
+                    == _entry["sha256"]
+                ):
+                    _entry["etag"] = _head["ETag"]
+                    return _entry, False
+            except ClientError:
+                pass
+
+        if verbose:
+            print(f"uploading file {path} to s3://{bucket_name}/{key}")
+        s3_client.upload_file(
+            path,
+            bucket_name,
+            key,
+            ExtraArgs={"Metadata": {SHA256_METADATA_KEY: _entry["sha256"]}},
+            Config=_transfer_config,
+        )
+        _entry["etag"] = s3_client.head_object(Bucket=bucket_name, Key=key)["ETag"]
+        return _entry, True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as _executor:
+        _futures = {
+            _executor.submit(_sync_file, _key, _path): _key
+            for _key, _path in _local_files.items()
+        }
+        for _future, _key in _futures.items():
+            try:
+                _entry, _uploaded = _future.result()
+            except Exception as e:
+                print(
+                    f"Error syncing {_local_files[_key]} to s3://{bucket_name}/{_key}: {e}"
+                )
+                _result.failed[_key] = str(e)
+                continue
+            _manifest[_key] = _entry
+            if _uploaded:
+                _result.uploaded.append(_key)
+                _result.bytes_uploaded += _entry["size"]
+            else:
+                _result.unchanged.append(_key)
+
+    if delete_removed:
+        _removed = sorted(set(_remote) - set(_local_files))
+        for _start in range(0, len(_removed), _DELETE_BATCH_SIZE):
+            _batch = _removed[_start : _start + _DELETE_BATCH_SIZE]
+            _resp = s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={"Objects": [{"Key": _key} for _key in _batch], "Quiet": True},
+            )
+            _errors = {_err["Key"]: _err["Message"] for _err in _resp.get("Errors", [])}
+            _result.failed.update(_errors)
+            _result.deleted.extend(_key for _key in _batch if _key not in _errors)
+
+    _write_manifest(manifest_path, bucket_name, prefix, _manifest)
+    print(
+        f"Synced {local_dir} to s3://{bucket_name}/{prefix}: {len(_result.uploaded)} uploaded "
+        f"({_result.bytes_uploaded:,} bytes), {len(_result.unchanged)} unchanged, "
+        f"{len(_result.deleted)} deleted, {len(_result.failed)} failed"
+    )
+    return _result
@@ -0,0 +1,147 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module describes the OpenSearch Serverless vector index of a knowledge base.
+
+A VectorIndexProfile holds the settings that trade retrieval latency, recall and memory: the HNSW
+graph parameters (m, ef_construction, ef_search), the distance (space type), scalar quantization,
+and the shard and replica counts. VectorIndexProfile.for_embedding_model() sets the dimension that
+matches the embedding model of the knowledge base, since an index whose dimension differs from the
+embeddings makes every ingested document fail.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List
+
+# dimension of the vectors of each embedding model, and the other dimensions it supports
+EMBEDDING_MODEL_DIMENSIONS: Dict[str, List[int]] = {
+    "cohere.embed-multilingual-v3": [1024],
+    "cohere.embed-english-v3": [1024],
+    "amazon.titan-embed-text-v1": [1536],
+    "amazon.titan-embed-text-v2:0": [1024, 512, 256],
+}
+SPACE_TYPES = ["l2", "innerproduct", "cosinesimil"]
+# short names accepted for space_type
+_SPACE_TYPE_ALIASES = {"cosine": "cosinesimil", "dot_product": "innerproduct"}
+# quantization -> engine that supports it
+QUANTIZATION_ENGINES = {"fp16": "faiss", "byte": "lucene"}
+
+
+@dataclass
+class VectorIndexProfile:
+    """Settings of a knowledge base vector index. None for an HNSW parameter keeps the engine default.
+
+    quantization stores vectors as 16-bit floats ("fp16", faiss engine) or 8-bit integers ("byte",
+    lucene engine), which halves or quarters the memory of the index at some cost in recall.
+    """
+
+    dimension: int = 1024
+    space_type: str = "l2"
+    engine: str = "faiss"
+    m: int = None
+    ef_construction: int = None
+    ef_search: int = 512
+    quantization: str = None
+    number_of_shards: int = 1
+    number_of_replicas: int = 0
+
+    def __post_init__(self):
+        self.space_type = _SPACE_TYPE_ALIASES.get(self.space_type, self.space_type)
+        if self.space_type not in SPACE_TYPES:
+            raise ValueError(
+                f"Invalid space type {self.space_type}. It should be one of {SPACE_TYPES}"
+            )
+        if self.quantization is not None:
+            if self.quantization not in QUANTIZATION_ENGINES:
+                raise ValueError(
+                    f"Invalid quantization {self.quantization}. "
+                    f"It should be one of {list(QUANTIZATION_ENGINES)}"
+                )
+            _engine = QUANTIZATION_ENGINES[self.quantization]
+            if self.engine != _engine:
+                # the default engine is switched, an explicitly chosen one is an error
+                if self.engine != VectorIndexProfile.engine:
+                    raise ValueError(
+                        f"{self.quantization} quantization requires the {_engine} engine"
+                    )
+                self.engine = _engine
+        if self.dimension <= 0:
+            raise ValueError(f"Invalid dimension {self.dimension}")
+
+    @classmethod
+    def for_embedding_model(
+        cls, embedding_model: str, dimension: int = None, **settings
+    ) -> "VectorIndexProfile":
+        """Creates the profile of an index for the vectors of an embedding model.
+
+        Args:
+            embedding_model (str): id of the embedding model, one of EMBEDDING_MODEL_DIMENSIONS
+            dimension (int, optional): dimension of the vectors, for models supporting several.
+            Defaults to the default dimension of the model.
+            settings: other VectorIndexProfile fields, e.g. space_type="cosine", m=32
+
+        Returns:
+            VectorIndexProfile: the profile
+
+        Raises:
+            ValueError: if the model is unknown or does not support the dimension
+        """
+        if embedding_model not in EMBEDDING_MODEL_DIMENSIONS:
+            raise ValueError(
+                f"Unknown embedding model {embedding_model}. "
+                f"It should be one of {list(EMBEDDING_MODEL_DIMENSIONS)}"
+            )
+        _dimensions = EMBEDDING_MODEL_DIMENSIONS[embedding_model]
+        if dimension is None:
+            dimension = _dimensions[0]
+        elif dimension not in _dimensions:
+            raise ValueError(
+                f"{embedding_model} supports the dimensions {_dimensions}, not {dimension}"
+            )
+        return cls(dimension=dimension, **settings)
+
+    def method(self) -> Dict:
+        """Returns the knn_vector method of the index mapping."""
+        _parameters = {}
+        if self.m is not None:
+            _parameters["m"] = self.m
+        if self.ef_construction is not None:
+            _parameters["ef_construction"] = self.ef_construction
+        if self.quantization == "fp16":
+            _parameters["encoder"] = {"name": "sq", "parameters": {"type": "fp16"}}
+        elif self.quantization == "byte":
+            _parameters["encoder"] = {"name": "sq"}
+        _method = {"name": "hnsw", "engine": self.engine, "space_type": self.space_type}
+        if _parameters:
+            _method["parameters"] = _parameters
+        return _method
+
+    def index_body(
+        self,
+        vector_field: str = "vector",
+        text_field: str = "text",
+        metadata_field: str = "text-metadata",
+    ) -> Dict:
+        """Returns the settings and mappings used to create the index."""
+        _settings = {
+            "index.knn": "true",
+            "number_of_shards": self.number_of_shards,
+            "number_of_replicas": self.number_of_replicas,
+        }
+        if self.ef_search is not None:
+            _settings["knn.algo_param.ef_search"] = self.ef_search
+        return {
+            "settings": _settings,
+            "mappings": {
+                "properties": {
+                    vector_field: {
+                        "type": "knn_vector",
+                        "dimension": self.dimension,
+                        "method": self.method(),
+                    },
+                    text_field: {"type": "text"},
+                    metadata_field: {"type": "text"},
+                }
+            },
+        }
@@ -0,0 +1,126 @@
+# Copyright 2024 Amazon.com and its affiliates; all rights reserved.
+# This file is AWS Content and may not be duplicated or distributed without permission
+
+"""
+This module contains polling helpers used to wait for Amazon Bedrock resources (agents, aliases,
+knowledge bases, ingestion jobs, ...) to reach a stable state.
+
+poll_until() polls a single resource with exponential backoff and jitter, an overall deadline
+and optional cancellation. wait_for_all() runs several of those waits concurrently.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from typing import Any, Callable, Dict, Hashable
+
+DEFAULT_WAIT_TIMEOUT = 600  # seconds
+DEFAULT_INITIAL_DELAY = 1.0
+DEFAULT_MAX_DELAY = 15.0
+DEFAULT_BACKOFF = 1.5
+
+
+class WaitTimeoutError(TimeoutError):
+    """Raised when a resource does not reach the expected state before the deadline."""
+
+    def __init__(self, description: str, timeout: float, last_value: Any = None):
+        super().__init__(
+            f"Timed out after {timeout:,.1f}s waiting for {description}, last value: {last_value}"
+        )
+        self.last_value = last_value
+
+
+class WaitCancelledError(Exception):
+    """Raised when a wait is cancelled through its cancel_event."""
+
+
+def poll_until(
+    check: Callable[[], Any],
+    is_done: Callable[[Any], bool],
+    description: str = "resource",
+    timeout: float = DEFAULT_WAIT_TIMEOUT,
+    initial_delay: float = DEFAULT_INITIAL_DELAY,
+    max_delay: float = DEFAULT_MAX_DELAY,
+    backoff: float = DEFAULT_BACKOFF,
+    cancel_event: threading.Event = None,
+    on_poll: Callable[[Any], None] = None,
+) -> Any:
+    """Calls check() until is_done() accepts its result, sleeping between calls with exponential
+    backoff and jitter so that short transitions return quickly and long ones poll rarely.
+
+    Args:
+        check (Callable): returns the current value of the resource, e.g. its status
+        is_done (Callable): returns True when the value is final
+        description (str, optional): what is being waited on, used in error messages
+        timeout (float, optional): overall deadline in seconds. Defaults to DEFAULT_WAIT_TIMEOUT.
+        initial_delay (float, optional): first delay between polls, in seconds
+        max_delay (float, optional): upper bound for the delay between polls, in seconds
+        backoff (float, optional): factor applied to the delay after each poll
+        cancel_event (threading.Event, optional): set it from another thread to stop waiting
+        on_poll (Callable, optional): called with each value that is not final yet
+
+    Returns:
+        Any: the final value returned by check()
+
+    Raises:
+        WaitTimeoutError: if the deadline passes first
+        WaitCancelledError: if cancel_event is set first
+    """
+    _deadline = time.monotonic() + timeout
+    _delay = initial_delay
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            raise WaitCancelledError(f"Cancelled waiting for {description}")
+        _value = check()
+        if is_done(_value):
+            return _value
+        if on_poll is not None:
+            on_poll(_value)
+
+        _remaining = _deadline - time.monotonic()
+        if _remaining <= 0:
+            raise WaitTimeoutError(description, timeout, _value)
+        # "equal jitter": sleep at least half the delay, so concurrent waiters spread out
+        _sleep = min(_delay / 2 + random.uniform(0, _delay / 2), _remaining)
+        if cancel_event is not None:
+            if cancel_event.wait(_sleep):
+                raise WaitCancelledError(f"Cancelled waiting for {description}")
+        else:
+            time.sleep(_sleep)
+        _delay = min(_delay * backoff, max_delay)
+
+
+def wait_for_all(
+    waits: Dict[Hashable, Callable[[threading.Event], Any]],
+    max_workers: int = None,
+    cancel_event: threading.Event = None,
+) -> Dict[Hashable, Any]:
+    """Runs several waits concurrently and returns once all of them are done.
+
+    Args:
+        waits (Dict[Hashable, Callable]): key to a function that performs one wait. Each function
+        receives the shared cancel event, and should pass it on to poll_until().
+        max_workers (int, optional): maximum number of waits in flight. Defaults to one per wait.
+        cancel_event (threading.Event, optional): set it from another thread to stop all waits
+
+    Returns:
+        Dict[Hashable, Any]: key to the value returned by its wait
+
+    Raises:
+        The first error raised by any wait. The remaining waits are cancelled.
+    """
+    if not waits:
+        return {}
+    if cancel_event is None:
+        cancel_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=max_workers or len(waits)) as _executor:
+        _futures = {
+            _executor.submit(_wait, cancel_event): _key for _key, _wait in waits.items()
+        }
+        _done, _ = wait(_futures, return_when=FIRST_EXCEPTION)
+        for _future in _done:
+            if _future.exception() is not None:
+                cancel_event.set()
+                raise _future.exception()
+        return {_futures[_future]: _future.result() for _future in _futures}
@@ -0,0 +1,35 @@
+import json
+from typing import Any, Dict
+
+from src.utils.bedrock_agent_helper import AgentsForAmazonBedrock
+from src.utils.local_tools import load_lambda_handler
+
+
+def lookup(order_id: str, quantity: int = 1) -> Dict[str, Any]:
+    return {"order_id": order_id, "quantity": quantity, "raw": json.dumps(order_id)}
+
+
+def test_generated_lambda_file_imports_and_dispatches(tmp_path):
+    # create_lambda_file() uses no AWS client
+    _agents = object.__new__(AgentsForAmazonBedrock)
+    _path = _agents.create_lambda_file(lookup, output_dir=str(tmp_path))
+
+    _handler = load_lambda_handler(_path)
+    _response = _handler(
+        {
+            "messageVersion": "1.0",
+            "actionGroup": "orders",
+            "function": "lookup",
+            "parameters": [
+                {"name": "order_id", "type": "string", "value": "A-1"},
+                {"name": "quantity", "type": "integer", "value": "3"},
+            ],
+            "sessionAttributes": {},
+            "promptSessionAttributes": {},
+        },
+        None,
+    )
+
+    _body = _response["response"]["functionResponse"]["responseBody"]["TEXT"]["body"]
+    assert _response["response"]["function"] == "lookup"
+    assert json.loads(_body) == {"order_id": "A-1", "quantity": 3, "raw": '"A-1"'}
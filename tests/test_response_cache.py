@@ -0,0 +1,49 @@
+import pytest
+
+from src.utils.response_cache import (
+    CacheBackend,
+    MemoryCacheBackend,
+    ResponseCache,
+    SessionTracker,
+)
+
+
+def test_sessions_do_not_evict_answers():
+    cache = ResponseCache(MemoryCacheBackend(max_entries=4))
+    key = ResponseCache.make_key("agent:a/b", "question")
+    assert cache.start_turn("s0")
+    cache.put(key, "answer")
+
+    for i in range(1, 10):
+        cache.start_turn(f"s{i}")
+
+    assert cache.get(key) == "answer"
+
+
+def test_forgotten_session_is_not_a_first_turn():
+    cache = ResponseCache(session_tracker=SessionTracker(max_entries=4))
+    assert cache.start_turn("s1")
+    assert not cache.start_turn("s1")
+
+    for i in range(2, 7):
+        assert cache.start_turn(f"s{i}") == (i <= 4)
+
+    # s1 was forgotten: neither it nor any unknown session counts as a first turn
+    assert not cache.start_turn("s1")
+    assert not cache.start_turn("new")
+
+
+def test_forgotten_sessions_expire():
+    tracker = SessionTracker(max_entries=1, ttl=0)
+    assert tracker.start_turn("s1")
+    assert tracker.start_turn("s2")
+    assert tracker.start_turn("s1")
+
+
+def test_cache_backend_is_abstract():
+    class Incomplete(CacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()